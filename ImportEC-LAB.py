@@ -21,719 +21,2972 @@
 # Start of the project: 15-04-2022
 # Last modification: 06-02-2023
 #
-# This software is a plugin for the Veusz software.
+# This software is a plugin for the Veusz software. Its import functions also work
+# without Veusz, as a library or through convert_eclab.py.
 
 
 
-from veusz.plugins import ImportPlugin, importpluginregistry
+import sys
 
 
 
 
 
+# ##### BEGIN VEUSZ PLUGIN API #####
+# Veusz is only imported when it runs the plugin, and has then already loaded its
+# plugin API. Otherwise (scripts, convert_eclab.py) the plugins run on the stand-ins
+# below and nothing is registered.
 
+class HeadlessImportPlugin:
+    """ Stand-in for the ImportPlugin of Veusz, when the plugins are used without Veusz.
+    """
+    def __init__(self):
+        self.fields = []
 
+    def getPreview(self, params):
+        return ("", False)
 
 
-class ImportECLAB_CV(ImportPlugin):
-    name = "EC-LAB CV"
-    author = "Arthur Langlard"
-    description = "Imports cyclic voltammetry measurements from EC-LAB files."
-    descriptor = "Cyclic Voltammetry\n"
 
-    # Comment this line to remove the tab of the plugin
-    promote_tab = 'EC-LAB CV'
-    file_extensions = set(['.mpt', '.MPT'])
+class HeadlessField:
+    """ Stand-in for the import fields of Veusz: only the name, the description and
+    the default value of the field are used without the dialog.
+    """
+    default_value = None
 
-    class HeaderInfo:
-        m_header_lines = []
-        m_header_names_str = ['Reference electrode :',
-                              'Electrode surface area :',
-                              'Characteristic mass :',
-                              'dE/dt',
-                              'dE/dt unit',
-                              ]
+    def __init__(self, name, descr=None, default=None, **options):
+        self.name = name
+        self.descr = descr
+        self.default = self.default_value if default is None else default
+        self.options = options
 
-        m_header_names = ["reference_electrode",
-                          "surface",
-                          "mass",
-                          "scan_rate",
-                          "scan_rate_unit",
-                          "offset_voltage_vs_SHE",
-                          "surface_unit",
-                          "mass_unit",
-                          ]
+class HeadlessFieldCheck(HeadlessField):
+    default_value = False
 
-        m_header_string = ""
+class HeadlessFieldText(HeadlessField):
+    default_value = ""
 
-        m_header_infos = {}
+class HeadlessFieldInt(HeadlessField):
+    default_value = 0
 
-        def __init__(self, header_lines):
-            self.m_header_lines = header_lines
-            self.m_header_string = ''.join(self.m_header_lines)
-            extracted_parameters = []
+class HeadlessFieldFloat(HeadlessField):
+    default_value = 0.0
 
-            for name in self.m_header_names_str:
-                extracted_parameters.append(self.extract_parameter_from_string(name).strip())
+class HeadlessFieldCombo(HeadlessField):
+    pass
 
-            if not extracted_parameters[0] == "": # If the reference electrode was specified.
-                index_of_offset_voltage = [i for i, _ in enumerate(extracted_parameters[0]) if extracted_parameters[0].startswith("(", i)][-1]
-                offset_voltage_vs_SHE = float(extracted_parameters[0][index_of_offset_voltage + 1: -2].replace(",", "."))
-                ref_electrode_str = extracted_parameters[0][:index_of_offset_voltage - 1]
-            else:
-                offset_voltage_vs_SHE = 0.0
-                ref_electrode_str = "NHE"
-                
-            surface, surface_unit = extracted_parameters[1].split(" ")
-            surface = float(surface.replace(",", "."))
-            mass, mass_unit = extracted_parameters[2].split(" ")
-            mass = float(mass.replace(",", "."))
-            scan_rate = float(extracted_parameters[3].replace(",", "."))
-            scan_rate_unit = extracted_parameters[4]
 
-            parameters = [ref_electrode_str,
-                          surface,
-                          mass,
-                          scan_rate,
-                          scan_rate_unit,
-                          offset_voltage_vs_SHE,
-                          surface_unit,
-                          mass_unit,
-                          ]
 
-            self.m_header_infos = dict(zip(self.m_header_names, parameters))
+class HeadlessDataset1D:
+    """ Stand-in for the ImportDataset1D of Veusz: a name and the array of its values.
+    """
+    def __init__(self, name, data=None, serr=None, perr=None, nerr=None):
+        self.name = name
+        self.data = data
+        self.serr = serr
+        self.perr = perr
+        self.nerr = nerr
+
+
+
+if "veusz.plugins" in sys.modules:
+    from veusz.plugins import (ImportPlugin, ImportDataset1D, ImportFieldCheck, ImportFieldCombo, ImportFieldFloat,
+                               ImportFieldInt, ImportFieldText, importpluginregistry)
+else:
+    ImportPlugin = HeadlessImportPlugin
+    ImportDataset1D = HeadlessDataset1D
+    ImportFieldCheck = HeadlessFieldCheck
+    ImportFieldCombo = HeadlessFieldCombo
+    ImportFieldFloat = HeadlessFieldFloat
+    ImportFieldInt = HeadlessFieldInt
+    ImportFieldText = HeadlessFieldText
+    importpluginregistry = []
+
+# ##### END VEUSZ PLUGIN API #####
+
+
 
-        def extract_parameter_from_string(self, name):
-            parameter_found = False
-            for line in self.m_header_lines:
-                if name in line:
-                    parameter_found = True
-                    return line.rstrip().split(name)[-1]
-            
-            if not parameter_found:
-                return ""
 
 
+class ImportProfile:
+    """ Wall time, rows and memory of the stages of an import (decoding, header,
+    tokenizing, float conversion, splitting...), recorded when the "profile" field is set.
+    A stage run several times, once per chunk for instance, is recorded once with
+    the sums of its runs. The memory is traced with tracemalloc, which slows down the
+    allocation of Python objects: allocated_bytes sums the memory allocated at the
+    peak of each run, peak_bytes is the largest of them.
+    """
+    def __init__(self, filename):
+        import time
+        import tracemalloc
 
+        self.m_filename = str(filename)
+        self.m_stages = {}
+        self.m_open_stages = []    # ProfileStage contexts running, outermost first.
+        self.m_own_tracing = not tracemalloc.is_tracing()
+        if self.m_own_tracing:
+            tracemalloc.start()
+        self.m_start = time.perf_counter()
 
+    def record(self, name):
+        if name not in self.m_stages:
+            self.m_stages[name] = {"seconds": 0.0, "calls": 0, "rows": 0, "allocated_bytes": 0, "peak_bytes": 0}
+        return self.m_stages[name]
 
-    def parse_header_data(self, file):
-        """ Separate the file into the header part and the data part.
+    def finish(self):
+        """ Stop tracing the memory and return the stages as a dict.
         """
+        import time
+        import tracemalloc
+
+        total_seconds = time.perf_counter() - self.m_start
+        if self.m_own_tracing:
+            tracemalloc.stop()
+        return {"filename": self.m_filename,
+                "total_seconds": total_seconds,
+                "stages": dict((name, dict(stage)) for name, stage in self.m_stages.items()),
+                }
+
+
+
+class ProfileStage:
+    """ Context recording one run of a stage in the profile of the current import.
+    It gives the record of the stage, where the rows processed are added.
+    Without profile, nothing is measured.
+    Stages may be nested ("index" runs "tokenize" and "convert"): an inner stage
+    resets the peak of tracemalloc, so it first saves the peak reached so far in the
+    stages around it, which take it into account when they end.
+    """
+    def __init__(self, name):
+        self.m_profile = current_profile.get()
+        self.m_record = {"rows": 0} if self.m_profile is None else self.m_profile.record(name)
+
+    def __enter__(self):
+        if self.m_profile is not None:
+            import time
+            import tracemalloc
+
+            memory, peak = tracemalloc.get_traced_memory()
+            for stage in self.m_profile.m_open_stages:
+                stage.m_peak = max(stage.m_peak, peak)
+            self.m_profile.m_open_stages.append(self)
+
+            self.m_memory = memory
+            self.m_peak = memory
+            tracemalloc.reset_peak()
+            self.m_start = time.perf_counter()
+        return self.m_record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.m_profile is not None:
+            import time
+            import tracemalloc
+
+            seconds = time.perf_counter() - self.m_start
+            peak = max(tracemalloc.get_traced_memory()[1], self.m_peak)
+            self.m_profile.m_open_stages.remove(self)
+            self.m_record["seconds"] += seconds
+            self.m_record["calls"] += 1
+            self.m_record["allocated_bytes"] += peak - self.m_memory
+            self.m_record["peak_bytes"] = max(self.m_record["peak_bytes"], peak - self.m_memory)
+        return False
+
+
+
+class CurrentProfile:
+    """ Profile of the import running in the current thread, if any.
+    """
+    def __init__(self):
+        import threading
+        self.m_local = threading.local()
 
-        output = [None,None]
-        flag_Is_correct_file = (file.readline() == "EC-Lab ASCII FILE\n")
-        if not flag_Is_correct_file:
-            raise ValueError('Not a EC-LAB file.')
-        
-        
-
-        if flag_Is_correct_file:
-
-            line = ''
-            prevLine = ''
-            line_no = 1 # The first line (no. 0) has already been read.
-            header_lines = []
-            data_lines = []
-
-            while not "Nb header lines" in line: # Search for the length of the header.
-                line = file.readline()
-                line_no += 1
-            length_header = int(line.split(":")[-1])
-
-            file.readline()
-            line_no += 1
-            if not (file.readline() == self.descriptor):
-                raise ValueError('Not a Cyclic Voltammetry file.')
-            else:
-                header_lines.append(self.descriptor)
-            line_no += 1
+    def get(self):
+        return getattr(self.m_local, "profile", None)
 
-            while line_no < length_header - 1:    # Parse the header.
-                header_lines.append(file.readline())
-                line_no += 1
+    def set(self, profile):
+        self.m_local.profile = profile
 
-            while not line == '':   # Parse the data part.
-                line = file.readline()
-                data_lines.append(line)
-                line_no += 1
+current_profile = CurrentProfile()
 
-            data_lines.pop()    # Remove the last empty string.
 
-            output = header_lines, data_lines
-        return output
 
+def start_profile(params):
+    """ Start recording the stages of an import in the current thread, if the
+    "profile" field is set. Return the profile or None.
+    """
+    profile = ImportProfile(params.filename) if params.field_results["profile"] else None
+    current_profile.set(profile)
+    return profile
 
 
 
+def finish_profile(profile):
+    """ Stop recording an import and log its stages.
+    Return the stages as a dict, or None if the import was not profiled.
+    """
+    import logging
 
-    def split_cycles(self, data_header, data_Np, do_split=False):
-        import numpy as np
-        cycle_index = data_header.index("cycle number")
-        cycle_no = int(data_Np[0, cycle_index])
+    current_profile.set(None)
+    if profile is None:
+        return None
 
-        if not do_split:
-            return [data_header], [data_Np]
+    results = profile.finish()
+    logger = logging.getLogger("ImportEC-LAB")
+    logger.info("Import of %s: %.3f s", results["filename"], results["total_seconds"])
+    for name, stage in results["stages"].items():
+        logger.info("  %-10s %9.3f s %6d calls %10d rows %10.1f MB allocated %10.1f MB peak",
+                    name, stage["seconds"], stage["calls"], stage["rows"],
+                    stage["allocated_bytes"] / 1e6, stage["peak_bytes"] / 1e6)
+    return results
 
-        else:
 
-            #     Cycle 1          ,      Cycle 2 ...
-            # [[point, point, ...] , [point, point, ...]]
-            Cycles = [[]]
-            cycles_nos = [cycle_no]
 
-            for data_point in data_Np:
-                if int(data_point[cycle_index]) == cycle_no:
-                    Cycles[cycle_no - 1].append(list(data_point))
-                else:
-                    Cycles.append([list(data_point)])
-                    cycle_no += 1
-                    cycles_nos.append(cycle_no)
 
-            Cycles_np = []
-            Data_headers = []
 
-            for cycle_list, cycle_no in zip(Cycles, cycles_nos):
-                Cycles_np.append(np.array(cycle_list, dtype=float))
-                header_with_cycle_no = [str(name) + " (" + str(cycle_no) + ")" for name in data_header]
-                Data_headers.append(header_with_cycle_no)
 
-        return Data_headers, Cycles_np
+def parse_data_block(data_block, nb_columns, usecols=None):
+    """ Convert the data part of an EC-Lab file into a float array.
+    The data part is given as text or as raw bytes: the numbers are ASCII in all the
+    encodings of EC-Lab files, so bytes are converted without being decoded.
+    The decimal commas are replaced once on the whole buffer. Only the columns of
+    usecols (indices in the file, in increasing order) are converted, all of them
+    by default.
+    """
+    import io
+    import numpy as np
 
+    with ProfileStage("tokenize"):
+        if isinstance(data_block, (bytes, bytearray)):
+            data_block = bytes(data_block).replace(b',', b'.').strip()
+            data_lines = io.BytesIO(data_block)
+        else:
+            if not isinstance(data_block, str):
+                data_block = ''.join(data_block)
+            data_block = data_block.replace(',', '.').strip()
+            data_lines = data_block.splitlines()
 
+    if usecols is not None and len(usecols) == nb_columns:
+        usecols = None    # All the columns: the number of values of each row is checked.
 
+    nb_converted = nb_columns if usecols is None else len(usecols)
+    if len(data_block) == 0:
+        return np.empty((0, nb_converted))
 
+    # loadtxt splits the lines into fields while converting them.
+    with ProfileStage("convert") as stage:
+        try:
+            data_Np = np.loadtxt(data_lines, dtype=float, delimiter='\t', usecols=usecols, ndmin=2)
+        except ValueError as error:
+            raise ValueError('Malformed data in EC-LAB file.') from error
+        stage["rows"] += len(data_Np)
 
-    def __init__(self):
-        from veusz.plugins import ImportPlugin, ImportFieldCheck, ImportFieldFloat, ImportFieldCombo
+    if data_Np.shape[1] != nb_converted:
+        raise ValueError('Malformed data in EC-LAB file.')
 
-        ImportPlugin.__init__(self)
+    return data_Np
 
-        self.fields = [
-            ImportFieldCheck("extract_cycles", descr="Import cycles as separate datasets."),
-            ImportFieldCheck("import_all_data", descr="Import misc. data."),
 
-            ImportFieldCheck("change_surface", descr="Define a surface"),
-            ImportFieldFloat("surface", descr="Surface", default=1.0),
-            ImportFieldCombo("surface_unit", descr="Surface unit", items=("m2", "cm2", "mm2"),
-                             editable=False, default="cm2"),
 
-            ImportFieldCheck("change_mass", descr="Define a mass"),
-            ImportFieldFloat("mass", descr="Mass", default=1.0),
-            ImportFieldCombo("mass_unit", descr="Mass unit", items=("g", "mg", "ng"),
-                             editable=False, default="mg")
-            ]
 
 
+ASCII_DATA_CHARACTERS = "0123456789+-.,Ee\t\r\n "
 
+def ascii_data(encoding):
+    """ Whether the numbers of the data part are stored as ASCII in an encoding, as in
+    UTF-8 and the 8-bit encodings of EC-Lab files (latin-1, cp1252...). The data part
+    is then read and converted as raw bytes, and positions in it are byte offsets.
+    """
+    try:
+        return ASCII_DATA_CHARACTERS.encode(encoding) == ASCII_DATA_CHARACTERS.encode('ascii')
+    except (LookupError, UnicodeError, TypeError):
+        return False
 
-    def import_dataset(self, params):
-        import numpy as np
 
-        f = params.openFileWithEncoding()
-        try:
-            header_lines, data_lines = self.parse_header_data(f)
-        except ValueError:
-            raise
 
-        data_header = data_lines[0].split('\t')[:-1]    # Remove the last character (end of line '\n').
-        lines_list = []
-        for line in data_lines[1:]:
-            lines_list.append(line.replace(',', '.').split('\t'))
+COMPRESSED_EXTENSIONS = ('.gz', '.xz', '.zst', '.zip')
 
-        data_Np = np.array(lines_list, dtype=float)
+def compression(filename):
+    """ The compression of a file from its extension ('.gz', '.xz', '.zst' or '.zip'),
+    None if it is not compressed.
+    """
+    import os
 
-        if not params.field_results["import_all_data"]:
-            misc_data = ['mode',
-                        'ox/red',
-                        'error',
-                        'control changes',
-                        'counter inc.',
-                        'I Range',
-                        ]
+    extension = os.path.splitext(str(filename))[1].lower()
+    return extension if extension in COMPRESSED_EXTENSIONS else None
 
-            misc_data_indices = [data_header.index(misc_item) for misc_item in misc_data]
-            data_header = [name for name in data_header if name not in misc_data]
-            data_Np = np.delete(data_Np, misc_data_indices, axis=1)
-        
-        MyHeader = self.HeaderInfo(header_lines)
 
-        return MyHeader, data_header, data_Np
 
+# Extensions of the files offered by the plugins: text exports, binary files and compressed files.
+ECLAB_EXTENSIONS = set(['.mpt', '.MPT', '.mpr', '.MPR', '.gz', '.GZ', '.xz', '.XZ', '.zst', '.ZST', '.zip', '.ZIP'])
 
 
-    def getPreview(self, params):
-        import numpy as np
-        try:
-            MyHeader, data_header, data_Np = self.import_dataset(params)
-        except ValueError:
-            return ("File cannot be displayed", False)
 
-        header_string = MyHeader.m_header_string
-        data_header_string = '\t'.join(data_header)
-        data_string = "\n"
-        max_data_len = 20
-        if len(data_Np) < max_data_len:
-            max_data_len = len(data_Np) - 1
-        for data_line in data_Np[:max_data_len]:
-            for value in data_line:
-                data_string = data_string + "{:.4e}".format(value) + "\t"
-            data_string = data_string + "\n"
+def open_eclab_file(params):
+    """ Open the file of an import as text, with the encoding of the import.
+    A compressed file is decompressed as it is read, without temporary file: reading
+    only the header decompresses only the first blocks. A .zip archive is read from
+    its first .mpt file. The other files are opened by params.openFileWithEncoding.
+    """
+    import io
 
-        return (header_string + data_header_string + data_string, True)
+    kind = compression(params.filename)
+    if kind is None:
+        return params.openFileWithEncoding()
 
+    if kind == '.gz':
+        import gzip
+        return gzip.open(params.filename, 'rt', encoding=params.encoding, errors='replace')
 
+    if kind == '.xz':
+        import lzma
+        return lzma.open(params.filename, 'rt', encoding=params.encoding, errors='replace')
 
-    def doImport(self, params):
-        from veusz.plugins import ImportDataset1D
-        import numpy as np
-        """Actually imports data.
-        params is a ImportPluginParams object.
-        Return a list of ImportDataset1D objects.
-        """
+    if kind == '.zst':
+        try:
+            from compression import zstd    # Python 3.14 and later.
+            return zstd.open(params.filename, 'rt', encoding=params.encoding, errors='replace')
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('Reading .zst files needs the zstandard package.')
+        stream = zstandard.ZstdDecompressor().stream_reader(open(params.filename, 'rb'), closefd=True)
+        return io.TextIOWrapper(io.BufferedReader(stream), encoding=params.encoding, errors='replace')
 
-        MyHeader, data_header, data_Np = self.import_dataset(params)
+    import zipfile
+    with zipfile.ZipFile(params.filename) as archive:
+        names = [name for name in archive.namelist() if name.lower().endswith('.mpt')]
+        if len(names) == 0:
+            raise ValueError('No EC-LAB file in the archive.')
+        # The file of the archive stays open until the member is closed.
+        member = archive.open(names[0])
+    return io.TextIOWrapper(member, encoding=params.encoding, errors='replace')
 
 
-        # Add generated values to the data table.
-        if params.field_results["change_surface"]:
-            MyHeader.m_header_infos["surface"] = params.field_results["surface"]
-            MyHeader.m_header_infos["surface_unit"] = params.field_results["surface_unit"]
-        surface = MyHeader.m_header_infos["surface"]
 
-        if params.field_results["change_mass"]:
-            MyHeader.m_header_infos["mass"] = params.field_results["mass"]
-            MyHeader.m_header_infos["mass_unit"] = params.field_results["mass_unit"]
-        mass = MyHeader.m_header_infos["mass"]
-
-        intensity_index = data_header.index("<I>/mA")
-        charge_index = data_header.index("(Q-Qo)/C")
-        dataset_i_per_surface = np.array([intensity / surface for intensity in data_Np[:, intensity_index] ])
-        dataset_Q_per_mass = np.array([charge / mass for charge in data_Np[:, charge_index] ])
-
-        data_header.append("<I>_per_surf/mA/" + MyHeader.m_header_infos["surface_unit"])
-        data_Np = np.c_[data_Np, dataset_i_per_surface]
-        data_header.append("(Q-Qo)_per_mass/C/" + MyHeader.m_header_infos["mass_unit"])
-        data_Np = np.c_[data_Np, dataset_Q_per_mass]
-        data_header.append("(Q-Qo)/mA.h")
-        data_Np = np.c_[data_Np, np.array([charge / 3.6 for charge in data_Np[:, charge_index] ])]
-        data_header.append("(Q-Qo)_per_mass/mA.h/" + MyHeader.m_header_infos["mass_unit"])
-        data_Np = np.c_[data_Np, np.array([charge / 3.6 for charge in dataset_Q_per_mass ])]
-        generated_datasets_single_values = [ImportDataset1D("mass/" + MyHeader.m_header_infos["mass_unit"],
-                                              mass),
-                                          ImportDataset1D("surface/" + MyHeader.m_header_infos["surface_unit"],
-                                                          surface),
-                                          ImportDataset1D("scan_rate/" + MyHeader.m_header_infos["scan_rate_unit"],
-                                                          MyHeader.m_header_infos["scan_rate"]),
-                                          ImportDataset1D("offset_voltage/VvsNHE",
-                                                          MyHeader.m_header_infos["offset_voltage_vs_SHE"]),
-                                          ]
 
 
+def read_technique_line(file):
+    """ Read the first lines of an EC-Lab file, up to the line naming its technique.
+    Return the number of lines of the header, the number of lines read and the
+    technique line, as the descriptor of the plugins.
+    """
+    if not (file.readline() == "EC-Lab ASCII FILE\n"):
+        raise ValueError('Not a EC-LAB file.')
 
-        # Split data into separate cyles.
-        Data_headers, Cycles_np = self.split_cycles(data_header, data_Np, params.field_results["extract_cycles"])
-        imported_datasets = []
+    line = ' '
+    line_no = 1 # The first line (no. 0) has already been read.
 
-        for data_header, data_Np in zip(Data_headers, Cycles_np):
-            labeled_datasets = zip(data_header, data_Np.T)
-            imported_datasets = imported_datasets + [ImportDataset1D(*data) for data in labeled_datasets]
+    while not "Nb header lines" in line: # Search for the length of the header.
+        line = file.readline()
+        line_no += 1
+        if line == '':
+            raise ValueError('Not a EC-LAB file.')
+    length_header = int(line.split(":")[-1])
+
+    file.readline()
+    line_no += 1
+    technique_line = file.readline()
+    line_no += 1
+    return length_header, line_no, technique_line
+
+
+
+def read_header_lines(file, descriptor, error_message):
+    """ Read the header part of an EC-Lab file, of the technique of descriptor (of
+    any technique if descriptor is None).
+    The file is left positioned on the line holding the names of the data columns.
+    """
+    length_header, line_no, technique_line = read_technique_line(file)
+    if descriptor is not None and not (technique_line == descriptor):
+        raise ValueError(error_message)
+    header_lines = [technique_line]
+
+    while line_no < length_header - 1:    # Parse the header.
+        header_lines.append(file.readline())
+        line_no += 1
+
+    return header_lines
+
+
+
+def read_descriptor(params):
+    """ The technique line of the file of an import, reading only the first lines of
+    its header. None for a binary file, which has no such line.
+    """
+    if is_binary_file(params.filename):
+        return None
+    with open_eclab_file(params) as f:
+        return read_technique_line(f)[2]
+
+
+
+def extract_header(header_lines):
+    """ Scan the header lines of an EC-Lab file once, for all the parameters.
+    Return the parameters and the table of the sequences of the technique.
+    The parameters map the names of the "name : value" lines, with their colon, and
+    the names of the rows of the table to their text, as in the first line found.
+    The table has one record per sequence ("Ns") and a field per row: float if all
+    its values are numbers, text otherwise. It is None if the header has no table.
+    The table starts at its "Ns" row, which gives the width of the columns: a line
+    of free text with double spaces before it (a comment...) is not a row. Without
+    "Ns" row, the technique has a single sequence and each row a single value.
+    """
+    import re
+    import numpy as np
+
+    parameters = {}
+    table_lines = []
+
+    for line in header_lines:
+        line = line.rstrip()
+        name, separator, value = line.partition(' : ')
+        if not separator and line.endswith(' :'):
+            name, separator, value = line[:-2], ' :', ''
+        if separator:
+            parameters.setdefault(name + ' :', value.strip())
+            continue
+
+        # Rows of the table: a name, then one fixed-width column per sequence.
+        match = re.match(r'(\S.*?)(?:\s{2,}|\t)(\S.*)', line)
+        if match is None:
+            continue
+        parameters.setdefault(match.group(1), match.group(2))
+        table_lines.append((line, match))
+
+    row_names = [match.group(1) for _, match in table_lines]
+    rows = []
+    if "Ns" in row_names:
+        ns_row = row_names.index("Ns")
+        width = table_lines[ns_row][1].start(2)
+        for line, match in table_lines[ns_row:]:
+            if '\t' in line:
+                fields = [field.strip() for field in line.split('\t')[1:]]
+            else:
+                fields = [line[index:index + width].strip() for index in range(width, len(line), width)]
+            rows.append((match.group(1), fields))
+    else:
+        rows = [(match.group(1), [match.group(2).strip()]) for _, match in table_lines]
+
+    if len(rows) == 0:
+        return parameters, None
+
+    nb_sequences = max(len(fields) for _, fields in rows)
+    names = []
+    columns = []
+    for name, fields in rows:
+        label = name
+        occurrence = 1
+        while label in names:
+            occurrence += 1
+            label = name + " #" + str(occurrence)
+
+        fields = fields + [''] * (nb_sequences - len(fields))
+        try:
+            column = np.array([float(field.replace(',', '.')) if field != '' else np.nan for field in fields])
+        except ValueError:
+            column = np.array(fields, dtype=str)
 
+        names.append(label)
+        columns.append(column)
 
-        return imported_datasets + generated_datasets_single_values
+    sequences = np.empty(nb_sequences, dtype=[(name, column.dtype) for name, column in zip(names, columns)])
+    for name, column in zip(names, columns):
+        sequences[name] = column
+    return parameters, sequences
 
 
 
+def sequence_numbers(values):
+    """ Values of a row of the table of the sequences as numbers, nan for the values
+    which are not numbers: a row holding some text is stored as text (see extract_header).
+    """
+    numbers = []
+    for value in values:
+        try:
+            numbers.append(float(str(value).replace(',', '.')))
+        except ValueError:
+            numbers.append(float('nan'))
+    return numbers
+
+
+
+
+
+# Columns holding flags, counters and indices, stored as small integers in compact mode.
+COMPACT_INTEGER_COLUMNS = {'mode': 'i1',
+                           'ox/red': 'i1',
+                           'error': 'i1',
+                           'control changes': 'i1',
+                           'Ns changes': 'i1',
+                           'counter inc.': 'i1',
+                           'Ns': 'i2',
+                           'I Range': 'i2',
+                           'cycle number': 'i4',
+                           'half cycle': 'i4',
+                           'z cycle': 'i4',
+                           }
+
+# Columns kept in float64 by single_precision: the time, on which the rows of a time
+# window are found, would only be known to 0.06 s after a few days in float32.
+FULL_PRECISION_COLUMNS = ['time/s']
+
+def compact_dtype(data_header, compact_integers=False, single_precision=False):
+    """ Structured dtype storing the columns of data_header compactly: the integer
+    columns as small integers if compact_integers, the measurements as float32 if
+    single_precision. The integer columns and the columns of FULL_PRECISION_COLUMNS are
+    never stored as float32. None if neither is asked: the data is then a 2-D float64
+    array. The fields are named after the positions of the columns, as names may repeat.
+    """
+    import numpy as np
+
+    if not (compact_integers or single_precision):
+        return None
+
+    fields = []
+    for index, name in enumerate(data_header):
+        if compact_integers and name in COMPACT_INTEGER_COLUMNS:
+            field_dtype = COMPACT_INTEGER_COLUMNS[name]
+        elif (single_precision and name not in COMPACT_INTEGER_COLUMNS
+              and name not in FULL_PRECISION_COLUMNS):
+            field_dtype = 'f4'
+        else:
+            field_dtype = 'f8'
+        fields.append(('f' + str(index), field_dtype))
+    return np.dtype(fields)
 
 
 
+def merge_dtypes(dtype, other_dtype):
+    """ Structured dtype able to hold the rows of both dtypes, field by field.
+    """
+    import numpy as np
+    return np.dtype([(name, np.promote_types(dtype[name], other_dtype[name])) for name in dtype.names])
 
 
 
+def convert_rows(block, dtype, precision_loss=None):
+    """ Convert a 2-D float64 block of rows to the structured dtype (see convert_columns).
+    """
+    return convert_columns(list(block.T), dtype, precision_loss)
 
 
 
+def convert_columns(columns, dtype, precision_loss=None):
+    """ Store columns of the same length in a table of the structured dtype.
+    An integer field is widened to float64 if the values of its column are not integers
+    in its range, so the returned rows may have a wider dtype.
+    The largest relative error of the float32 fields is kept in precision_loss, by field.
+    """
+    import numpy as np
 
+    fields = []
+    for name, column in zip(dtype.names, columns):
+        field_dtype = dtype[name]
+        if field_dtype.kind == 'i' and len(column) > 0:
+            limits = np.iinfo(field_dtype)
+            if (not np.array_equal(column, np.trunc(column))
+                    or column.min() < limits.min or column.max() > limits.max):
+                field_dtype = np.dtype('f8')
+        fields.append((name, field_dtype))
 
+    nb_rows = len(columns[0]) if len(columns) > 0 else 0
+    rows = np.empty(nb_rows, dtype=np.dtype(fields))
+    for name, column in zip(rows.dtype.names, columns):
+        rows[name] = column
 
+        if precision_loss is not None and rows.dtype[name] == np.float32 and nb_rows > 0:
+            nonzero = column != 0
+            error = (np.abs(rows[name][nonzero] - np.asarray(column[nonzero], dtype=float))
+                     / np.abs(np.asarray(column[nonzero], dtype=float)))
+            precision_loss[name] = max(precision_loss.get(name, 0.0), float(np.max(error, initial=0.0)))
 
+    return rows
 
 
 
+def float_table(columns, nb_rows):
+    """ Copy columns of nb_rows values into a 2-D float64 table.
+    """
+    import numpy as np
 
+    data_Np = np.empty((nb_rows, len(columns)))
+    for index, column in enumerate(columns):
+        data_Np[:, index] = column
+    return data_Np
 
 
 
+def table_columns(data_Np):
+    """ The columns of a data table, 2-D array or structured array, as a list of views.
+    """
+    if data_Np.dtype.names is None:
+        return list(data_Np.T)
+    return [data_Np[name] for name in data_Np.dtype.names]
 
 
 
-class ImportECLAB_GC(ImportPlugin):
-    name = "EC-LAB GC"
-    author = "Arthur Langlard"
-    description = "Imports galvanostatic cycling measurements from EC-LAB files."
-    descriptor = "Galvanostatic Cycling with Potential Limitation\n"
+def select_table_columns(data_Np, indices):
+    """ The columns of a data table at the given indices, as a new table.
+    """
+    if data_Np.dtype.names is None:
+        return data_Np[:, indices]
+    return data_Np[[data_Np.dtype.names[index] for index in indices]]
 
 
-    # Comment this line to remove the tab of the plugin
-    promote_tab = 'EC-LAB GC'
-    file_extensions = set(['.mpt', '.MPT'])
 
-    class HeaderInfo:
-        m_header_lines = []
-        m_header_names_str = ['Reference electrode :',
-                              'Electrode surface area :',
-                              'Characteristic mass :',
-                              'Is',
-                              'unit Is',
-                              'EM (V)',
-                              ]
 
-        m_header_names = ["reference_electrode",
-                          "surface",
-                          "mass",
-                          "currents",
-                          "currents_units",
-                          "threshold_voltages",
-                          "offset_voltage_vs_SHE",
-                          "surface_unit",
-                          "mass_unit",
-                          ]
 
-        m_header_string = ""
 
-        m_header_infos = {}
+DATA_CHUNK_SIZE = 1 << 22    # Number of characters converted at once.
 
-        def __init__(self, header_lines):
-            self.m_header_lines = header_lines
-            self.m_header_string = ''.join(self.m_header_lines)
-            extracted_parameters = []
+def finished_row(line, nb_columns):
+    """ Whether a line without end of line holds the values of all the columns, as the
+    last row of a file whose writing is over. The last value of a row still being
+    written cannot be told from a finished one: the row is read again with the next rows.
+    """
+    fields = line.strip().split('\t' if isinstance(line, str) else b'\t')
+    if len(fields) != nb_columns:
+        return False
+    try:
+        for field in fields:
+            float(field.replace(',', '.') if isinstance(field, str) else field.replace(b',', b'.'))
+    except ValueError:
+        return False
+    return True
 
-            for name in self.m_header_names_str:
-                extracted_parameters.append(self.extract_parameter_from_string(name).strip())
 
-            if not extracted_parameters[0] == "": # If the reference electrode was specified.
-                index_of_offset_voltage = [i for i, _ in enumerate(extracted_parameters[0]) if extracted_parameters[0].startswith("(", i)][-1]
-                offset_voltage_vs_SHE = float(extracted_parameters[0][index_of_offset_voltage + 1: -2].replace(",", "."))
-                ref_electrode_str = extracted_parameters[0][:index_of_offset_voltage - 1]
+
+def read_data_rows(file, nb_columns, chunk_size=DATA_CHUNK_SIZE, complete_rows_only=False, usecols=None,
+                   dtype=None, precision_loss=None):
+    """ Convert the data rows from the current position of the file to its end.
+    The file may be opened in text or in binary mode; in binary mode, the rows are
+    converted from the raw bytes (see parse_data_block).
+    The rows are read by chunks which are converted and copied into a growing array,
+    so the text of the whole data part is never held in memory. Only the columns of
+    usecols are converted and stored, all of them by default.
+    If a structured dtype is given (see compact_dtype), each chunk is stored with it,
+    as by convert_rows, instead of in a 2-D float64 array.
+    The text following the last end of line is returned along with the array. It is
+    converted as a last row unless complete_rows_only is set, for files which are
+    still being written and may end with a half-written line: it is then only
+    converted if it is a finished row (see finished_row).
+    """
+    import numpy as np
+    import os
+
+    try:
+        remaining_size = os.fstat(file.fileno()).st_size - file.tell()
+    except (AttributeError, OSError, ValueError):
+        remaining_size = None
+
+    nb_converted = nb_columns if usecols is None else len(usecols)
+    if dtype is None:
+        data_Np = np.empty((0, nb_converted))
+    else:
+        data_Np = np.empty(0, dtype=dtype)
+    nb_rows = 0
+    remainder = file.read(0)    # Empty text or bytes, as read from the file.
+    end_of_line = '\n' if isinstance(remainder, str) else b'\n'
+
+    while True:
+        with ProfileStage("decode"):
+            chunk = file.read(chunk_size)
+        if len(chunk) == 0:
+            partial_line = remainder
+            if complete_rows_only and not finished_row(remainder, nb_columns):
+                block_text = remainder[:0]
             else:
-                offset_voltage_vs_SHE = 0.0
-                ref_electrode_str = "NHE"
-                
-            surface, surface_unit = extracted_parameters[1].split(" ")
-            surface = float(surface.replace(",", "."))
-            mass, mass_unit = extracted_parameters[2].split(" ")
-            mass = float(mass.replace(",", "."))
+                block_text = remainder
+        else:
+            chunk = remainder + chunk
+            end_of_rows = chunk.rfind(end_of_line) + 1
+            block_text, remainder = chunk[:end_of_rows], chunk[end_of_rows:]
 
+        block = parse_data_block(block_text, nb_columns, usecols)
+        if dtype is not None:
+            with ProfileStage("compact") as stage:
+                block = convert_rows(block, dtype, precision_loss)
+                stage["rows"] += len(block)
+            if block.dtype != data_Np.dtype:
+                dtype = merge_dtypes(data_Np.dtype, block.dtype)
+                data_Np = data_Np.astype(dtype)
 
-            currents = [float(current) for current in extracted_parameters[3].replace(",", ".").split()]
-            currents_units = extracted_parameters[4].split()
+        if nb_rows + len(block) > len(data_Np):
+            capacity = len(data_Np) + len(data_Np) // 4 + len(block)
+            if len(data_Np) == 0 and remaining_size and len(block_text) > 0:
+                # Estimate the final number of rows from the size of the first rows.
+                capacity = max(capacity, int(1.02 * remaining_size * len(block) / len(block_text)) + 1)
+            data_Np.resize((capacity,) + data_Np.shape[1:], refcheck=False)
 
-            threshold_voltages = [float(current) for current in extracted_parameters[5].replace(",", ".").split()]
+        data_Np[nb_rows:nb_rows + len(block)] = block
+        nb_rows += len(block)
 
-            parameters = [ref_electrode_str,
-                          surface,
-                          mass,
-                          currents,
-                          currents_units,
-                          threshold_voltages,
-                          offset_voltage_vs_SHE,
-                          surface_unit,
-                          mass_unit,
-                          ]
+        if len(chunk) == 0:
+            break
 
-            self.m_header_infos = dict(zip(self.m_header_names, parameters))
+    data_Np.resize((nb_rows,) + data_Np.shape[1:], refcheck=False)
+    return data_Np, partial_line
 
-        def extract_parameter_from_string(self, name):
-            parameter_found = False
-            for line in self.m_header_lines:
-                if name in line:
-                    parameter_found = True
-                    return line.rstrip().split(name)[-1]
-            
-            if not parameter_found:
-                return ""
 
 
+def read_column_names(file):
+    """ Read the line of column names which ends the header of an EC-Lab file.
+    """
+    return file.readline().split('\t')[:-1]    # Remove the last character (end of line '\n').
 
 
 
-    def parse_header_data(self, file):
-        """ Separate the file into the header part and the data part.
-        """
+def select_columns(file_header, removed_columns=(), selected_columns=None):
+    """ Indices of the columns of a file to import: the columns of selected_columns
+    (all of them if empty), except those of removed_columns.
+    """
+    return [index for index, name in enumerate(file_header)
+            if (not selected_columns or name in selected_columns) and name not in removed_columns]
 
-        output = [None,None]
-        flag_Is_correct_file = (file.readline() == "EC-Lab ASCII FILE\n")
-        if not flag_Is_correct_file:
-            raise ValueError('Not a EC-LAB file.')
-        
-        
-
-        if flag_Is_correct_file:
-
-            line = ''
-            prevLine = ''
-            line_no = 1 # The first line (no. 0) has already been read.
-            header_lines = []
-            data_lines = []
-
-            while not "Nb header lines" in line: # Search for the length of the header.
-                line = file.readline()
-                line_no += 1
-            length_header = int(line.split(":")[-1])
-
-            file.readline()
-            line_no += 1
-            if not (file.readline() == self.descriptor):
-                raise ValueError('Not a Galvanostatic Cycling file.')
-            else:
-                header_lines.append(self.descriptor)
 
-            line_no += 1
 
-            while line_no < length_header - 1:    # Parse the header.
-                header_lines.append(file.readline())
-                line_no += 1
+def parse_column_list(text):
+    """ Names of the columns given in a text field, separated by ';'.
+    """
+    return [name.strip() for name in text.split(';') if name.strip() != '']
 
-            while not line == '':   # Parse the data part.
-                line = file.readline()
-                data_lines.append(line)
-                line_no += 1
 
-            data_lines.pop()    # Remove the last empty string.
 
-            output = header_lines, data_lines
-        return output
+def parse_number_list(text):
+    """ Integers given in a text field, separated by ';' or ',': single numbers or
+    ranges "first-last", last included.
+    """
+    numbers = []
+    for item in text.replace(',', ';').split(';'):
+        item = item.strip()
+        if item == '':
+            continue
+        first, separator, last = item.partition('-')
+        try:
+            if separator:
+                numbers.extend(range(int(first), int(last) + 1))
+            else:
+                numbers.append(int(item))
+        except ValueError:
+            raise ValueError('Invalid list of numbers: ' + text)
+    return numbers
 
 
 
+def row_selections(params, selection_fields):
+    """ Selections of rows set in the fields of an import, as (column name, values)
+    pairs. selection_fields maps the name of each field ("cycles", "steps") to the
+    column it selects on. Empty fields select nothing.
+    """
+    selections = []
+    for field, column in selection_fields.items():
+        values = parse_number_list(params.field_results[field])
+        if values:
+            selections.append((column, values))
+    return selections
 
 
-    def split_by_variable(self, data_header, data_Np, cycling_index, do_split=False):
-        import numpy as np
-        cycle_no = int(data_Np[0, cycling_index])
 
-        if not do_split:
-            return [data_header], [data_Np]
+def select_rows(data_header, data_Np, selections):
+    """ The rows of a data table whose values are in all the selections.
+    """
+    import numpy as np
 
-        else:
+    columns = table_columns(data_Np)
+    selected = np.ones(len(data_Np), dtype=bool)
+    for name, values in selections:
+        if name not in data_header:
+            raise ValueError('No column ' + name + ' in EC-LAB file.')
+        selected &= np.isin(columns[data_header.index(name)], values)
+    return data_Np[selected]
 
-            #     Cycle 1          ,      Cycle 2 ...
-            # [[point, point, ...] , [point, point, ...]]
-            Cycles = [[]]
-            cycles_nos = [cycle_no]
 
-            for data_point in data_Np:
-                if int(data_point[cycling_index]) == cycle_no:
-                    Cycles[-1].append(list(data_point))
-                else:
-                    Cycles.append([list(data_point)])
-                    cycle_no += 1
-                    cycles_nos.append(cycle_no)
-            
-            Cycles_np = []
-            Data_headers = []
-
-            for cycle_list, cycle_no in zip(Cycles, cycles_nos):
-                Cycles_np.append(np.array(cycle_list, dtype=float))
-                header_with_cycle_no = [str(name) + " (" + str(cycle_no) + ")" for name in data_header]
-                Data_headers.append(header_with_cycle_no)
 
-        return Data_headers, Cycles_np
+def read_data_block(file, chunk_size=DATA_CHUNK_SIZE, max_rows=None, removed_columns=(), selected_columns=None):
+    """ Read the data part of an EC-Lab file, from the line of column names to the end.
+    If max_rows is given, only the first max_rows rows are read and the rest of the
+    file is left untouched. The columns are selected as by select_columns.
+    Return the names of the imported columns and the data array.
+    """
+    file_header = read_column_names(file)
+    usecols = select_columns(file_header, removed_columns, selected_columns)
+    data_header = [file_header[index] for index in usecols]
 
+    if max_rows is not None:
+        data_lines = []
+        while len(data_lines) < max_rows:
+            line = file.readline()
+            if line == '':
+                break
+            data_lines.append(line)
+        return data_header, parse_data_block(data_lines, len(file_header), usecols)
 
+    data_Np, _ = read_data_rows(file, len(file_header), chunk_size, usecols=usecols)
+    return data_header, data_Np
 
 
 
-    def __init__(self):
-        from veusz.plugins import ImportPlugin, ImportFieldCheck, ImportFieldFloat, ImportFieldCombo
 
-        ImportPlugin.__init__(self)
-        self.fields = [
-            ImportFieldCheck("extract_cycles", descr="Import cycles as separate datasets."),
-            ImportFieldCheck("extract_steps", descr="Import steps as separate datasets."),
-            ImportFieldCheck("import_all_data", descr="Import misc. data."),
 
-            ImportFieldCheck("change_surface", descr="Define a surface"),
-            ImportFieldFloat("surface", descr="Surface", default=1.0),
-            ImportFieldCombo("surface_unit", descr="Surface unit", items=("m2", "cm2", "mm2"),
-                             editable=False, default="cm2"),
 
-            ImportFieldCheck("change_mass", descr="Define a mass"),
-            ImportFieldFloat("mass", descr="Mass", default=1.0),
-            ImportFieldCombo("mass_unit", descr="Mass unit", items=("g", "mg", "ng"),
-                             editable=False, default="mg")
-            
-            ]
+def segment_bounds(values):
+    """ The values as integers, and the starts and stops of the runs of consecutive rows
+    sharing the same value (cycle number, half cycle...). values must not be empty.
+    """
+    import numpy as np
 
+    values = np.asarray(values).astype(np.int64)
+    boundaries = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(values)]))
+    return values, starts, stops
 
 
 
-    def import_dataset(self, params):
-        import numpy as np
+def split_by_column(data_header, columns, column_index):
+    """ Split the data columns into the blocks of consecutive rows sharing the same
+    value in one column (cycle number, half cycle...).
+    Each block is a list of slices of the columns, not copies. The names of the columns
+    of a block are suffixed with the value of the column, e.g. "Ewe/V (3)". If a value
+    appears again later in the file (numbering restarted), the occurrence is appended:
+    "Ewe/V (3 #2)".
+    """
+    nb_rows = len(columns[column_index])
+    if nb_rows == 0:
+        return [], []
 
-        f = params.openFileWithEncoding()
-        try:
-            header_lines, data_lines = self.parse_header_data(f)
-        except ValueError:
-            raise
+    with ProfileStage("split") as stage:
+        cycle_nos, starts, stops = segment_bounds(columns[column_index])
 
-        data_header = data_lines[0].split('\t')[:-1]    # Remove the last character (end of line '\n').
-        lines_list = []
-        for line in data_lines[1:]:
-            lines_list.append(line.replace(',', '.').split('\t'))
+        Cycles_np = []
+        Data_headers = []
+        occurrences = {}
 
-        data_Np = np.array(lines_list, dtype=float)
+        for start, stop, cycle_no in zip(starts.tolist(), stops.tolist(), cycle_nos[starts].tolist()):
+            occurrences[cycle_no] = occurrences.get(cycle_no, 0) + 1
+            label = str(cycle_no)
+            if occurrences[cycle_no] > 1:
+                label = label + " #" + str(occurrences[cycle_no])
 
-        if not params.field_results["import_all_data"]:
-            misc_data = ['mode',
-                        'ox/red',
-                        'error',
-                        'control changes',
-                        'Ns changes',
-                        'Ns',
-                        'counter inc.',
-                        'I Range',
-                        'dq/mA.h',
-                        'control/V/mA',
-                        'control/V',
-                        'control/mA',
-                        ]
-            if not params.field_results["extract_steps"]:
-                misc_data = misc_data + ['half cycle']
+            Cycles_np.append([column[start:stop] for column in columns])
+            Data_headers.append([str(name) + " (" + label + ")" for name in data_header])
+        stage["rows"] += nb_rows
 
-            misc_data_indices = [data_header.index(misc_item) for misc_item in misc_data]
-            data_header = [name for name in data_header if name not in misc_data]
-            data_Np = np.delete(data_Np, misc_data_indices, axis=1)
+    return Data_headers, Cycles_np
 
-        MyHeader = self.HeaderInfo(header_lines)
-        return MyHeader, data_header, data_Np
 
 
 
-    def getPreview(self, params):
-        import numpy as np
-        try:
-            MyHeader, data_header, data_Np = self.import_dataset(params)
-        except ValueError:
-            return ("File cannot be displayed", False)
 
 
-        header_string = MyHeader.m_header_string
-        data_header_string = '\t'.join(data_header)
-        data_string = "\n"
-        max_data_len = 20
-        if len(data_Np) < max_data_len:
-            max_data_len = len(data_Np) - 1
-        for data_line in data_Np[:max_data_len]:
-            for value in data_line:
-                data_string = data_string + "{:.4e}".format(value) + "\t"
-            data_string = data_string + "\n"
+def segment_extreme_rows(values, starts, reduction):
+    """ Row of the extreme of values in each segment of consecutive rows beginning at
+    starts: the first row of the minimum with np.fmin, of the maximum with np.fmax.
+    NaN values are ignored; the row is -1 for a segment holding only NaN.
+    """
+    import numpy as np
 
-        return (header_string + data_header_string + data_string, True)
+    segments = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+    extremes = reduction.reduceat(values, starts)
+    rows = np.flatnonzero(values == extremes[segments])
+    found, first_rows = np.unique(segments[rows], return_index=True)
 
+    segment_rows = np.full(len(starts), -1, dtype=np.int64)
+    segment_rows[found] = rows[first_rows]
+    return segment_rows
 
 
-    def doImport(self, params):
-        from veusz.plugins import ImportDataset1D
-        import numpy as np
-        """Actually imports data.
-        params is a ImportPluginParams object.
-        Return a list of ImportDataset1D objects.
-        """
 
-        MyHeader, data_header, data_Np = self.import_dataset(params)
+def minmax_indices(y, nb_points):
+    """ Rows kept by the min/max decimation of a block: the first and last rows, and
+    the rows of the minimum and maximum of y in each of nb_points // 2 buckets of
+    consecutive rows. The envelope of the curve is kept, spikes included.
+    """
+    import numpy as np
 
+    nb_rows = len(y)
+    nb_buckets = max(nb_points // 2, 1)
+    y = np.asarray(y, dtype=float)
+    starts = np.linspace(0, nb_rows, nb_buckets, endpoint=False).astype(np.int64)
 
-        # Add generated values to the data table.
-        if params.field_results["change_surface"]:
-            MyHeader.m_header_infos["surface"] = params.field_results["surface"]
-            MyHeader.m_header_infos["surface_unit"] = params.field_results["surface_unit"]
-        surface = MyHeader.m_header_infos["surface"]
+    indices = [np.array([0, nb_rows - 1])]
+    for reduction in (np.fmin, np.fmax):
+        rows = segment_extreme_rows(y, starts, reduction)
+        indices.append(rows[rows >= 0])
 
-        if params.field_results["change_mass"]:
-            MyHeader.m_header_infos["mass"] = params.field_results["mass"]
-            MyHeader.m_header_infos["mass_unit"] = params.field_results["mass_unit"]
-        mass = MyHeader.m_header_infos["mass"]
-        
-        capacity_index = data_header.index("Capacity/mA.h")
-        dataset_Q_per_mass = np.array([capacity / mass for capacity in data_Np[:, capacity_index] ])
+    return np.unique(np.concatenate(indices))
 
-        data_header.append("Capacity_per_mass/mA.h/" + MyHeader.m_header_infos["mass_unit"])
-        data_Np = np.c_[data_Np, dataset_Q_per_mass]
 
-        generated_datasets_single_values = [ImportDataset1D("mass/" + MyHeader.m_header_infos["mass_unit"],
-                                              mass),
-                                          ImportDataset1D("surface/" + MyHeader.m_header_infos["surface_unit"],
-                                                          surface),
-                                          ImportDataset1D("offset_voltage/VvsNHE",
-                                                          MyHeader.m_header_infos["offset_voltage_vs_SHE"]),
-                                          ]
 
+def lttb_indices(x, y, nb_points):
+    """ Rows kept by the Largest-Triangle-Three-Buckets decimation of a block.
+    The rows between the first and the last one are split into nb_points - 2 buckets.
+    In each bucket, the row kept is the one forming the largest triangle with the row
+    kept in the previous bucket and the average point of the next bucket.
+    """
+    import numpy as np
 
+    nb_rows = len(y)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, nb_rows - 1, nb_points - 1).astype(np.int64)
+    sizes = np.diff(edges)
 
-        Data_headers = [data_header]
-        Cycles_np = [data_Np]
+    # Average point of each bucket, followed by the last row.
+    x_means = np.append(np.add.reduceat(x[:nb_rows - 1], edges[:-1]) / sizes, x[-1])
+    y_means = np.append(np.add.reduceat(y[:nb_rows - 1], edges[:-1]) / sizes, y[-1])
 
-        # Split data into separate cyles.
-        if params.field_results["extract_steps"]:
-            cycling_index_for_steps = data_header.index('half cycle')
-            Data_headers, Cycles_np = self.split_by_variable(data_header, data_Np, cycling_index_for_steps, params.field_results["extract_steps"])
+    indices = np.empty(nb_points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = nb_rows - 1
+    kept = 0
+    edges = edges.tolist()
+    for bucket in range(nb_points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        areas = np.abs((x[kept] - x_means[bucket + 1]) * (y[start:stop] - y[kept])
+                       - (x[kept] - x[start:stop]) * (y_means[bucket + 1] - y[kept]))
+        kept = start + int(np.argmax(areas))
+        indices[bucket + 1] = kept
 
+    return indices
 
-        D_h_temp = []
-        C_np_temp = []
 
-        Data_headers_b = []
-        Cycles_np_b = []
 
-        if params.field_results["extract_cycles"]:
-            cycling_index_for_cycles = data_header.index('cycle number')
-            for data_header, data_Np in zip(Data_headers, Cycles_np):
-            
-                D_h_temp, C_np_temp = self.split_by_variable(data_header, data_Np, cycling_index_for_cycles, params.field_results["extract_cycles"])
-                Data_headers_b = Data_headers_b + D_h_temp
-                Cycles_np_b = Cycles_np_b + C_np_temp
+def decimate_blocks(Data_headers, Cycles_np, axes, method="none", nb_points=5000, keep_full=False):
+    """ Reduce each block of columns (whole data, cycle or step) to about nb_points rows
+    for plotting, with the "min/max" or "LTTB" method. The rows are chosen on the
+    columns of axes, indices (x, y) in the blocks, x being the row number if None;
+    the same rows are kept in all the columns of a block.
+    If keep_full, the blocks at full resolution are kept as well, their names suffixed
+    with " full".
+    """
+    import numpy as np
+
+    if method == "none" or axes[1] is None:
+        return Data_headers, Cycles_np
+    nb_points = max(int(nb_points), 3)
+
+    x_index, y_index = axes
+    decimated_headers = []
+    decimated_blocks = []
+    with ProfileStage("decimate") as stage:
+        for data_header, columns in zip(Data_headers, Cycles_np):
+            nb_rows = len(columns[y_index])
+            stage["rows"] += nb_rows
+            if nb_rows <= nb_points:
+                indices = None
+            elif method == "LTTB":
+                x = np.arange(nb_rows) if x_index is None else columns[x_index]
+                indices = lttb_indices(x, columns[y_index], nb_points)
+            else:
+                indices = minmax_indices(columns[y_index], nb_points)
+
+            decimated_headers.append(data_header)
+            decimated_blocks.append(columns if indices is None else [column[indices] for column in columns])
+
+    if keep_full:
+        decimated_headers = decimated_headers + [[name + " full" for name in data_header]
+                                                 for data_header in Data_headers]
+        decimated_blocks = decimated_blocks + Cycles_np
+
+    return decimated_headers, decimated_blocks
+
+
+
+def decimation_axes(data_header, axes):
+    """ Indices in data_header of the columns of axes, None for those not imported.
+    """
+    return tuple(data_header.index(name) if name in data_header else None for name in axes)
+
 
-            Data_headers, Cycles_np = Data_headers_b, Cycles_np_b
 
 
 
-        #Data_headers, Cycles_np = self.split_by_variable(data_header, data_Np, params.field_results["extract_cycles"])
-        imported_datasets = []
 
-        for data_header, data_Np in zip(Data_headers, Cycles_np):
-            labeled_datasets = zip(data_header, data_Np.T)
-            imported_datasets = imported_datasets + [ImportDataset1D(*data) for data in labeled_datasets]
+def add_derived_columns(data_header, columns, derived_columns, header_infos):
+    """ Append the derived columns of a technique to the data columns.
+    Each derived column is declared as (name, source column, divisors): its values are
+    those of the source column divided in turn by each divisor, a number or the name of
+    a parameter of header_infos. The name is formatted with header_infos.
+    All the derived columns are allocated as one block and computed in place, in
+    float64 whatever the storage of the source column.
+    """
+    import numpy as np
+
+    nb_rows = len(columns[0]) if len(columns) > 0 else 0
+    derived_block = np.empty((len(derived_columns), nb_rows))
+    derived_header = []
+
+    for derived_column, (name, source, divisors) in zip(derived_block, derived_columns):
+        divisors = [header_infos[divisor] if isinstance(divisor, str) else divisor for divisor in divisors]
+        np.divide(columns[data_header.index(source)], divisors[0], out=derived_column, dtype=float)
+        for divisor in divisors[1:]:
+            np.divide(derived_column, divisor, out=derived_column)
+        derived_header.append(name.format(**header_infos))
+
+    return data_header + derived_header, columns + list(derived_block)
+
+
+
+# Columns used by cycle_summary.
+CYCLE_SUMMARY_COLUMNS = ["time/s", "Ewe/V", "(Q-Qo)/mA.h", "cycle number", "half cycle"]
+
+def cycle_summary(data_header, columns, mass, mass_unit):
+    """ Summary of each cycle and each half cycle of a galvanostatic cycling, computed
+    with reductions over the runs of rows of the cycles, without splitting the data.
+    The charge passed between two rows is the increment of (Q-Qo): counted as charge
+    when positive, as discharge when negative. The energy of an increment is the
+    charge times the mean potential of the two rows, in mW.h. The mean voltage is the
+    energy divided by the capacity, the coulombic efficiency the discharge capacity
+    divided by the charge capacity, in %.
+    Return the summary datasets as (name, values) pairs, one value per cycle or
+    half cycle.
+    """
+    import numpy as np
+
+    for name in CYCLE_SUMMARY_COLUMNS:
+        if name not in data_header:
+            raise ValueError('Missing column ' + name + ' for the cycle summary.')
+    time, potential, charge, cycle_nos, half_cycles = [np.asarray(columns[data_header.index(name)], dtype=float)
+                                                       for name in CYCLE_SUMMARY_COLUMNS]
+    if len(time) == 0:
+        return []
+
+    with ProfileStage("summary") as stage:
+        increments = np.diff(charge, prepend=charge[0])
+        energies = increments * (potential + np.concatenate((potential[:1], potential[:-1]))) / 2
+        charging = increments > 0
+        charge_increments = np.where(charging, increments, 0.0)
+        discharge_increments = np.where(charging, 0.0, -increments)
+        charge_energies = np.where(charging, energies, 0.0)
+        discharge_energies = np.where(charging, 0.0, -energies)
+
+        cycle_nos, starts, stops = segment_bounds(cycle_nos)
+        charge_capacity = np.add.reduceat(charge_increments, starts)
+        discharge_capacity = np.add.reduceat(discharge_increments, starts)
+        charge_energy = np.add.reduceat(charge_energies, starts)
+        discharge_energy = np.add.reduceat(discharge_energies, starts)
+
+        half_cycle_nos, half_starts, half_stops = segment_bounds(half_cycles)
+        half_capacity = np.add.reduceat(increments, half_starts)
+        half_energy = np.add.reduceat(energies, half_starts)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            summary = [("summary_cycle_number", cycle_nos[starts].astype(float)),
+                       ("summary_charge_capacity/mA.h", charge_capacity),
+                       ("summary_discharge_capacity/mA.h", discharge_capacity),
+                       ("summary_charge_capacity_per_mass/mA.h/" + mass_unit, charge_capacity / mass),
+                       ("summary_discharge_capacity_per_mass/mA.h/" + mass_unit, discharge_capacity / mass),
+                       ("summary_coulombic_efficiency/%", 100 * discharge_capacity / charge_capacity),
+                       ("summary_charge_energy/mW.h", charge_energy),
+                       ("summary_discharge_energy/mW.h", discharge_energy),
+                       ("summary_charge_mean_voltage/V", charge_energy / charge_capacity),
+                       ("summary_discharge_mean_voltage/V", discharge_energy / discharge_capacity),
+                       ("summary_duration/s", time[stops - 1] - time[starts]),
+
+                       # Half cycles: positive in charge, negative in discharge.
+                       ("summary_half_cycle_number", half_cycle_nos[half_starts].astype(float)),
+                       ("summary_half_cycle_capacity/mA.h", half_capacity),
+                       ("summary_half_cycle_capacity_per_mass/mA.h/" + mass_unit, half_capacity / mass),
+                       ("summary_half_cycle_energy/mW.h", half_energy),
+                       ("summary_half_cycle_mean_voltage/V", half_energy / half_capacity),
+                       ("summary_half_cycle_duration/s", time[half_stops - 1] - time[half_starts]),
+                       ]
+        stage["rows"] += len(time)
+
+    return summary
+
+
+
+# Columns used by peak_analysis.
+PEAK_ANALYSIS_COLUMNS = ["Ewe/V", "<I>/mA", "(Q-Qo)/C", "cycle number"]
+
+def peak_analysis(data_header, columns, threshold_current):
+    """ Peaks of each cycle of a cyclic voltammetry, computed with reductions over the
+    runs of rows of the cycles, without splitting the data.
+    The anodic sweep is made of the rows where the potential rises, the cathodic sweep
+    of the others. In each cycle, the anodic peak is the maximum current of the anodic
+    sweep, the cathodic peak the minimum current of the cathodic sweep. The charges are
+    the sums of the positive and of the negative increments of (Q-Qo). The threshold
+    potentials are where the current first reaches threshold_current (mA) in the anodic
+    sweep and -threshold_current in the cathodic sweep, interpolated between two rows.
+    Values not found in a cycle are NaN.
+    Return the analysis datasets as (name, values) pairs, one value per cycle.
+    """
+    import numpy as np
+
+    for name in PEAK_ANALYSIS_COLUMNS:
+        if name not in data_header:
+            raise ValueError('Missing column ' + name + ' for the peak analysis.')
+    potential, current, charge, cycle_nos = [np.asarray(columns[data_header.index(name)], dtype=float)
+                                             for name in PEAK_ANALYSIS_COLUMNS]
+    nb_rows = len(potential)
+    if nb_rows == 0:
+        return []
+
+    def at_rows(values, rows):
+        return np.where(rows >= 0, values[rows], np.nan)
+
+    with ProfileStage("peaks") as stage:
+        cycle_nos, starts, stops = segment_bounds(cycle_nos)
+        rising = np.diff(potential, append=potential[-1]) > 0
+        if nb_rows > 1:
+            rising[-1] = rising[-2]
+
+        anodic_rows = segment_extreme_rows(np.where(rising, current, np.nan), starts, np.fmax)
+        cathodic_rows = segment_extreme_rows(np.where(rising, np.nan, current), starts, np.fmin)
+
+        increments = np.diff(charge, prepend=charge[0])
+        anodic_charge = np.add.reduceat(np.where(increments > 0, increments, 0.0), starts)
+        cathodic_charge = np.add.reduceat(np.where(increments < 0, increments, 0.0), starts)
+
+        def threshold_potential(crossing, threshold):
+            # First crossing row of each cycle, nb_rows if none.
+            rows = np.minimum.reduceat(np.where(crossing, np.arange(nb_rows), nb_rows), starts)
+            found = rows < stops
+            rows = np.minimum(rows, nb_rows - 1)
+            previous_rows = np.maximum(rows - 1, starts)
+            steps = current[rows] - current[previous_rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fractions = np.clip(np.where(steps != 0, (threshold - current[previous_rows]) / steps, 1.0), 0.0, 1.0)
+            potentials = potential[previous_rows] + fractions * (potential[rows] - potential[previous_rows])
+            return np.where(found, potentials, np.nan)
+
+        threshold_current = abs(threshold_current)
+        anodic_threshold = threshold_potential(rising & (current >= threshold_current), threshold_current)
+        cathodic_threshold = threshold_potential(~rising & (current <= -threshold_current), -threshold_current)
+
+        anodic_potential = at_rows(potential, anodic_rows)
+        cathodic_potential = at_rows(potential, cathodic_rows)
+        analysis = [("peaks_cycle_number", cycle_nos[starts].astype(float)),
+                    ("peaks_anodic_potential/V", anodic_potential),
+                    ("peaks_anodic_current/mA", at_rows(current, anodic_rows)),
+                    ("peaks_cathodic_potential/V", cathodic_potential),
+                    ("peaks_cathodic_current/mA", at_rows(current, cathodic_rows)),
+                    ("peaks_separation/V", anodic_potential - cathodic_potential),
+                    ("peaks_anodic_charge/C", anodic_charge),
+                    ("peaks_cathodic_charge/C", cathodic_charge),
+                    ("peaks_anodic_threshold_potential/V", anodic_threshold),
+                    ("peaks_cathodic_threshold_potential/V", cathodic_threshold),
+                    ]
+        stage["rows"] += nb_rows
+
+    return analysis
+
+
+
+
+
+class ParsedFile:
+    """ The parsed content of an EC-Lab file, as kept in the parse cache.
+    The rows are stored at the start of m_buffer, which may have room for the rows
+    appended later to a file still being written. m_data_end is the position in the
+    file following the last complete (newline terminated) row, and m_nb_complete_rows
+    the number of rows before it.
+    Only the columns m_usecols of the file may have been parsed: m_file_header holds
+    the names of all the columns, m_data_header those of the parsed ones.
+    m_compact is the pair (compact_integers, single_precision) of compact_dtype.
+    """
+    def __init__(self, MyHeader, data_header, data_Np, data_end=None, nb_complete_rows=None,
+                 file_header=None, usecols=None, compact=(False, False)):
+        self.m_header = MyHeader
+        self.m_data_header = list(data_header)
+        self.m_file_header = list(data_header) if file_header is None else list(file_header)
+        self.m_usecols = usecols
+        self.m_compact = tuple(compact)
+        self.m_buffer = data_Np
+        self.m_nb_rows = len(data_Np)
+        self.m_data_end = data_end
+        self.m_nb_complete_rows = len(data_Np) if nb_complete_rows is None else nb_complete_rows
+
+    def nbytes(self):
+        return self.m_buffer.nbytes
+
+    def has_columns(self, removed_columns=(), selected_columns=None):
+        """ Whether the columns to import were all parsed.
+        """
+        usecols = select_columns(self.m_file_header, removed_columns, selected_columns)
+        return all(self.m_file_header[index] in self.m_data_header for index in usecols)
+
+    def contents(self, removed_columns=(), selected_columns=None):
+        """ Return a copy of the header, the names of the columns to import and their data.
+        The data is a read-only view if all the parsed columns are imported, a copy otherwise.
+        """
+        import copy
 
+        data_Np = self.m_buffer[:self.m_nb_rows]
+        data_Np.setflags(write=False)   # Shared between imports: never modified in place.
 
-        return imported_datasets + generated_datasets_single_values
+        usecols = select_columns(self.m_file_header, removed_columns, selected_columns)
+        data_header = [self.m_file_header[index] for index in usecols]
+        if data_header != self.m_data_header:
+            with ProfileStage("columns") as stage:
+                data_Np = select_table_columns(data_Np, [self.m_data_header.index(name) for name in data_header])
+                stage["rows"] += len(data_Np)
 
+        return copy.deepcopy(self.m_header), data_header, data_Np
 
+    def append_rows(self, rows, data_end, nb_complete_rows=None):
+        """ Add the rows read after m_data_end, of which the first nb_complete_rows
+        (all by default) are complete. They replace any last row which was incomplete.
+        Room is kept in the buffer for the next rows.
+        """
+        import numpy as np
 
+        start = self.m_nb_complete_rows
+        nb_rows = start + len(rows)
 
+        dtype = self.m_buffer.dtype
+        if dtype.names is not None and rows.dtype != dtype:
+            dtype = merge_dtypes(dtype, rows.dtype)
+            rows = rows.astype(dtype)
 
+        # Rows already handed out are never overwritten.
+        if (nb_rows > len(self.m_buffer) or start < self.m_nb_rows
+                or not self.m_buffer.flags.writeable or dtype != self.m_buffer.dtype):
+            buffer = np.empty((nb_rows + nb_rows // 4,) + self.m_buffer.shape[1:], dtype=dtype)
+            buffer[:start] = self.m_buffer[:start]
+            self.m_buffer = buffer
 
+        self.m_buffer[start:nb_rows] = rows
+        self.m_nb_rows = nb_rows
+        self.m_nb_complete_rows = nb_rows if nb_complete_rows is None else start + nb_complete_rows
+        self.m_data_end = data_end
 
 
 
 
-class ImportECLAB_CA(ImportPlugin):
+
+PARSE_CACHE_MAX_BYTES = 1 << 29    # Memory used by the cached data arrays.
+
+class ParseCache:
+    """ In-process cache of the parsed EC-Lab files, shared by the import plugins.
+    Veusz calls getPreview and doImport, and the user may import the same file again
+    with other fields: the file is parsed once and then served from here.
+    Entries are keyed by path, size, modification time, encoding and technique, and
+    the least recently used ones are evicted above m_max_bytes of data.
+    Scripts may import files from several threads: every method holds m_lock.
+    """
+    def __init__(self, max_bytes=PARSE_CACHE_MAX_BYTES):
+        from collections import OrderedDict
+        import threading
+
+        self.m_entries = OrderedDict()
+        self.m_max_bytes = max_bytes
+        self.m_nb_bytes = 0
+        self.m_lock = threading.RLock()
+
+    def key(self, params, descriptor):
+        import os
+
+        try:
+            stat = os.stat(params.filename)
+        except (OSError, TypeError):
+            return None
+        return (os.path.realpath(params.filename), stat.st_size, stat.st_mtime_ns,
+                params.encoding, descriptor)
+
+    def get(self, key):
+        """ Return the ParsedFile of key, or None.
+        """
+        with self.m_lock:
+            if key not in self.m_entries:
+                return None
+            self.m_entries.move_to_end(key)
+            return self.m_entries[key][0]
+
+    def previous(self, key):
+        """ Return the ParsedFile of an older version of the file of key, or None.
+        """
+        with self.m_lock:
+            for old_key in self.m_entries:
+                if old_key[0] == key[0] and old_key[3:] == key[3:]:
+                    return self.m_entries[old_key][0]
+            return None
+
+    def put(self, key, parsed_file):
+        if key is None or parsed_file.nbytes() > self.m_max_bytes:
+            return
+
+        with self.m_lock:
+            # An older version of the same file will never be asked for again.
+            for old_key in [k for k in self.m_entries if k[0] == key[0]]:
+                self.remove(old_key)
+
+            # The size is stored as the buffer of an entry may grow afterwards.
+            self.m_entries[key] = (parsed_file, parsed_file.nbytes())
+            self.m_nb_bytes += parsed_file.nbytes()
+
+            while self.m_nb_bytes > self.m_max_bytes:
+                self.remove(next(iter(self.m_entries)))
+
+    def remove(self, key):
+        with self.m_lock:
+            if key in self.m_entries:
+                self.m_nb_bytes -= self.m_entries.pop(key)[1]
+
+    def clear(self):
+        with self.m_lock:
+            self.m_entries.clear()
+            self.m_nb_bytes = 0
+
+parse_cache = ParseCache()
+
+
+
+
+
+SIDECAR_SUFFIX = ".eclab-cache"
+SIDECAR_VERSION = 4
+SIDECAR_HASH_BYTES = 1 << 20    # Bytes hashed at each end of the source file.
+
+def sidecar_paths(filename):
+    """ Candidate locations of the binary cache of a file: next to the file, then in
+    the user cache directory for read-only archives.
+    Each location is a pair (data .npy file, header .json file).
+    """
+    import hashlib
+    import os
+
+    real_path = os.path.realpath(filename)
+    user_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                            "veusz-eclab")
+    user_name = hashlib.sha1(real_path.encode("utf-8")).hexdigest()
+
+    bases = [real_path + SIDECAR_SUFFIX, os.path.join(user_dir, user_name + SIDECAR_SUFFIX)]
+    return [(base + ".npy", base + ".json") for base in bases]
+
+
+
+def file_signature(filename):
+    """ Size, modification time and a hash of both ends of a file.
+    Hashing the whole file would cost as much as parsing it; the ends catch appended
+    or rewritten data, the size and time catch the rest.
+    """
+    import hashlib
+    import os
+
+    stat = os.stat(filename)
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        file_hash.update(f.read(SIDECAR_HASH_BYTES))
+        if stat.st_size > SIDECAR_HASH_BYTES:
+            f.seek(max(SIDECAR_HASH_BYTES, stat.st_size - SIDECAR_HASH_BYTES))
+            file_hash.update(f.read())
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash.hexdigest()}
+
+
+
+def load_sidecar(params, descriptor, compact=(False, False)):
+    """ Load the binary cache of a file, if there is a valid one.
+    The data array is memory-mapped, so opening a large cached file costs almost nothing.
+    Return header_lines, header_infos, file_header, data_header, data_Np or None.
+    """
+    import json
+    import numpy as np
+
+    try:
+        signature = file_signature(params.filename)
+    except (OSError, TypeError):
+        return None
+
+    for data_path, header_path in sidecar_paths(params.filename):
+        try:
+            with open(header_path, encoding="utf-8") as f:
+                sidecar_header = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        if (sidecar_header.get("version") != SIDECAR_VERSION
+                or sidecar_header.get("source") != signature
+                or sidecar_header.get("encoding") != params.encoding
+                or sidecar_header.get("descriptor") != descriptor
+                or sidecar_header.get("compact") != list(compact)):
+            continue
+
+        try:
+            data_Np = np.load(data_path, mmap_mode='r')
+        except (OSError, ValueError):
+            continue
+        nb_columns = data_Np.shape[1] if data_Np.ndim == 2 else len(data_Np.dtype.names or ())
+        if nb_columns != len(sidecar_header["data_header"]):
+            continue
+
+        return (sidecar_header["header_lines"], sidecar_header["header_infos"], sidecar_header["file_header"],
+                sidecar_header["data_header"], data_Np)
+
+    return None
+
+
+
+def save_sidecar(params, descriptor, parsed_file):
+    """ Write the binary cache of a parsed file: the data array as a raw .npy file and
+    the header lines, parsed header parameters and column names as JSON.
+    The first writable location is used. Failing to write the cache is not an error.
+    """
+    import json
+    import os
+    import numpy as np
+
+    try:
+        signature = file_signature(params.filename)
+    except (OSError, TypeError):
+        return False
+
+    sidecar_header = {"version": SIDECAR_VERSION,
+                      "source": signature,
+                      "encoding": params.encoding,
+                      "descriptor": descriptor,
+                      "compact": list(parsed_file.m_compact),
+                      "header_lines": parsed_file.m_header.m_header_lines,
+                      "header_infos": parsed_file.m_header.m_header_infos,
+                      "file_header": parsed_file.m_file_header,
+                      "data_header": parsed_file.m_data_header,
+                      }
+    data_Np = parsed_file.m_buffer[:parsed_file.m_nb_rows]
+
+    for data_path, header_path in sidecar_paths(params.filename):
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            # The header is written last: a cache without header is never used.
+            with open(data_path + ".tmp", 'wb') as f:
+                np.save(f, data_Np)
+            with open(header_path + ".tmp", 'w', encoding="utf-8") as f:
+                json.dump(sidecar_header, f, default=str)
+            os.replace(data_path + ".tmp", data_path)
+            os.replace(header_path + ".tmp", header_path)
+            return True
+        except OSError:
+            for path in (data_path + ".tmp", header_path + ".tmp"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    return False
+
+
+
+
+
+
+def data_end_position(file, partial_line):
+    """ Position in the file following the last complete row, given the text or bytes
+    read after it. None if the file cannot tell its position.
+    """
+    try:
+        if isinstance(partial_line, bytes):
+            return file.tell() - len(partial_line)
+        return file.tell() - len(partial_line.encode(file.encoding, errors='replace'))
+    except (AttributeError, OSError, ValueError, LookupError, TypeError):
+        return None
+
+
+
+def record_precision_loss(MyHeader, precision_loss):
+    """ Keep the largest relative error of the float32 columns in the header parameters.
+    """
+    MyHeader.m_header_infos["float32_relative_error"] = max([MyHeader.m_header_infos.get("float32_relative_error", 0.0)]
+                                                            + list(precision_loss.values()))
+
+
+
+def join_blocks(blocks, dtype, nb_columns):
+    """ Join the blocks of rows converted apart, in order, into one table. Structured
+    blocks (see compact_dtype) are stored with a dtype able to hold all of them.
+    """
+    import numpy as np
+
+    if dtype is None:
+        return np.concatenate(blocks or [np.empty((0, nb_columns))])
+    for block in blocks:
+        dtype = merge_dtypes(dtype, block.dtype)
+    return np.concatenate([block.astype(dtype, copy=False) for block in blocks] or [np.empty(0, dtype=dtype)])
+
+
+
+PARALLEL_PARSE_MIN_BYTES = 1 << 24    # Smaller data parts are converted by a single process.
+PARALLEL_RANGES_PER_WORKER = 4
+
+def aligned_byte_ranges(filename, data_start, nb_ranges):
+    """ Split the data part of a file, from the byte position data_start to its end,
+    into about nb_ranges byte ranges of whole rows, aligned on the ends of lines.
+    The text following the last end of line, if any, belongs to the last range.
+    Return the starts and stops of the ranges and the position following the last
+    end of line.
+    """
+    import os
+    import numpy as np
+
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        data_end = size
+        while data_end > data_start:
+            block_start = max(data_start, data_end - (1 << 16))
+            f.seek(block_start)
+            position = f.read(data_end - block_start).rfind(b'\n')
+            if position >= 0:
+                data_end = block_start + position + 1
+                break
+            data_end = block_start
+
+        positions = [data_start]
+        for boundary in np.linspace(data_start, data_end, nb_ranges + 1)[1:-1].astype(np.int64).tolist():
+            f.seek(max(boundary - 1, data_start))
+            position = max(boundary - 1, data_start) + len(f.readline())
+            if positions[-1] < position < data_end:
+                positions.append(position)
+
+    return positions, positions[1:] + [size], data_end
+
+
+
+def parse_byte_range(filename, start, stop, nb_columns, usecols=None, shared=False):
+    """ Convert the rows held between two byte positions of an EC-Lab file, in a worker
+    of read_data_parallel.
+    If shared, the array is written to a new shared memory block and (name of the
+    block, shape) is returned: the caller copies it and unlinks the block. Otherwise
+    the array is returned.
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        rows = f.read(stop - start)
+    block = parse_data_block(rows, nb_columns, usecols)
+    if not shared:
+        return block
+
+    memory = shared_memory.SharedMemory(create=True, size=max(block.nbytes, 1))
+    np.ndarray(block.shape, dtype=block.dtype, buffer=memory.buf)[...] = block
+    memory.close()
+    return memory.name, block.shape
+
+
+
+def read_data_parallel(params, data_start, nb_columns, usecols=None, dtype=None, precision_loss=None, workers=0):
+    """ Convert the data part of an EC-Lab file, from the byte position data_start, with
+    several processes (one per core if workers is 0).
+    The data part is split into ranges of whole rows, converted by parse_byte_range in
+    a process pool and sent back through shared memory; the blocks are joined in the
+    order of the file. read_parsed_file only calls it when parse_byte_range can be sent
+    to processes (see process_pool_available).
+    Return the data array, as read_data_rows, and the position following the last
+    complete row.
+    """
+    import os
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import resource_tracker, shared_memory
+
+    workers = workers or os.cpu_count() or 1
+    nb_converted = nb_columns if usecols is None else len(usecols)
+    with ProfileStage("parallel") as stage:
+        starts, stops, data_end = aligned_byte_ranges(params.filename, data_start,
+                                                      workers * PARALLEL_RANGES_PER_WORKER)
+
+        futures = []
+        memories = []
+        blocks = []
+        try:
+            # The workers share the tracker of the shared blocks of this process, which
+            # is told when the blocks are unlinked.
+            resource_tracker.ensure_running()
+            with ProcessPoolExecutor(workers) as executor:
+                futures = [executor.submit(parse_byte_range, params.filename, start, stop, nb_columns, usecols, True)
+                           for start, stop in zip(starts, stops)]
+
+                for future in futures:
+                    name, shape = future.result()
+                    memories.append(shared_memory.SharedMemory(name=name))
+                    block = np.ndarray(shape, buffer=memories[-1].buf)
+                    if dtype is not None:
+                        block = convert_rows(block, dtype, precision_loss)
+                    blocks.append(block)
+
+            data_Np = join_blocks(blocks, dtype, nb_converted)
+            stage["rows"] += len(data_Np)
+        finally:
+            # The views on the shared blocks are released before the blocks.
+            blocks = block = None
+            attached = [memory.name for memory in memories]
+            for future in futures:
+                if (future.done() and not future.cancelled() and future.exception() is None
+                        and future.result()[0] not in attached):
+                    memories.append(shared_memory.SharedMemory(name=future.result()[0]))
+            for memory in memories:
+                memory.close()
+                memory.unlink()
+
+    return data_Np, data_end
+
+
+
+def read_parsed_file(plugin, params, complete_rows_only=False, removed_columns=(), selected_columns=None,
+                     compact=(False, False), workers=1):
+    """ Parse a whole EC-Lab file with the header reader and HeaderInfo of a plugin.
+    Only the columns selected as by select_columns are converted, and they are stored
+    as by compact_dtype.
+    Only the header is decoded: the data part is read and converted as raw bytes,
+    unless the file is compressed or its encoding does not store the numbers as ASCII.
+    With workers other than 1, a large data part is then converted in parallel by
+    read_data_parallel, unless complete_rows_only or the plugin cannot start worker
+    processes (see process_pool_available), which is logged.
+    """
+    import os
+
+    precision_loss = {}
+    raw_data = compression(params.filename) is None and ascii_data(params.encoding)
+    with open_eclab_file(params) as f:
+        with ProfileStage("header"):
+            header_lines = plugin.parse_header(f)
+            file_header = read_column_names(f)
+        usecols = select_columns(file_header, removed_columns, selected_columns)
+        data_header = [file_header[index] for index in usecols]
+        dtype = compact_dtype(data_header, *compact)
+
+        if raw_data:
+            data_start = f.tell()
+        else:
+            data_Np, partial_line = read_data_rows(f, len(file_header), complete_rows_only=complete_rows_only,
+                                                   usecols=usecols, dtype=dtype, precision_loss=precision_loss)
+            data_end = data_end_position(f, partial_line)
+
+    parallel = (raw_data and workers != 1 and not complete_rows_only
+                and os.path.getsize(params.filename) - data_start >= PARALLEL_PARSE_MIN_BYTES)
+    if parallel and not process_pool_available(parse_byte_range):
+        import logging
+        logging.getLogger("ImportEC-LAB").warning(
+            "parse_workers ignored for %s: the plugin file was executed, not imported as a module, so the data "
+            "part cannot be converted by other processes. It is converted by this process.", params.filename)
+        parallel = False
+
+    if parallel:
+        data_Np, data_end = read_data_parallel(params, data_start, len(file_header), usecols, dtype, precision_loss,
+                                               workers)
+        with open(params.filename, 'rb') as f:
+            f.seek(data_end)
+            partial_line = f.read()
+    elif raw_data:
+        with open(params.filename, 'rb') as f:
+            f.seek(data_start)
+            data_Np, partial_line = read_data_rows(f, len(file_header), complete_rows_only=complete_rows_only,
+                                                   usecols=usecols, dtype=dtype, precision_loss=precision_loss)
+            data_end = data_end_position(f, partial_line)
+
+    nb_complete_rows = len(data_Np)
+    if len(partial_line.strip()) > 0 and (not complete_rows_only or finished_row(partial_line, len(file_header))):
+        nb_complete_rows -= 1
+
+    with ProfileStage("header"):
+        MyHeader = plugin.HeaderInfo(header_lines)
+    if compact[1]:
+        record_precision_loss(MyHeader, precision_loss)
+
+    return ParsedFile(MyHeader, data_header, data_Np, data_end, nb_complete_rows, file_header, usecols, compact)
+
+
+
+def read_appended_rows(plugin, params, cache_key, removed_columns=(), selected_columns=None,
+                       compact=(False, False)):
+    """ Incremental import of a file which is still being written by EC-Lab.
+    Only the rows appended since the previous import of the file are converted and
+    added to its ParsedFile; a last line without end of line is read again by the
+    next import, and is only imported now if it is a finished row.
+    Return None if there is no previous import to extend, or if the beginning of
+    the file changed.
+    """
+    previous = parse_cache.previous(cache_key)
+    if (previous is None or previous.m_data_end is None or previous.m_data_end < 1
+            or cache_key[1] < previous.m_data_end
+            or not previous.has_columns(removed_columns, selected_columns)
+            or previous.m_compact != tuple(compact)):
+        return None
+
+    with open_eclab_file(params) as f:
+        if plugin.parse_header(f) != previous.m_header.m_header_lines:
+            return None
+
+    with open(params.filename, 'rb') as f:
+        f.seek(previous.m_data_end - 1)
+        if f.read(1) != b'\n':
+            return None
+        dtype = previous.m_buffer.dtype if previous.m_buffer.dtype.names is not None else None
+        precision_loss = {}
+        rows, partial_line = read_data_rows(f, len(previous.m_file_header), complete_rows_only=True,
+                                            usecols=previous.m_usecols, dtype=dtype, precision_loss=precision_loss)
+        data_end = data_end_position(f, partial_line)
+
+    if data_end is None:
+        return None
+
+    nb_complete_rows = len(rows)
+    if finished_row(partial_line, len(previous.m_file_header)):
+        nb_complete_rows -= 1
+    previous.append_rows(rows, data_end, nb_complete_rows)
+    if previous.m_compact[1]:
+        record_precision_loss(previous.m_header, precision_loss)
+    parse_cache.put(cache_key, previous)
+    return previous
+
+
+
+def scan_runs(filename, data_start, nb_columns, column_index, chunk_size=DATA_CHUNK_SIZE):
+    """ Scan the data part of an EC-Lab file, from the byte position data_start, for the
+    runs of consecutive rows sharing the same value in one column.
+    Only that column is converted. Return the values of the runs, the positions in the
+    file of their first row and the positions following their last row.
+    """
+    import numpy as np
+
+    values = []
+    starts = []
+    previous_value = None
+    position = data_start
+    remainder = b''
+
+    with open(filename, 'rb') as f:
+        f.seek(data_start)
+        while True:
+            with ProfileStage("index") as stage:
+                chunk = f.read(chunk_size)
+                if chunk == b'':
+                    block, remainder = remainder, b''
+                else:
+                    chunk = remainder + chunk
+                    end_of_rows = chunk.rfind(b'\n') + 1
+                    block, remainder = chunk[:end_of_rows], chunk[end_of_rows:]
+
+                # Positions of the rows in the block; blank lines are not rows.
+                line_ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n')) + 1
+                if len(block) > 0 and not block.endswith(b'\n'):
+                    line_ends = np.append(line_ends, len(block))
+                line_starts = np.concatenate(([0], line_ends[:-1]))
+                line_starts = line_starts[line_ends - line_starts > 2]
+
+                block_values = parse_data_block(block, nb_columns, [column_index])[:, 0]
+                if len(block_values) != len(line_starts):
+                    raise ValueError('Malformed data in EC-LAB file.')
+
+                if len(block_values) > 0:
+                    changes = np.flatnonzero(block_values[1:] != block_values[:-1]) + 1
+                    if previous_value is None or block_values[0] != previous_value:
+                        changes = np.concatenate(([0], changes))
+                    values.append(block_values[changes])
+                    starts.append(position + line_starts[changes])
+                    previous_value = block_values[-1]
+                stage["rows"] += len(block_values)
+
+            position += len(block)
+            if chunk == b'':
+                break
+
+    values = np.concatenate(values).astype(np.int64) if values else np.empty(0, dtype=np.int64)
+    starts = np.concatenate(starts).astype(np.int64) if starts else np.empty(0, dtype=np.int64)
+    stops = np.append(starts[1:], position)
+    return values, starts, stops
+
+
+
+class RowIndex:
+    """ Byte-offset index of the runs of rows of an EC-Lab file sharing the same value in
+    a column (cycle number, half cycle...), as kept in row_index_cache.
+    m_runs maps the index of a column to the values of its runs, the positions of their
+    first row and the positions following their last row. A column is scanned the
+    first time it is asked for.
+    """
+    def __init__(self, data_start, nb_columns):
+        self.m_data_start = data_start
+        self.m_nb_columns = nb_columns
+        self.m_runs = {}
+
+    def nbytes(self):
+        return sum(array.nbytes for runs in self.m_runs.values() for array in runs)
+
+    def runs(self, params, column_index):
+        if column_index not in self.m_runs:
+            self.m_runs[column_index] = scan_runs(params.filename, self.m_data_start, self.m_nb_columns,
+                                                  column_index)
+        return self.m_runs[column_index]
+
+row_index_cache = ParseCache(max_bytes=1 << 24)
+
+
+
+def merge_ranges(starts, stops):
+    """ Join the byte ranges which follow each other.
+    """
+    import numpy as np
+
+    if len(starts) == 0:
+        return starts, stops
+    joined = starts[1:] == stops[:-1]
+    return starts[np.append(True, ~joined)], stops[np.append(~joined, True)]
+
+
+
+def intersect_ranges(ranges, other_ranges):
+    """ Intersection of two lists of sorted, disjoint byte ranges (starts, stops).
+    """
+    import numpy as np
+
+    starts = []
+    stops = []
+    index = other_index = 0
+    (range_starts, range_stops), (other_starts, other_stops) = ranges, other_ranges
+    while index < len(range_starts) and other_index < len(other_starts):
+        start = max(range_starts[index], other_starts[other_index])
+        stop = min(range_stops[index], other_stops[other_index])
+        if start < stop:
+            starts.append(start)
+            stops.append(stop)
+        if range_stops[index] < other_stops[other_index]:
+            index += 1
+        else:
+            other_index += 1
+    return np.array(starts, dtype=np.int64), np.array(stops, dtype=np.int64)
+
+
+
+def read_header_position(plugin, params):
+    """ Read the header of an EC-Lab file for a plugin.
+    Return the header lines, the names of the columns and the byte position of the
+    first row of data.
+    """
+    with open_eclab_file(params) as f:
+        with ProfileStage("header"):
+            header_lines = plugin.parse_header(f)
+            file_header = read_column_names(f)
+        data_start = f.tell()
+    return header_lines, file_header, data_start
+
+
+
+def read_byte_ranges(plugin, params, header_lines, file_header, ranges, removed_columns=(), selected_columns=None,
+                     compact=(False, False)):
+    """ Convert the rows held in byte ranges (starts, stops) of an EC-Lab file, seeking
+    directly to each range. The columns are selected and stored as by read_parsed_file.
+    Return the header, the names of the imported columns and their data.
+    """
+    usecols = select_columns(file_header, removed_columns, selected_columns)
+    data_header = [file_header[index] for index in usecols]
+    dtype = compact_dtype(data_header, *compact)
+    precision_loss = {}
+    blocks = []
+    with open(params.filename, 'rb') as f:
+        for start, stop in zip(*ranges):
+            f.seek(start)
+            with ProfileStage("decode"):
+                rows = f.read(stop - start)
+            block = parse_data_block(rows, len(file_header), usecols)
+            if dtype is not None:
+                with ProfileStage("compact") as stage:
+                    block = convert_rows(block, dtype, precision_loss)
+                    stage["rows"] += len(block)
+            blocks.append(block)
+
+    data_Np = join_blocks(blocks, dtype, len(usecols))
+
+    MyHeader = plugin.HeaderInfo(header_lines)
+    if compact[1]:
+        record_precision_loss(MyHeader, precision_loss)
+    return MyHeader, data_header, data_Np
+
+
+
+def read_selected_rows(plugin, params, selections, removed_columns=(), selected_columns=None,
+                       compact=(False, False)):
+    """ Read only the rows of an EC-Lab file whose values are in all the selections
+    (see row_selections), seeking directly to them.
+    The positions of the runs of rows of each selected column are found with the
+    RowIndex of the file, built by the first selective import and kept in
+    row_index_cache. The columns are selected and stored as by read_parsed_file.
+    Return the header, the names of the imported columns and their data.
+    """
+    import numpy as np
+
+    header_lines, file_header, data_start = read_header_position(plugin, params)
+
+    cache_key = row_index_cache.key(params, plugin.descriptor)
+    row_index = row_index_cache.get(cache_key)
+    if row_index is None or row_index.m_data_start != data_start:
+        row_index = RowIndex(data_start, len(file_header))
+
+    ranges = None
+    for name, values in selections:
+        if name not in file_header:
+            raise ValueError('No column ' + name + ' in EC-LAB file.')
+        run_values, run_starts, run_stops = row_index.runs(params, file_header.index(name))
+        selected = np.isin(run_values, values)
+        column_ranges = merge_ranges(run_starts[selected], run_stops[selected])
+        ranges = column_ranges if ranges is None else intersect_ranges(ranges, column_ranges)
+    row_index_cache.put(cache_key, row_index)
+
+    return read_byte_ranges(plugin, params, header_lines, file_header, ranges, removed_columns, selected_columns,
+                            compact)
+
+
+
+
+
+TIME_UNITS = {"s": 1.0, "min": 60.0, "h": 3600.0}
+
+def time_window(params):
+    """ The time window set in the fields of an import, as (start, stop) in seconds,
+    or None.
+    """
+    fields = params.field_results
+    if not fields["time_window"]:
+        return None
+    unit = TIME_UNITS[fields["time_unit"]]
+    return fields["time_start"] * unit, fields["time_stop"] * unit
+
+
+
+def select_time_window(data_header, data_Np, window):
+    """ The rows of a data table in a time window, as a view: the time is increasing.
+    """
+    import numpy as np
+
+    if "time/s" not in data_header:
+        raise ValueError('No column time/s in EC-LAB file.')
+    time = table_columns(data_Np)[data_header.index("time/s")]
+    start, stop = np.searchsorted(time, window[0], side='left'), np.searchsorted(time, window[1], side='right')
+    return data_Np[start:stop]
+
+
+
+def row_at(f, position, data_start, nb_columns, column_index):
+    """ The first row of an EC-Lab file (opened in binary mode) starting at or after a
+    byte position: the position of the row and its value in one column.
+    The position may fall inside a row: the search resyncs on the next end of line.
+    Return None if there is no row after the position.
+    """
+    if position > data_start:
+        f.seek(position - 1)
+        position = position - 1 + len(f.readline())
+    else:
+        f.seek(position)
+
+    line = f.readline()
+    while line.strip() == b'':    # Blank lines are not rows.
+        if line == b'':
+            return None
+        position += len(line)
+        line = f.readline()
+
+    return position, parse_data_block(line, nb_columns, [column_index])[0, 0]
+
+
+
+def bisect_rows(f, value, data_start, data_stop, nb_columns, column_index, side='left'):
+    """ Byte position of the first row of an EC-Lab file whose value in an increasing
+    column is >= value ('left') or > value ('right'), data_stop if there is none.
+    The file is bisected on byte positions: only a few rows are read and converted.
+    """
+    low, high = data_start, data_stop
+    while low < high:
+        middle = (low + high) // 2
+        row = row_at(f, middle, data_start, nb_columns, column_index)
+        if row is None or row[1] > value or (side == 'left' and row[1] == value):
+            high = middle
+        else:
+            low = middle + 1
+
+    row = row_at(f, low, data_start, nb_columns, column_index)
+    return data_stop if row is None else row[0]
+
+
+
+def read_time_window(plugin, params, window, removed_columns=(), selected_columns=None, compact=(False, False)):
+    """ Read only the rows of an EC-Lab file in a time window (start, stop) in seconds.
+    The time increases along the file, so the first and last rows of the window are
+    found by bisecting the file, and only the rows between them are read.
+    Return the header, the names of the imported columns and their data.
+    """
+    import numpy as np
+    import os
+
+    header_lines, file_header, data_start = read_header_position(plugin, params)
+    if "time/s" not in file_header:
+        raise ValueError('No column time/s in EC-LAB file.')
+
+    with ProfileStage("bisect"):
+        with open(params.filename, 'rb') as f:
+            data_stop = os.fstat(f.fileno()).st_size
+            arguments = (data_start, data_stop, len(file_header), file_header.index("time/s"))
+            start = bisect_rows(f, window[0], *arguments, side='left')
+            stop = bisect_rows(f, window[1], *arguments, side='right')
+
+    ranges = (np.array([start], dtype=np.int64), np.array([max(start, stop)], dtype=np.int64))
+    return read_byte_ranges(plugin, params, header_lines, file_header, ranges, removed_columns, selected_columns,
+                            compact)
+
+
+
+
+
+MPR_MAGIC = b'BIO-LOGIC MODULAR FILE\x1a'
+MPR_HEADER_SIZE = 0x34
+
+# Column IDs of the data module of .mpr files: name, as in the ASCII export, and type.
+MPR_COLUMNS = {4: ('time/s', '<f8'),
+               5: ('control/V/mA', '<f4'),
+               6: ('Ewe/V', '<f4'),
+               7: ('dq/mA.h', '<f8'),
+               8: ('I/mA', '<f4'),
+               9: ('Ece/V', '<f4'),
+               11: ('<I>/mA', '<f8'),
+               13: ('(Q-Qo)/mA.h', '<f8'),
+               16: ('Analog IN 1/V', '<f4'),
+               19: ('control/V', '<f4'),
+               20: ('control/mA', '<f4'),
+               23: ('dQ/mA.h', '<f8'),
+               24: ('cycle number', '<f8'),
+               26: ('Rapp/Ohm', '<f4'),
+               32: ('freq/Hz', '<f4'),
+               33: ('|Ewe|/V', '<f4'),
+               34: ('|I|/A', '<f4'),
+               35: ('Phase(Z)/deg', '<f4'),
+               36: ('|Z|/Ohm', '<f4'),
+               37: ('Re(Z)/Ohm', '<f4'),
+               38: ('-Im(Z)/Ohm', '<f4'),
+               39: ('I Range', '<u2'),
+               69: ('R/Ohm', '<f4'),
+               70: ('P/W', '<f4'),
+               74: ('Energy/W.h', '<f8'),
+               75: ('Analog OUT/V', '<f4'),
+               76: ('<I>/mA', '<f4'),
+               77: ('<Ewe>/V', '<f4'),
+               123: ('Energy charge/W.h', '<f8'),
+               124: ('Energy discharge/W.h', '<f8'),
+               125: ('Capacitance charge/\u00b5F', '<f8'),
+               126: ('Capacitance discharge/\u00b5F', '<f8'),
+               131: ('Ns', '<u2'),
+               169: ('Cs/\u00b5F', '<f4'),
+               172: ('Cp/\u00b5F', '<f4'),
+               174: ('<Ewe>/V', '<f4'),
+               434: ('(Q-Qo)/C', '<f4'),
+               435: ('dQ/C', '<f4'),
+               467: ('Q charge/discharge/mA.h', '<f8'),
+               468: ('half cycle', '<u4'),
+               469: ('z cycle', '<u4'),
+               471: ('<Ece>/V', '<f4'),
+               }
+
+# Column IDs stored as bits of a single flags byte: name and bit mask.
+MPR_FLAGS = {1: ('mode', 0x03),
+             2: ('ox/red', 0x04),
+             3: ('error', 0x08),
+             21: ('control changes', 0x10),
+             31: ('Ns changes', 0x20),
+             65: ('counter inc.', 0x80),
+             }
+
+class MPRFile:
+    """ Reader of the binary EC-Lab files (.mpr).
+    The file is a list of modules (settings, data, log...) each with a short header.
+    The file is memory-mapped and the rows of the data module are read through a
+    structured dtype, so the columns are views on the file, not copies.
+    """
+    def __init__(self, filename):
+        import mmap
+
+        with open(filename, 'rb') as f:
+            try:
+                self.m_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file.
+                raise ValueError('Not a EC-LAB binary file.')
+
+        if not self.m_map[:len(MPR_MAGIC)] == MPR_MAGIC:
+            raise ValueError('Not a EC-LAB binary file.')
+
+        self.m_modules = self.read_modules()
+        if "VMP data" not in self.m_modules:
+            raise ValueError('No data in EC-LAB binary file.')
+        self.m_records, self.m_column_ids = self.read_data_module(self.m_modules["VMP data"])
+
+    def read_modules(self):
+        """ Find the modules of the file: {short name: (long name, version, date, offset, length)}.
+        """
+        import struct
+
+        modules = {}
+        position = MPR_HEADER_SIZE
+        while position < len(self.m_map):
+            if not self.m_map[position:position + 6] == b'MODULE':
+                raise ValueError('Corrupted EC-LAB binary file.')
+            position += 6
+
+            short_name, long_name, length, version, date = struct.unpack_from('<10s25sII8s', self.m_map, position)
+            header_size = struct.calcsize('<10s25sII8s')
+            if length == 0xFFFFFFFF:
+                # Newer module header, with the maximum length stored before the length.
+                short_name, long_name, _, length, version, _, date = struct.unpack_from('<10s25sIIII8s', self.m_map, position)
+                header_size = struct.calcsize('<10s25sIIII8s')
+            position += header_size
+
+            if position + length > len(self.m_map):
+                raise ValueError('Truncated EC-LAB binary file.')
+
+            modules[short_name.decode('latin-1').strip()] = (long_name.decode('latin-1').strip(), version,
+                                                             date.decode('latin-1'), position, length)
+            position += length
+
+        return modules
+
+    def module_data(self, short_name):
+        """ Raw content of a module ("VMP Set", "VMP data", "VMP LOG"...), without copy.
+        """
+        _, _, _, offset, length = self.m_modules[short_name]
+        return memoryview(self.m_map)[offset:offset + length]
+
+    def read_data_module(self, module):
+        """ Map the rows of the data module on a structured array.
+        """
+        import numpy as np
+
+        _, version, _, offset, length = module
+        nb_points = int(np.frombuffer(self.m_map, dtype='<u4', count=1, offset=offset)[0])
+        nb_columns = int(np.frombuffer(self.m_map, dtype='u1', count=1, offset=offset + 4)[0])
+
+        if version == 0:
+            column_ids = np.frombuffer(self.m_map, dtype='u1', count=nb_columns, offset=offset + 5)
+            data_offset = offset + 100
+        elif version in (2, 3):
+            column_ids = np.frombuffer(self.m_map, dtype='<u2', count=nb_columns, offset=offset + 5)
+            data_offset = offset + (405 if version == 2 else 406)
+        else:
+            raise ValueError('Unsupported EC-LAB binary file version.')
+
+        fields = []
+        for column_id in column_ids.tolist():
+            if column_id in MPR_FLAGS:
+                if not ('flags', 'u1') in fields:
+                    fields.append(('flags', 'u1'))
+            elif column_id in MPR_COLUMNS:
+                name, dtype = MPR_COLUMNS[column_id]
+                if name in [field[0] for field in fields]:
+                    name = name + " #" + str(column_id)
+                fields.append((name, dtype))
+            else:
+                raise ValueError('Unknown column ' + str(column_id) + ' in EC-LAB binary file.')
+
+        dtype = np.dtype(fields)
+        if data_offset + nb_points * dtype.itemsize > offset + length:
+            raise ValueError('Truncated EC-LAB binary file.')
+
+        records = np.frombuffer(self.m_map, dtype=dtype, count=nb_points, offset=data_offset)
+        return records, column_ids.tolist()
+
+    def columns(self):
+        """ Return the names of the columns and their data, in the order of the file.
+        The columns are views on the file, except the flags which are unpacked.
+        """
+        names = []
+        columns = []
+        for column_id in self.m_column_ids:
+            if column_id in MPR_FLAGS:
+                name, mask = MPR_FLAGS[column_id]
+                shift = (mask & -mask).bit_length() - 1
+                names.append(name)
+                columns.append((self.m_records['flags'] & mask) >> shift)
+
+        for name in self.m_records.dtype.names:
+            if name != 'flags':
+                names.append(name)
+                columns.append(self.m_records[name])
+
+        return names, columns
+
+    def export_columns(self):
+        """ Return the names of the columns and their data, with the columns that the
+        ASCII export adds and the plugins use. The columns of the file are views on it.
+        """
+        import numpy as np
+
+        names, columns = self.columns()
+
+        if "(Q-Qo)/C" not in names and "(Q-Qo)/mA.h" in names:
+            names.append("(Q-Qo)/C")
+            columns.append(columns[names.index("(Q-Qo)/mA.h")] * 3.6)
+        if "Capacity/mA.h" not in names and "Q charge/discharge/mA.h" in names:
+            names.append("Capacity/mA.h")
+            columns.append(np.abs(columns[names.index("Q charge/discharge/mA.h")]))
+
+        return names, columns
+
+    def table(self):
+        """ Return the data as the text import does: names of the columns (see
+        export_columns) and a float64 array, into which all the columns are copied.
+        """
+        names, columns = self.export_columns()
+        return names, float_table(columns, len(self.m_records))
+
+
+
+def is_binary_file(filename):
+    import os
+    return os.path.splitext(str(filename))[1].lower() == '.mpr'
+
+
+
+def read_mpr_file(plugin, params, compact=(False, False)):
+    """ Parse a binary EC-Lab file for a plugin.
+    The columns are copied into a float64 table, as the text import stores them, unless
+    they are stored compactly (see compact_dtype): they are then converted from the
+    memory-mapped file directly into the compact table.
+    The settings module does not give the electrode surface and mass in a documented
+    way: the header defaults to 1 cm2 and 1 mg, to be set with the fields of the import.
+    """
+    precision_loss = {}
+    with ProfileStage("mpr") as stage:
+        mpr_file = MPRFile(params.filename)
+        data_header, columns = mpr_file.export_columns()
+        dtype = compact_dtype(data_header, *compact)
+        if dtype is None:
+            data_Np = float_table(columns, len(mpr_file.m_records))
+        else:
+            data_Np = convert_columns(columns, dtype, precision_loss)
+        stage["rows"] += len(data_Np)
+
+    header_lines = [plugin.descriptor,
+                    "Electrode surface area : 1 cm2\n",
+                    "Characteristic mass : 1 mg\n",
+                    ] + plugin.mpr_header_lines
+
+    MyHeader = plugin.HeaderInfo(header_lines)
+    if compact[1]:
+        record_precision_loss(MyHeader, precision_loss)
+
+    return ParsedFile(MyHeader, data_header, data_Np, compact=compact)
+
+
+
+
+
+def check_mpr_columns(plugin, params, data_header):
+    """ Check that a binary file has the columns the plugin needs with the fields of
+    the import. The technique of a binary file is not read: a file of another
+    technique is reported here rather than failing later on a missing column.
+    """
+    missing_columns = [name for name in plugin.required_columns(params) if name not in data_header]
+    if missing_columns:
+        raise ValueError('Columns missing from the EC-LAB binary file for the ' + plugin.name + ' plugin: '
+                         + ', '.join(sorted(set(missing_columns), key=missing_columns.index)) + '.')
+
+
+
+
+
+def read_eclab_file(plugin, params, nb_rows=None, removed_columns=(), selected_columns=None, selections=(),
+                    window=None):
+    """ Read an EC-Lab file for a plugin, through the parse cache, the incremental
+    reader and the binary sidecar cache, as enabled by the fields of the import.
+    If nb_rows is given, only the first nb_rows rows of data are needed. Only the
+    columns selected as by select_columns are converted, unless they are already cached.
+    Otherwise, only the rows in the selections (see row_selections) and in the time
+    window (start, stop) in seconds, if any, are imported. If the file is not cached,
+    only these rows are read, by read_time_window or read_selected_rows, unless the
+    file is compressed, as the rows of a compressed file cannot be reached without
+    decompressing all the rows before them, or its encoding does not store the
+    numbers as ASCII.
+    The data is stored as set by the "compact_integers" and "single_precision" fields.
+    A large data part is converted by params.parse_workers processes, if the parameters
+    of the import have this attribute (see ImportParams): the dialog of Veusz executes
+    the plugin file, whose functions cannot be sent to other processes.
+    Return the header, the names of the imported columns and their data.
+    """
+    fields = params.field_results
+    compact = (fields["compact_integers"], fields["single_precision"])
+    seekable = compression(params.filename) is None and ascii_data(params.encoding)
+    cache_key = parse_cache.key(params, plugin.descriptor)
+    parsed_file = parse_cache.get(cache_key)
+    if parsed_file is not None and (not parsed_file.has_columns(removed_columns, selected_columns)
+                                    or parsed_file.m_compact != compact):
+        parsed_file = None
+
+    if parsed_file is None and is_binary_file(params.filename):
+        parsed_file = read_mpr_file(plugin, params, compact)
+        parse_cache.put(cache_key, parsed_file)
+
+    if parsed_file is None and nb_rows is None and fields["incremental"] and seekable:
+        parsed_file = read_appended_rows(plugin, params, cache_key, removed_columns, selected_columns, compact)
+
+    if parsed_file is None and fields["disk_cache"]:
+        sidecar = load_sidecar(params, plugin.descriptor, compact)
+        if sidecar is not None:
+            header_lines, header_infos, file_header, data_header, data_Np = sidecar
+            MyHeader = plugin.HeaderInfo(header_lines)
+            if compact[1]:
+                record_precision_loss(MyHeader, {"": header_infos.get("float32_relative_error", 0.0)})
+            parsed_file = ParsedFile(MyHeader, data_header, data_Np,
+                                     file_header=file_header,
+                                     usecols=[file_header.index(name) for name in data_header],
+                                     compact=compact)
+            if parsed_file.has_columns(removed_columns, selected_columns):
+                parse_cache.put(cache_key, parsed_file)
+            else:
+                parsed_file = None
+
+    if parsed_file is None and nb_rows is None and window is not None and seekable:
+        MyHeader, data_header, data_Np = read_time_window(plugin, params, window, removed_columns, selected_columns,
+                                                          compact)
+        if selections:
+            data_Np = select_rows(data_header, data_Np, selections)
+        return MyHeader, data_header, data_Np
+
+    if parsed_file is None and nb_rows is None and selections and seekable:
+        return read_selected_rows(plugin, params, selections, removed_columns, selected_columns, compact)
+
+    if parsed_file is None and nb_rows is not None:
+        # Header-only preview: the file is not parsed further than the first rows.
+        with open_eclab_file(params) as f:
+            with ProfileStage("header"):
+                header_lines = plugin.parse_header(f)
+            data_header, data_Np = read_data_block(f, max_rows=nb_rows, removed_columns=removed_columns,
+                                                   selected_columns=selected_columns)
+        return plugin.HeaderInfo(header_lines), data_header, data_Np
+
+    if parsed_file is None:
+        parsed_file = read_parsed_file(plugin, params, fields["incremental"] and seekable, removed_columns,
+                                       selected_columns, compact, getattr(params, "parse_workers", 1))
+        parse_cache.put(cache_key, parsed_file)
+        if fields["disk_cache"]:
+            save_sidecar(params, plugin.descriptor, parsed_file)
+
+    MyHeader, data_header, data_Np = parsed_file.contents(removed_columns, selected_columns)
+    if is_binary_file(params.filename):
+        check_mpr_columns(plugin, params, data_header)
+    if nb_rows is not None:
+        data_Np = data_Np[:nb_rows]
+    else:
+        if window is not None:
+            data_Np = select_time_window(data_header, data_Np, window)
+        if selections:
+            data_Np = select_rows(data_header, data_Np, selections)
+    return MyHeader, data_header, data_Np
+
+
+
+
+
+
+class ImportECLAB_Base(ImportPlugin):
+    """ Fields and import shared by the EC-LAB plugins: the file is read, completed
+    with the derived columns, split and decimated into datasets. The plugin of each
+    technique gives its HeaderInfo and descriptor, and its own fields, columns and
+    analysis.
+    """
+    author = "Arthur Langlard"
+    file_extensions = ECLAB_EXTENSIONS
+
+    # Header lines needed by HeaderInfo and missing from binary files.
+    mpr_header_lines = []
+
+    # Columns added by doImport: name, source column and divisors (see add_derived_columns).
+    derived_columns = []
+
+    # Fields selecting the rows to import, and the columns they select on.
+    selection_fields = {"cycles": "cycle number"}
+
+    # Fields splitting the data into datasets, and the columns they split on, in order.
+    split_fields = {"extract_cycles": "cycle number"}
+
+    # Columns (x, y) on which the rows kept by the decimation are chosen.
+    decimation_columns = ("time/s", "Ewe/V")
+
+    # Columns only imported with "import_all_data", unless doImport uses them.
+    misc_columns = ['mode',
+                    'ox/red',
+                    'error',
+                    'control changes',
+                    'counter inc.',
+                    'I Range',
+                    ]
+
+    # Error raised by parse_header for the files of other techniques.
+    parse_error = 'Not a EC-LAB file of this technique.'
+
+    selection_descriptions = {"cycles": "Cycles to import, e.g. '1; 100; 200-210' (all if empty).",
+                              "steps": "Steps (half cycles) to import, e.g. '0-3' (all if empty).",
+                              }
+
+
+
+    def parse_header(self, file):
+        """ Read the header part of the file, up to the names of the data columns.
+        """
+        return read_header_lines(file, self.descriptor, self.parse_error)
+
+
+
+    def split_by_variable(self, data_header, columns, cycling_index, do_split=False):
+        if not do_split:
+            return [data_header], [columns]
+
+        return split_by_column(data_header, columns, cycling_index)
+
+
+
+    def split(self, params, data_header, columns):
+        """ Split the data into datasets with the fields of split_fields: each field
+        splits the datasets of the previous ones.
+        """
+        Data_headers = [data_header]
+        Cycles_np = [columns]
+
+        for field, column in self.split_fields.items():
+            if not params.field_results[field]:
+                continue
+            cycling_index = data_header.index(column)
+            Data_headers_b = []
+            Cycles_np_b = []
+            for data_header, columns in zip(Data_headers, Cycles_np):
+                D_h_temp, C_np_temp = self.split_by_variable(data_header, columns, cycling_index, True)
+                Data_headers_b = Data_headers_b + D_h_temp
+                Cycles_np_b = Cycles_np_b + C_np_temp
+            Data_headers, Cycles_np = Data_headers_b, Cycles_np_b
+
+        return Data_headers, Cycles_np
+
+
+
+
+
+    def __init__(self):
+        ImportPlugin.__init__(self)
+        self.m_profile = None    # Stages of the last import, with the "profile" field.
+
+        self.fields = self.technique_fields() + [
+            ImportFieldCheck("import_all_data", descr="Import misc. data."),
+            ImportFieldText("columns", descr="Columns to import, separated by ';' (all if empty)."),
+            ] + [ImportFieldText(field, descr=self.selection_descriptions[field]) for field in self.selection_fields] + [
+            ImportFieldCheck("time_window", descr="Only import the rows of a time window."),
+            ImportFieldFloat("time_start", descr="Start of the time window", default=0.0),
+            ImportFieldFloat("time_stop", descr="End of the time window", default=0.0),
+            ImportFieldCombo("time_unit", descr="Unit of the time window", items=("s", "min", "h"),
+                             editable=False, default="h"),
+            ImportFieldCombo("decimation", descr="Decimation of each dataset for plotting",
+                             items=("none", "min/max", "LTTB"), editable=False, default="none"),
+            ImportFieldInt("decimation_points", descr="Points per decimated dataset", default=5000, minval=3),
+            ImportFieldCheck("full_resolution", descr="Also import the full data, as datasets named '... full'."),
+            ImportFieldCheck("disk_cache", descr="Keep a binary cache next to the file."),
+            ImportFieldCheck("incremental", descr="Only read the rows added since the last import."),
+            ImportFieldCheck("compact_integers", descr="Store flags, counters and cycle numbers as small integers."),
+            ImportFieldCheck("single_precision", descr="Store measurements as float32 (less memory, less precision)."),
+            ImportFieldCheck("profile", descr="Log the time and memory of each stage of the import."),
+
+            ImportFieldCheck("change_surface", descr="Define a surface"),
+            ImportFieldFloat("surface", descr="Surface", default=1.0),
+            ImportFieldCombo("surface_unit", descr="Surface unit", items=("m2", "cm2", "mm2"),
+                             editable=False, default="cm2"),
+
+            ImportFieldCheck("change_mass", descr="Define a mass"),
+            ImportFieldFloat("mass", descr="Mass", default=1.0),
+            ImportFieldCombo("mass_unit", descr="Mass unit", items=("g", "mg", "ng"),
+                             editable=False, default="mg")
+            ]
+
+
+
+    def technique_fields(self):
+        """ Fields of the technique, shown first.
+        """
+        return [ImportFieldCheck("extract_cycles", descr="Import cycles as separate datasets.")]
+
+
+
+    def analysis_columns(self, params):
+        """ Names of the columns used by the analysis of the technique, if enabled.
+        """
+        return []
+
+
+
+    def header_datasets(self, header_infos):
+        """ Parameters of the header imported as single values, besides the mass, the
+        surface and the offset voltage.
+        """
+        return []
+
+
+
+    def analysis_datasets(self, params, data_header, columns, header_infos):
+        """ Datasets of the analysis of the technique, if enabled.
+        """
+        return []
+
+
+
+    def misc_data(self, params):
+        """ Names of the columns which are only imported with "import_all_data".
+        """
+        required_columns = self.required_columns(params)
+        return [column for column in self.misc_columns if column not in required_columns]
+
+
+
+    def required_columns(self, params):
+        """ Names of the columns used by doImport, imported along any subset of columns.
+        """
+        required_columns = []
+        for _, source, _ in self.derived_columns:
+            if source not in required_columns:
+                required_columns = required_columns + [source]
+        for field, column in self.split_fields.items():
+            if params.field_results[field]:
+                required_columns = required_columns + [column]
+        required_columns = required_columns + self.analysis_columns(params)
+        if params.field_results["time_window"]:
+            required_columns = required_columns + ["time/s"]
+        for field, column in self.selection_fields.items():
+            if params.field_results[field].strip() != "":
+                required_columns = required_columns + [column]
+        if params.field_results["decimation"] != "none":
+            required_columns = required_columns + list(self.decimation_columns)
+        return required_columns
+
+
+
+    def import_dataset(self, params, nb_rows=None):
+        """ Read the file and convert the columns to import: the columns given in the
+        "columns" field, else all but the misc. data.
+        If nb_rows is given, only the first nb_rows rows of data are read, else only
+        the rows selected by the fields (cycles, steps, time window), if any.
+        """
+        selections = row_selections(params, self.selection_fields)
+        window = time_window(params)
+        selected_columns = parse_column_list(params.field_results["columns"])
+        if selected_columns:
+            return read_eclab_file(self, params, nb_rows,
+                                   selected_columns=selected_columns + self.required_columns(params),
+                                   selections=selections, window=window)
+
+        removed_columns = []
+        if not params.field_results["import_all_data"]:
+            removed_columns = self.misc_data(params)
+        return read_eclab_file(self, params, nb_rows, removed_columns, selections=selections, window=window)
+
+
+
+    def getPreview(self, params):
+        max_data_len = 20
+        try:
+            MyHeader, data_header, data_Np = self.import_dataset(params, nb_rows=max_data_len)
+        except ValueError:
+            return ("File cannot be displayed", False)
+
+        header_string = MyHeader.m_header_string
+        data_header_string = '\t'.join(data_header)
+        data_string = "\n"
+        if len(data_Np) < max_data_len:
+            max_data_len = len(data_Np) - 1
+        for data_line in data_Np[:max_data_len]:
+            for value in data_line:
+                data_string = data_string + "{:.4e}".format(value) + "\t"
+            data_string = data_string + "\n"
+
+        return (header_string + data_header_string + data_string, True)
+
+
+
+    def doImport(self, params):
+        """Actually imports data.
+        params is a ImportPluginParams object.
+        Return a list of ImportDataset1D objects.
+        With the "profile" field, the time and memory of the stages of the import are
+        logged and kept in m_profile.
+        """
+        profile = start_profile(params)
+        try:
+            return self.import_datasets(params)
+        finally:
+            self.m_profile = finish_profile(profile)
+
+
+
+    def import_datasets(self, params):
+        """ Read the file and build the datasets.
+        """
+
+        MyHeader, data_header, data_Np = self.import_dataset(params)
+        header_infos = MyHeader.m_header_infos
+
+
+        # Add generated values to the data table.
+        if params.field_results["change_surface"]:
+            header_infos["surface"] = params.field_results["surface"]
+            header_infos["surface_unit"] = params.field_results["surface_unit"]
+
+        if params.field_results["change_mass"]:
+            header_infos["mass"] = params.field_results["mass"]
+            header_infos["mass_unit"] = params.field_results["mass_unit"]
+
+        with ProfileStage("derived") as stage:
+            data_header, columns = add_derived_columns(data_header, table_columns(data_Np), self.derived_columns,
+                                                       header_infos)
+            stage["rows"] += len(data_Np)
+
+        generated_datasets_single_values = [ImportDataset1D("mass/" + header_infos["mass_unit"],
+                                                            header_infos["mass"]),
+                                            ImportDataset1D("surface/" + header_infos["surface_unit"],
+                                                            header_infos["surface"]),
+                                            ] + self.header_datasets(header_infos) + [
+                                            ImportDataset1D("offset_voltage/VvsNHE",
+                                                            header_infos["offset_voltage_vs_SHE"]),
+                                            ]
+        if params.field_results["single_precision"]:
+            generated_datasets_single_values.append(ImportDataset1D("float32_relative_error",
+                                                                    header_infos.get("float32_relative_error", 0.0)))
+
+        generated_datasets_single_values = generated_datasets_single_values + self.analysis_datasets(
+            params, data_header, columns, header_infos)
+
+
+        # Split data into separate cyles.
+        axes = decimation_axes(data_header, self.decimation_columns)
+        Data_headers, Cycles_np = self.split(params, data_header, columns)
+
+        # Reduce the datasets to the points needed for plotting.
+        Data_headers, Cycles_np = decimate_blocks(Data_headers, Cycles_np, axes, params.field_results["decimation"],
+                                                  params.field_results["decimation_points"],
+                                                  params.field_results["full_resolution"])
+        imported_datasets = []
+
+        with ProfileStage("datasets"):
+            for data_header, columns in zip(Data_headers, Cycles_np):
+                labeled_datasets = zip(data_header, columns)
+                imported_datasets = imported_datasets + [ImportDataset1D(*data) for data in labeled_datasets]
+
+
+        return imported_datasets + generated_datasets_single_values
+
+
+
+
+
+
+
+
+
+
+class ImportECLAB_CV(ImportECLAB_Base):
+    name = "EC-LAB CV"
+    description = "Imports cyclic voltammetry measurements from EC-LAB files."
+    descriptor = "Cyclic Voltammetry\n"
+    parse_error = 'Not a Cyclic Voltammetry file.'
+
+    # Comment this line to remove the tab of the plugin
+    promote_tab = 'EC-LAB CV'
+
+    mpr_header_lines = ["dE/dt               0\n",
+                        "dE/dt unit          mV/s\n",
+                        ]
+
+    derived_columns = [("<I>_per_surf/mA/{surface_unit}", "<I>/mA", ["surface"]),
+                       ("(Q-Qo)_per_mass/C/{mass_unit}", "(Q-Qo)/C", ["mass"]),
+                       ("(Q-Qo)/mA.h", "(Q-Qo)/C", [3.6]),
+                       ("(Q-Qo)_per_mass/mA.h/{mass_unit}", "(Q-Qo)/C", ["mass", 3.6]),
+                       ]
+
+    decimation_columns = ("Ewe/V", "<I>/mA")
+
+    class HeaderInfo:
+        m_header_lines = []
+        m_header_names_str = ['Reference electrode :',
+                              'Electrode surface area :',
+                              'Characteristic mass :',
+                              'dE/dt',
+                              'dE/dt unit',
+                              ]
+
+        m_header_names = ["reference_electrode",
+                          "surface",
+                          "mass",
+                          "scan_rate",
+                          "scan_rate_unit",
+                          "offset_voltage_vs_SHE",
+                          "surface_unit",
+                          "mass_unit",
+                          ]
+
+        m_header_string = ""
+
+        m_header_infos = {}
+
+        m_header_parameters = {}
+
+        m_sequences = None
+
+        def __init__(self, header_lines):
+            self.m_header_lines = header_lines
+            self.m_header_string = ''.join(self.m_header_lines)
+            self.m_header_parameters, self.m_sequences = extract_header(self.m_header_lines)
+            extracted_parameters = []
+
+            for name in self.m_header_names_str:
+                extracted_parameters.append(self.extract_parameter_from_string(name).strip())
+
+            if not extracted_parameters[0] == "": # If the reference electrode was specified.
+                index_of_offset_voltage = [i for i, _ in enumerate(extracted_parameters[0]) if extracted_parameters[0].startswith("(", i)][-1]
+                offset_voltage_vs_SHE = float(extracted_parameters[0][index_of_offset_voltage + 1: -2].replace(",", "."))
+                ref_electrode_str = extracted_parameters[0][:index_of_offset_voltage - 1]
+            else:
+                offset_voltage_vs_SHE = 0.0
+                ref_electrode_str = "NHE"
+                
+            surface, surface_unit = extracted_parameters[1].split(" ")
+            surface = float(surface.replace(",", "."))
+            mass, mass_unit = extracted_parameters[2].split(" ")
+            mass = float(mass.replace(",", "."))
+            scan_rate = float(extracted_parameters[3].replace(",", "."))
+            scan_rate_unit = extracted_parameters[4]
+
+            parameters = [ref_electrode_str,
+                          surface,
+                          mass,
+                          scan_rate,
+                          scan_rate_unit,
+                          offset_voltage_vs_SHE,
+                          surface_unit,
+                          mass_unit,
+                          ]
+
+            self.m_header_infos = dict(zip(self.m_header_names, parameters))
+
+        def extract_parameter_from_string(self, name):
+            return self.m_header_parameters.get(name, "")
+
+
+
+
+    def split_cycles(self, data_header, columns, do_split=False):
+        if not do_split:
+            return [data_header], [columns]
+
+        cycle_index = data_header.index("cycle number")
+        return split_by_column(data_header, columns, cycle_index)
+
+
+
+    def technique_fields(self):
+        return ImportECLAB_Base.technique_fields(self) + [
+            ImportFieldCheck("peak_analysis", descr="Import the peaks, charges and threshold potentials of each cycle."),
+            ImportFieldFloat("threshold_current", descr="Current threshold of the peak analysis (mA)", default=0.1),
+            ]
+
+
+
+    def analysis_columns(self, params):
+        if params.field_results["peak_analysis"]:
+            return PEAK_ANALYSIS_COLUMNS
+        return []
+
+
+
+    def header_datasets(self, header_infos):
+        return [ImportDataset1D("scan_rate/" + header_infos["scan_rate_unit"], header_infos["scan_rate"])]
+
+
+
+    def analysis_datasets(self, params, data_header, columns, header_infos):
+        if not params.field_results["peak_analysis"]:
+            return []
+        return [ImportDataset1D(*data) for data in peak_analysis(data_header, columns,
+                                                                 params.field_results["threshold_current"])]
+
+
+
+
+
+
+
+
+
+
+class ImportECLAB_GC(ImportECLAB_Base):
+    name = "EC-LAB GC"
+    description = "Imports galvanostatic cycling measurements from EC-LAB files."
+    descriptor = "Galvanostatic Cycling with Potential Limitation\n"
+    parse_error = 'Not a Galvanostatic Cycling file.'
+
+
+    # Comment this line to remove the tab of the plugin
+    promote_tab = 'EC-LAB GC'
+
+    derived_columns = [("Capacity_per_mass/mA.h/{mass_unit}", "Capacity/mA.h", ["mass"]),
+                       ]
+
+    selection_fields = {"cycles": "cycle number", "steps": "half cycle"}
+
+    split_fields = {"extract_steps": "half cycle", "extract_cycles": "cycle number"}
+
+    misc_columns = ['mode',
+                    'ox/red',
+                    'error',
+                    'control changes',
+                    'Ns changes',
+                    'Ns',
+                    'counter inc.',
+                    'I Range',
+                    'dq/mA.h',
+                    'control/V/mA',
+                    'control/V',
+                    'control/mA',
+                    'half cycle',
+                    ]
+
+    class HeaderInfo:
+        m_header_lines = []
+        m_header_names_str = ['Reference electrode :',
+                              'Electrode surface area :',
+                              'Characteristic mass :',
+                              ]
+
+        m_header_names = ["reference_electrode",
+                          "surface",
+                          "mass",
+                          "currents",
+                          "currents_units",
+                          "threshold_voltages",
+                          "offset_voltage_vs_SHE",
+                          "surface_unit",
+                          "mass_unit",
+                          ]
+
+        m_header_string = ""
+
+        m_header_infos = {}
+
+        m_header_parameters = {}
+
+        m_sequences = None
+
+        def __init__(self, header_lines):
+            self.m_header_lines = header_lines
+            self.m_header_string = ''.join(self.m_header_lines)
+            self.m_header_parameters, self.m_sequences = extract_header(self.m_header_lines)
+            extracted_parameters = []
+
+            for name in self.m_header_names_str:
+                extracted_parameters.append(self.extract_parameter_from_string(name).strip())
+
+            if not extracted_parameters[0] == "": # If the reference electrode was specified.
+                index_of_offset_voltage = [i for i, _ in enumerate(extracted_parameters[0]) if extracted_parameters[0].startswith("(", i)][-1]
+                offset_voltage_vs_SHE = float(extracted_parameters[0][index_of_offset_voltage + 1: -2].replace(",", "."))
+                ref_electrode_str = extracted_parameters[0][:index_of_offset_voltage - 1]
+            else:
+                offset_voltage_vs_SHE = 0.0
+                ref_electrode_str = "NHE"
+                
+            surface, surface_unit = extracted_parameters[1].split(" ")
+            surface = float(surface.replace(",", "."))
+            mass, mass_unit = extracted_parameters[2].split(" ")
+            mass = float(mass.replace(",", "."))
+
+
+            # One value per sequence, nan (or '') for the sequences without one.
+            currents = sequence_numbers(self.extract_sequence_values("Is"))
+            currents_units = [str(unit) for unit in self.extract_sequence_values("unit Is")]
+
+            threshold_voltages = sequence_numbers(self.extract_sequence_values("EM (V)"))
+
+            parameters = [ref_electrode_str,
+                          surface,
+                          mass,
+                          currents,
+                          currents_units,
+                          threshold_voltages,
+                          offset_voltage_vs_SHE,
+                          surface_unit,
+                          mass_unit,
+                          ]
+
+            self.m_header_infos = dict(zip(self.m_header_names, parameters))
+
+        def extract_parameter_from_string(self, name):
+            return self.m_header_parameters.get(name, "")
+
+        def extract_sequence_values(self, name):
+            """ Values of a row of the table of the sequences, [] if it has no such row.
+            """
+            if self.m_sequences is None or name not in self.m_sequences.dtype.names:
+                return []
+            return self.m_sequences[name].tolist()
+
+
+
+
+    def technique_fields(self):
+        return ImportECLAB_Base.technique_fields(self) + [
+            ImportFieldCheck("extract_steps", descr="Import steps as separate datasets."),
+            ImportFieldCheck("cycle_summary", descr="Import the capacity, efficiency and energy of each cycle."),
+            ]
+
+
+
+    def analysis_columns(self, params):
+        if params.field_results["cycle_summary"]:
+            return CYCLE_SUMMARY_COLUMNS
+        return []
+
+
+
+    def analysis_datasets(self, params, data_header, columns, header_infos):
+        if not params.field_results["cycle_summary"]:
+            return []
+        return [ImportDataset1D(*data) for data in cycle_summary(data_header, columns, header_infos["mass"],
+                                                                 header_infos["mass_unit"])]
+
+
+
+
+
+
+
+
+
+
+class ImportECLAB_CA(ImportECLAB_Base):
     name = "EC-LAB CA"
-    author = "Arthur Langlard"
     description = "Imports chronoamperometric measurements from EC-LAB files."
     descriptor = "Chronoamperometry / Chronocoulometry\n"
+    parse_error = 'Not a Chronoamperometry file.'
 
 
     # Comment this line to remove the tab of the plugin
     promote_tab = 'EC-LAB CA'
-    file_extensions = set(['.mpt', '.MPT'])
+
+    derived_columns = [("Capacity_per_mass/mA.h/{mass_unit}", "Capacity/mA.h", ["mass"]),
+                       ]
+
+    selection_fields = {"cycles": "cycle number", "steps": "half cycle"}
+
+    split_fields = {"extract_steps": "half cycle", "extract_cycles": "cycle number"}
+
+    decimation_columns = ("time/s", "<I>/mA")
+
+    misc_columns = ['mode',
+                    'ox/red',
+                    'error',
+                    'control changes',
+                    'Ns changes',
+                    'Ns',
+                    'counter inc.',
+                    'I Range',
+                    'control/V',
+                    'half cycle',
+                    ]
 
     class HeaderInfo:
         m_header_lines = []
         m_header_names_str = ['Reference electrode :',
                               'Electrode surface area :',
                               'Characteristic mass :',
-                              'Ei (V)',
                               ]
 
         m_header_names = ["reference_electrode",
@@ -749,9 +3002,14 @@ class ImportECLAB_CA(ImportPlugin):
 
         m_header_infos = {}
 
+        m_header_parameters = {}
+
+        m_sequences = None
+
         def __init__(self, header_lines):
             self.m_header_lines = header_lines
             self.m_header_string = ''.join(self.m_header_lines)
+            self.m_header_parameters, self.m_sequences = extract_header(self.m_header_lines)
             extracted_parameters = []
 
             for name in self.m_header_names_str:
@@ -770,7 +3028,8 @@ class ImportECLAB_CA(ImportPlugin):
             mass, mass_unit = extracted_parameters[2].split(" ")
             mass = float(mass.replace(",", "."))
 
-            potential = extracted_parameters[3].replace(",", ".")
+            # One value per sequence, nan for the sequences without one.
+            potential = sequence_numbers(self.extract_sequence_values("Ei (V)"))
 
             parameters = [ref_electrode_str,
                           surface,
@@ -784,269 +3043,409 @@ class ImportECLAB_CA(ImportPlugin):
             self.m_header_infos = dict(zip(self.m_header_names, parameters))
 
         def extract_parameter_from_string(self, name):
-            parameter_found = False
-            for line in self.m_header_lines:
-                if name in line:
-                    parameter_found = True
-                    return line.rstrip().split(name)[-1]
-            
-            if not parameter_found:
-                return ""
+            return self.m_header_parameters.get(name, "")
 
+        def extract_sequence_values(self, name):
+            """ Values of a row of the table of the sequences, [] if it has no such row.
+            """
+            if self.m_sequences is None or name not in self.m_sequences.dtype.names:
+                return []
+            return self.m_sequences[name].tolist()
 
 
 
 
-    def parse_header_data(self, file):
-        """ Separate the file into the header part and the data part.
-        """
+    def technique_fields(self):
+        return ImportECLAB_Base.technique_fields(self) + [
+            ImportFieldCheck("extract_steps", descr="Import steps as separate datasets."),
+            ]
 
-        output = [None,None]
-        flag_Is_correct_file = (file.readline() == "EC-Lab ASCII FILE\n")
-        if not flag_Is_correct_file:
-            raise ValueError('Not a EC-LAB file.')
-        
-        
-
-        if flag_Is_correct_file:
-
-            line = ''
-            prevLine = ''
-            line_no = 1 # The first line (no. 0) has already been read.
-            header_lines = []
-            data_lines = []
-
-            while not "Nb header lines" in line: # Search for the length of the header.
-                line = file.readline()
-                line_no += 1
-            length_header = int(line.split(":")[-1])
-
-            file.readline()
-            line_no += 1
-            if not (file.readline() == self.descriptor):
-                raise ValueError('Not a Galvanostatic Cycling file.')
-            else:
-                header_lines.append(self.descriptor)
 
-            line_no += 1
 
-            while line_no < length_header - 1:    # Parse the header.
-                header_lines.append(file.readline())
-                line_no += 1
+# Plugins of the techniques, by their short names.
+TECHNIQUES = {"CV": ImportECLAB_CV,
+              "GC": ImportECLAB_GC,
+              "CA": ImportECLAB_CA,
+              }
 
-            while not line == '':   # Parse the data part.
-                line = file.readline()
-                data_lines.append(line)
-                line_no += 1
 
-            data_lines.pop()    # Remove the last empty string.
 
-            output = header_lines, data_lines
-        return output
 
 
+class ImportECLAB_Generic(ImportECLAB_Base):
+    """ Imports the columns of the files of any technique, without the columns derived
+    by the plugins of the known techniques.
+    """
+    name = "EC-LAB generic"
+    description = "Imports the columns of EC-LAB files of any technique."
+    descriptor = None    # Any technique, unless given to the plugin.
 
+    misc_columns = ['mode',
+                    'ox/red',
+                    'error',
+                    'control changes',
+                    'Ns changes',
+                    'counter inc.',
+                    'I Range',
+                    ]
 
+    class HeaderInfo:
+        """ The parameters common to all the techniques, each one optional: without
+        surface or mass in the header, they are 1 cm2 and 1 mg, as for binary files.
+        """
+        m_header_names = ["reference_electrode",
+                          "surface",
+                          "mass",
+                          "offset_voltage_vs_SHE",
+                          "surface_unit",
+                          "mass_unit",
+                          ]
 
-    def split_by_variable(self, data_header, data_Np, cycling_index, do_split=False):
-        import numpy as np
-        cycle_no = int(data_Np[0, cycling_index])
+        def __init__(self, header_lines):
+            self.m_header_lines = header_lines
+            self.m_header_string = ''.join(self.m_header_lines)
+            self.m_header_parameters, self.m_sequences = extract_header(self.m_header_lines)
 
-        if not do_split:
-            return [data_header], [data_Np]
+            reference_electrode = self.extract_parameter_from_string('Reference electrode :').strip()
+            if "(" in reference_electrode:
+                index_of_offset_voltage = reference_electrode.rindex("(")
+                offset_voltage_vs_SHE = float(reference_electrode[index_of_offset_voltage + 1: -2].replace(",", "."))
+                ref_electrode_str = reference_electrode[:index_of_offset_voltage - 1]
+            else:
+                offset_voltage_vs_SHE = 0.0
+                ref_electrode_str = reference_electrode or "NHE"
 
-        else:
+            surface, surface_unit = self.extract_quantity('Electrode surface area :', "cm2")
+            mass, mass_unit = self.extract_quantity('Characteristic mass :', "mg")
 
-            #     Cycle 1          ,      Cycle 2 ...
-            # [[point, point, ...] , [point, point, ...]]
-            Cycles = [[]]
-            cycles_nos = [cycle_no]
+            parameters = [ref_electrode_str,
+                          surface,
+                          mass,
+                          offset_voltage_vs_SHE,
+                          surface_unit,
+                          mass_unit,
+                          ]
 
-            for data_point in data_Np:
-                if int(data_point[cycling_index]) == cycle_no:
-                    Cycles[-1].append(list(data_point))
-                else:
-                    Cycles.append([list(data_point)])
-                    cycle_no += 1
-                    cycles_nos.append(cycle_no)
-            
-            Cycles_np = []
-            Data_headers = []
-
-            for cycle_list, cycle_no in zip(Cycles, cycles_nos):
-                Cycles_np.append(np.array(cycle_list, dtype=float))
-                header_with_cycle_no = [str(name) + " (" + str(cycle_no) + ")" for name in data_header]
-                Data_headers.append(header_with_cycle_no)
+            self.m_header_infos = dict(zip(self.m_header_names, parameters))
 
-        return Data_headers, Cycles_np
+        def extract_parameter_from_string(self, name):
+            return self.m_header_parameters.get(name, "")
 
+        def extract_quantity(self, name, default_unit):
+            """ Value and unit of a "name : value unit" line, 1 and default_unit if absent.
+            """
+            fields = self.extract_parameter_from_string(name).split()
+            try:
+                return float(fields[0].replace(",", ".")), (fields[1] if len(fields) > 1 else default_unit)
+            except (IndexError, ValueError):
+                return 1.0, default_unit
 
 
 
 
-    def __init__(self):
-        from veusz.plugins import ImportPlugin, ImportFieldCheck, ImportFieldFloat, ImportFieldCombo
+    def __init__(self, descriptor=None):
+        ImportECLAB_Base.__init__(self)
+        if descriptor is not None:
+            self.descriptor = descriptor
 
-        ImportPlugin.__init__(self)
-        self.fields = [
-            ImportFieldCheck("extract_cycles", descr="Import cycles as separate datasets."),
-            ImportFieldCheck("extract_steps", descr="Import steps as separate datasets."),
-            ImportFieldCheck("import_all_data", descr="Import misc. data."),
 
-            ImportFieldCheck("change_surface", descr="Define a surface"),
-            ImportFieldFloat("surface", descr="Surface", default=1.0),
-            ImportFieldCombo("surface_unit", descr="Surface unit", items=("m2", "cm2", "mm2"),
-                             editable=False, default="cm2"),
 
-            ImportFieldCheck("change_mass", descr="Define a mass"),
-            ImportFieldFloat("mass", descr="Mass", default=1.0),
-            ImportFieldCombo("mass_unit", descr="Mass unit", items=("g", "mg", "ng"),
-                             editable=False, default="mg")
-            
-            ]
+    def split(self, params, data_header, columns):
+        """ The cycles are only split if the file has a "cycle number" column.
+        """
+        if "cycle number" not in data_header:
+            return [data_header], [columns]
+        return ImportECLAB_Base.split(self, params, data_header, columns)
 
 
 
 
-    def import_dataset(self, params):
-        import numpy as np
 
-        f = params.openFileWithEncoding()
-        try:
-            header_lines, data_lines = self.parse_header_data(f)
-        except ValueError:
-            raise
+# Technique line given to the generic plugin for binary files, whose technique is
+# not read.
+MPR_DESCRIPTOR = "EC-Lab binary file\n"
 
-        data_header = data_lines[0].split('\t')[:-1]    # Remove the last character (end of line '\n').
-        lines_list = []
-        for line in data_lines[1:]:
-            lines_list.append(line.replace(',', '.').split('\t'))
+def merged_fields(plugin_classes):
+    """ Fields of several plugins, each name once. A field missing from the first
+    plugins is inserted after the field preceding it in its own plugin.
+    """
+    fields = []
+    names = []
+    for plugin_class in plugin_classes:
+        previous = None
+        for field in plugin_class().fields:
+            if field.name not in names:
+                position = 0 if previous is None else names.index(previous) + 1
+                fields.insert(position, field)
+                names.insert(position, field.name)
+            previous = field.name
+    return fields
 
-        data_Np = np.array(lines_list, dtype=float)
 
-        if not params.field_results["import_all_data"]:
-            misc_data = ['mode',
-                        'ox/red',
-                        'error',
-                        'control changes',
-                        'Ns changes',
-                        'Ns',
-                        'counter inc.',
-                        'I Range',
-                        'control/V',
-                        ]
-            if not params.field_results["extract_steps"]:
-                misc_data = misc_data + ['half cycle']
 
-            misc_data_indices = [data_header.index(misc_item) for misc_item in misc_data]
-            data_header = [name for name in data_header if name not in misc_data]
-            data_Np = np.delete(data_Np, misc_data_indices, axis=1)
+class ImportECLAB_Auto(ImportPlugin):
+    name = "EC-LAB auto"
+    author = "Arthur Langlard"
+    description = "Imports EC-LAB files of any technique, detected from the header of the file."
 
-        MyHeader = self.HeaderInfo(header_lines)
-        return MyHeader, data_header, data_Np
+    # Comment this line to remove the tab of the plugin
+    promote_tab = 'EC-LAB auto'
+    file_extensions = ECLAB_EXTENSIONS
 
+    def __init__(self):
+        ImportPlugin.__init__(self)
+        self.m_plugin = None    # Plugin of the technique of the last import.
+        self.fields = merged_fields(TECHNIQUES.values())
 
 
-    def getPreview(self, params):
-        import numpy as np
-        try:
-            MyHeader, data_header, data_Np = self.import_dataset(params)
-        except ValueError:
-            return ("File cannot be displayed", False)
 
+    def technique_plugin(self, params):
+        """ Plugin of the technique of the file, from its technique line. The files of
+        other techniques, and the binary files, are imported by the generic plugin.
+        """
+        descriptor = read_descriptor(params)
+        for plugin_class in TECHNIQUES.values():
+            if plugin_class.descriptor == descriptor:
+                return plugin_class()
+        return ImportECLAB_Generic(MPR_DESCRIPTOR if descriptor is None else descriptor)
 
-        header_string = MyHeader.m_header_string
-        data_header_string = '\t'.join(data_header)
-        data_string = "\n"
-        max_data_len = 20
-        if len(data_Np) < max_data_len:
-            max_data_len = len(data_Np) - 1
-        for data_line in data_Np[:max_data_len]:
-            for value in data_line:
-                data_string = data_string + "{:.4e}".format(value) + "\t"
-            data_string = data_string + "\n"
 
-        return (header_string + data_header_string + data_string, True)
+
+    def getPreview(self, params):
+        try:
+            plugin = self.technique_plugin(params)
+        except (ValueError, OSError):
+            return ("File cannot be displayed", False)
+        preview, ok = plugin.getPreview(params)
+        return ("Imported as: " + plugin.name + "\n\n" + preview, ok)
 
 
 
     def doImport(self, params):
-        from veusz.plugins import ImportDataset1D
-        import numpy as np
         """Actually imports data.
         params is a ImportPluginParams object.
         Return a list of ImportDataset1D objects.
         """
+        self.m_plugin = self.technique_plugin(params)
+        return self.m_plugin.doImport(params)
 
-        MyHeader, data_header, data_Np = self.import_dataset(params)
 
 
-        # Add generated values to the data table.
-        if params.field_results["change_surface"]:
-            MyHeader.m_header_infos["surface"] = params.field_results["surface"]
-            MyHeader.m_header_infos["surface_unit"] = params.field_results["surface_unit"]
-        surface = MyHeader.m_header_infos["surface"]
+# Plugins of the imports outside of the dialog (batch, import_file), by technique.
+IMPORT_PLUGINS = dict(TECHNIQUES, auto=ImportECLAB_Auto)
 
-        if params.field_results["change_mass"]:
-            MyHeader.m_header_infos["mass"] = params.field_results["mass"]
-            MyHeader.m_header_infos["mass_unit"] = params.field_results["mass_unit"]
-        mass = MyHeader.m_header_infos["mass"]
-        
-        capacity_index = data_header.index("Capacity/mA.h")
-        dataset_Q_per_mass = np.array([capacity / mass for capacity in data_Np[:, capacity_index] ])
 
-        data_header.append("Capacity_per_mass/mA.h/" + MyHeader.m_header_infos["mass_unit"])
-        data_Np = np.c_[data_Np, dataset_Q_per_mass]
 
-        generated_datasets_single_values = [ImportDataset1D("mass/" + MyHeader.m_header_infos["mass_unit"],
-                                              mass),
-                                          ImportDataset1D("surface/" + MyHeader.m_header_infos["surface_unit"],
-                                                          surface),
-                                          ImportDataset1D("offset_voltage/VvsNHE",
-                                                          MyHeader.m_header_infos["offset_voltage_vs_SHE"]),
-                                          ]
 
 
+class ImportParams:
+    """ Stand-in for the ImportPluginParams of Veusz, to use the plugins outside of
+    the import dialog. parse_workers is the number of processes converting a large
+    file (1: this process, 0: one per core), see read_eclab_file.
+    """
+    def __init__(self, filename, encoding, field_results, parse_workers=1):
+        self.filename = filename
+        self.encoding = encoding
+        self.field_results = field_results
+        self.parse_workers = parse_workers
 
-        Data_headers = [data_header]
-        Cycles_np = [data_Np]
+    def openFileWithEncoding(self):
+        import io
+        return io.open(self.filename, 'r', encoding=self.encoding, errors='replace')
 
-        # Split data into separate cyles.
-        if params.field_results["extract_steps"]:
-            cycling_index_for_steps = data_header.index('half cycle')
-            Data_headers, Cycles_np = self.split_by_variable(data_header, data_Np, cycling_index_for_steps, params.field_results["extract_steps"])
 
 
-        D_h_temp = []
-        C_np_temp = []
+def plugin_field_results(plugin, field_results=None):
+    """ Values of the fields of a plugin: their defaults, updated with field_results.
+    """
+    results = dict((field.name, field.default) for field in plugin.fields)
+    if field_results is not None:
+        results.update((name, value) for name, value in field_results.items() if name in results)
+    return results
 
-        Data_headers_b = []
-        Cycles_np_b = []
 
-        if params.field_results["extract_cycles"]:
-            cycling_index_for_cycles = data_header.index('cycle number')
-            for data_header, data_Np in zip(Data_headers, Cycles_np):
-            
-                D_h_temp, C_np_temp = self.split_by_variable(data_header, data_Np, cycling_index_for_cycles, params.field_results["extract_cycles"])
-                Data_headers_b = Data_headers_b + D_h_temp
-                Cycles_np_b = Cycles_np_b + C_np_temp
 
-            Data_headers, Cycles_np = Data_headers_b, Cycles_np_b
+def process_pool_available(function):
+    """ Whether function can be sent to worker processes. It cannot when Veusz
+    executes the plugin file instead of importing it as a module.
+    """
+    import importlib.util
+    import multiprocessing
+    import pickle
 
+    try:
+        if not pickle.loads(pickle.dumps(function)) is function:
+            raise pickle.PicklingError()
+        # Unless forked, the workers import the module of function again by its name.
+        if (multiprocessing.get_start_method() != "fork"
+                and importlib.util.find_spec(function.__module__) is None):
+            raise ImportError()
+    except (pickle.PicklingError, AttributeError, TypeError, ValueError, ImportError):
+        return False
+    return True
 
 
-        #Data_headers, Cycles_np = self.split_by_variable(data_header, data_Np, params.field_results["extract_cycles"])
-        imported_datasets = []
 
-        for data_header, data_Np in zip(Data_headers, Cycles_np):
-            labeled_datasets = zip(data_header, data_Np.T)
-            imported_datasets = imported_datasets + [ImportDataset1D(*data) for data in labeled_datasets]
+def batch_import_file(class_name, filename, encoding, field_results):
+    """ Import one file of a batch with the plugin named class_name.
+    Run in a worker: returns (name, data) pairs rather than ImportDataset1D objects.
+    """
+    plugin = globals()[class_name]()
+    params = ImportParams(filename, encoding, plugin_field_results(plugin, field_results))
+    return [(dataset.name, dataset.data) for dataset in plugin.doImport(params)]
 
 
-        return imported_datasets + generated_datasets_single_values
+
+# Encoding of the EC-Lab exports, when the import is not run from the dialog.
+DEFAULT_ENCODING = "latin-1"
+
+def import_file(filename, technique="auto", field_results=None, encoding=DEFAULT_ENCODING, parse_workers=1):
+    """ Import an EC-Lab file without Veusz, with the plugin of a technique ("CV", "GC"
+    or "CA"), or of the technique of the file ("auto"). The fields of the plugin have
+    their defaults, updated with field_results. A large file is converted by
+    parse_workers processes (0: one per core).
+    Return the datasets as a dict of numpy arrays, in the order of the import.
+    """
+    import numpy as np
+
+    if technique not in IMPORT_PLUGINS:
+        raise ValueError('Unknown technique: ' + str(technique))
+    plugin = IMPORT_PLUGINS[technique]()
+    params = ImportParams(filename, encoding, plugin_field_results(plugin, field_results), parse_workers)
+    return dict((dataset.name, np.atleast_1d(np.asarray(dataset.data))) for dataset in plugin.doImport(params))
+
+
+
+def file_label(filename):
+    """ Name of an EC-Lab file without its compression and its extension: "run" for
+    run.mpt as for run.mpt.gz.
+    """
+    import os
+
+    name = os.path.basename(str(filename))
+    if compression(name) is not None:
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+
+
+def batch_prefixes(files):
+    """ Prefixes of the names of the datasets of the files of a batch: the labels of
+    the files, with as many of their folders as needed to tell apart files of the same
+    name. Files of the same name in the same folder (run.mpt and run.mpt.gz) are numbered.
+    """
+    import os
+
+    folders = [os.path.dirname(os.path.abspath(str(filename))).split(os.sep) for filename in files]
+    depths = [0] * len(files)
+    labels = [file_label(filename) for filename in files]
+
+    while True:
+        duplicates = [index for index, label in enumerate(labels)
+                      if depths[index] < len(folders[index])
+                      and any(other_label == label and other_folders != folders[index]
+                              for other_label, other_folders in zip(labels, folders))]
+        if len(duplicates) == 0:
+            break
+        for index in duplicates:
+            depths[index] += 1
+            labels[index] = "/".join(folders[index][len(folders[index]) - depths[index]:] + [file_label(files[index])])
+
+    prefixes = []
+    for index, label in enumerate(labels):
+        occurrence = labels[:index].count(label)
+        prefixes.append(label + (" #" + str(occurrence + 1) if occurrence > 0 else "") + " ")
+    return prefixes
+
+
+
+def batch_import(plugin_class, files, field_results=None, encoding=DEFAULT_ENCODING, max_workers=None):
+    """ Import many EC-Lab files with one of the plugins, in max_workers processes (one
+    per core by default). The files are imported one after the other if max_workers is
+    1, or if the plugin cannot start worker processes (see process_pool_available), as
+    in the dialog of Veusz: threads would convert them one at a time, under the GIL.
+    files is a list of file names or a glob pattern. The names of the datasets of each
+    file are prefixed with the name of the file (see batch_prefixes).
+    Return a single list of ImportDataset1D objects, in the order of the files.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import glob
+
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+    arguments = [(plugin_class.__name__, filename, encoding, field_results) for filename in files]
+
+    if max_workers == 1 or len(files) <= 1 or not process_pool_available(batch_import_file):
+        results = [batch_import_file(*file_arguments) for file_arguments in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers) as executor:
+            results = list(executor.map(batch_import_file, *zip(*arguments)))
+
+    imported_datasets = []
+    for prefix, datasets in zip(batch_prefixes(files), results):
+        imported_datasets = imported_datasets + [ImportDataset1D(prefix + name, data) for name, data in datasets]
+
+    return imported_datasets
+
+
+
+
+
+
+
+
+class ImportECLAB_Batch(ImportPlugin):
+    name = "EC-LAB batch"
+    author = "Arthur Langlard"
+    description = "Imports all the EC-LAB files matching a pattern."
+
+    # Comment this line to remove the tab of the plugin
+    promote_tab = 'EC-LAB batch'
+    file_extensions = ECLAB_EXTENSIONS
+
+    techniques = IMPORT_PLUGINS
+
+    def __init__(self):
+        ImportPlugin.__init__(self)
+        self.fields = [
+            ImportFieldCombo("technique", descr="Technique", items=tuple(self.techniques),
+                             editable=False, default="GC"),
+            ImportFieldText("pattern", descr="Files (pattern in the folder of the file)", default="*.mpt"),
+            ] + ImportECLAB_Auto().fields
+
+
+
+    def batch_files(self, params):
+        import glob
+        import os
+
+        pattern = params.field_results["pattern"].strip()
+        if pattern == "":
+            return [params.filename]
+        return sorted(glob.glob(os.path.join(os.path.dirname(params.filename), pattern)))
+
+
+
+    def getPreview(self, params):
+        files = self.batch_files(params)
+        if len(files) == 0:
+            return ("No file matches the pattern.", False)
+        return ("%d files:\n" % len(files) + "\n".join(files), True)
+
+
+
+    def doImport(self, params):
+        """Actually imports data.
+        params is a ImportPluginParams object.
+        Return a list of ImportDataset1D objects.
+        """
+        plugin_class = self.techniques[params.field_results["technique"]]
+        return batch_import(plugin_class, self.batch_files(params), params.field_results, params.encoding)
 
 
 # add the classes to the registry.
 importpluginregistry.append(ImportECLAB_CV)
 importpluginregistry.append(ImportECLAB_GC)
 importpluginregistry.append(ImportECLAB_CA)
+importpluginregistry.append(ImportECLAB_Auto)
+importpluginregistry.append(ImportECLAB_Batch)
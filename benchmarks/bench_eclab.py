@@ -0,0 +1,344 @@
+# ##### BEGIN GPL LICENCE BLOCK #####
+#  Copyright (C) 2022-2023  Arthur Langlard
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENCE BLOCK #####
+
+
+# Benchmarks of the stages of the EC-Lab import plugins on synthetic files.
+#
+# Usage: python bench_eclab.py --rows 1000 100000 1000000 --techniques CV GC CA
+#
+# The generated files are kept in the data directory and reused. Each run is appended
+# to the results file with the version of the plugin, and compared with the last run
+# of another version.
+
+
+
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import generate_eclab
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_FILE = os.path.join(os.path.dirname(BENCHMARK_DIR), "ImportEC-LAB.py")
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results.jsonl")
+
+PLUGIN_NAMES = {"CV": "ImportECLAB_CV",
+                "GC": "ImportECLAB_GC",
+                "CA": "ImportECLAB_CA",
+                }
+
+STAGES = ["parse", "import_dataset", "split", "getPreview", "doImport"]
+
+
+
+
+
+def install_veusz_stub():
+    """ Register a minimal veusz.plugins module: the plugin API used by the plugins,
+    without Veusz. The versions of the plugin before its headless mode import
+    veusz.plugins when loaded and in their functions.
+    """
+    import types
+
+    class ImportPlugin:
+        def __init__(self):
+            self.fields = []
+
+    class ImportField:
+        default_value = None
+
+        def __init__(self, name, descr=None, default=None, **options):
+            self.name = name
+            self.descr = descr
+            self.default = self.default_value if default is None else default
+
+    class ImportDataset1D:
+        def __init__(self, name, data=None, serr=None, perr=None, nerr=None):
+            self.name = name
+            self.data = data
+
+    plugins = types.ModuleType("veusz.plugins")
+    plugins.ImportPlugin = ImportPlugin
+    plugins.ImportDataset1D = ImportDataset1D
+    plugins.ImportFieldCheck = type("ImportFieldCheck", (ImportField,), {"default_value": False})
+    plugins.ImportFieldText = type("ImportFieldText", (ImportField,), {"default_value": ""})
+    plugins.ImportFieldInt = type("ImportFieldInt", (ImportField,), {"default_value": 0})
+    plugins.ImportFieldFloat = type("ImportFieldFloat", (ImportField,), {"default_value": 0.0})
+    plugins.ImportFieldCombo = type("ImportFieldCombo", (ImportField,), {})
+    plugins.importpluginregistry = []
+
+    veusz = types.ModuleType("veusz")
+    veusz.plugins = plugins
+    sys.modules["veusz"] = veusz
+    sys.modules["veusz.plugins"] = plugins
+
+
+
+def load_plugin_module(filename=PLUGIN_FILE):
+    """ Execute the plugin file as Veusz does, and return its namespace.
+    If Veusz is not installed and the plugin needs it (versions before its headless
+    mode, with --plugin), the plugin is run on a stub of veusz.plugins.
+    """
+    with open(filename, encoding="utf-8") as f:
+        code = compile(f.read(), filename, "exec")
+    try:
+        namespace = {"__name__": "ImportEC_LAB", "__file__": filename}
+        exec(code, namespace)
+    except ModuleNotFoundError as error:
+        if error.name not in ("veusz", "veusz.plugins"):
+            raise
+        install_veusz_stub()
+        namespace = {"__name__": "ImportEC_LAB", "__file__": filename}
+        exec(code, namespace)
+    return namespace
+
+
+
+def plugin_version(filename=PLUGIN_FILE):
+    """ Version of the plugin: the git commit of its file, or its modification date.
+    """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(filename),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return datetime.datetime.fromtimestamp(os.path.getmtime(filename)).isoformat()
+
+
+
+def data_file(data_dir, technique, nb_rows, nb_cycles, decimal_separator):
+    """ Synthetic file of a benchmark case, generated if it does not exist yet.
+    """
+    separator_name = "comma" if decimal_separator == ',' else "point"
+    filename = os.path.join(data_dir, "%s_%d_%dcycles_%s.mpt" % (technique, nb_rows, nb_cycles, separator_name))
+    if not os.path.exists(filename):
+        os.makedirs(data_dir, exist_ok=True)
+        generate_eclab.generate(filename + ".tmp", technique, nb_rows, nb_cycles, decimal_separator)
+        os.replace(filename + ".tmp", filename)
+    return filename
+
+
+
+
+
+class ImportParams:
+    """ The parameters of an import, as Veusz gives them to the plugins. Older versions
+    of the plugin have no stand-in of their own.
+    """
+    def __init__(self, filename, encoding, field_results):
+        self.filename = filename
+        self.encoding = encoding
+        self.field_results = field_results
+
+    def openFileWithEncoding(self):
+        return open(self.filename, 'r', encoding=self.encoding, errors='replace')
+
+
+
+def stage_functions(module, technique, filename, field_results):
+    """ The stages to measure, as functions without arguments. Each stage starts from
+    an empty parse cache, except "split" which works on parsed data.
+    Only the plugin classes are needed, so that any version of the plugin can be
+    measured: the versions differ in their helpers and in the arguments of the split.
+    """
+    plugin = module[PLUGIN_NAMES[technique]]()
+    fields = dict((field.name, field.default) for field in plugin.fields)
+    fields.update((name, value) for name, value in field_results.items() if name in fields)
+    params = ImportParams(filename, "latin-1", fields)
+
+    def parse():
+        # The header and the data converted by the reader of the version: the data
+        # part is read as lines by the versions before the chunked reader.
+        with params.openFileWithEncoding() as f:
+            if "read_data_block" not in module:
+                return plugin.parse_header_data(f)
+            return plugin.parse_header(f), module["read_data_block"](f)
+
+    def import_dataset():
+        return plugin.import_dataset(params)
+
+    _, data_header, data_Np = plugin.import_dataset(params)
+    split_function = plugin.split_cycles if technique == "CV" else plugin.split_by_variable
+    if "data_Np" in inspect.signature(split_function).parameters:
+        columns = data_Np    # Versions splitting the 2-D array.
+    elif "table_columns" in module:
+        columns = module["table_columns"](data_Np)
+    else:
+        columns = list(data_Np.T)
+
+    def split():
+        if technique == "CV":
+            return split_function(data_header, columns, True)
+        return split_function(data_header, columns, data_header.index("cycle number"), True)
+
+    def getPreview():
+        return plugin.getPreview(params)
+
+    def doImport():
+        return plugin.doImport(params)
+
+    return {"parse": parse,
+            "import_dataset": import_dataset,
+            "split": split,
+            "getPreview": getPreview,
+            "doImport": doImport,
+            }
+
+
+
+def measure(function, clear_cache, repeat):
+    """ Best wall time of repeat runs, then the peak of memory allocated by one run.
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        clear_cache()
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    clear_cache()
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return seconds, peak_bytes
+
+
+
+def run_case(module, technique, nb_rows, nb_cycles, decimal_separator, data_dir, stages, repeat, field_results):
+    filename = data_file(data_dir, technique, nb_rows, nb_cycles, decimal_separator)
+    file_size = os.path.getsize(filename)
+    functions = stage_functions(module, technique, filename, field_results)
+    # Versions before the parse cache parse the file at each import.
+    clear_parse_cache = module["parse_cache"].clear if "parse_cache" in module else (lambda: None)
+
+    results = []
+    for stage in stages:
+        # The split works on data already parsed: the cache is kept.
+        clear_cache = (lambda: None) if stage == "split" else clear_parse_cache
+        seconds, peak_bytes = measure(functions[stage], clear_cache, repeat)
+        results.append({"technique": technique,
+                        "rows": nb_rows,
+                        "cycles": nb_cycles,
+                        "decimal": decimal_separator,
+                        "fields": field_results,
+                        "stage": stage,
+                        "seconds": seconds,
+                        "rows_per_s": nb_rows / seconds if seconds > 0 else float("inf"),
+                        "mb_per_s": file_size / 1e6 / seconds if seconds > 0 else float("inf"),
+                        "peak_mb": peak_bytes / 1e6,
+                        })
+    clear_parse_cache()
+    return results
+
+
+
+
+
+def case_key(result):
+    return (result["technique"], result["rows"], result["cycles"], result["decimal"],
+            json.dumps(result["fields"], sort_keys=True), result["stage"])
+
+
+
+def previous_results(results_file, version):
+    """ Last results of another version than version, by case.
+    """
+    previous = {}
+    if not os.path.exists(results_file):
+        return previous
+    with open(results_file, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["version"] != version:
+                for result in record["results"]:
+                    previous[case_key(result)] = (record["version"], result)
+    return previous
+
+
+
+def print_results(results, previous):
+    print("%-3s %10s %7s %-18s %10s %12s %9s %10s  %s" % ("", "rows", "cycles", "stage", "time (s)", "rows/s",
+                                                        "MB/s", "peak (MB)", "vs previous"))
+    for result in results:
+        comparison = ""
+        if case_key(result) in previous:
+            version, old_result = previous[case_key(result)]
+            comparison = "x%.2f time vs %s" % (result["seconds"] / old_result["seconds"], version)
+        print("%-3s %10d %7d %-18s %10.4f %12.0f %9.1f %10.1f  %s" % (result["technique"], result["rows"],
+                                                                      result["cycles"], result["stage"],
+                                                                      result["seconds"], result["rows_per_s"],
+                                                                      result["mb_per_s"], result["peak_mb"],
+                                                                      comparison))
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the EC-Lab import plugins.")
+    parser.add_argument("--techniques", nargs="+", default=["CV", "GC", "CA"], choices=sorted(PLUGIN_NAMES))
+    parser.add_argument("--rows", nargs="+", type=int, default=[1000, 100000, 1000000],
+                        help="sizes of the files, in rows (up to 50000000)")
+    parser.add_argument("--rows-per-cycle", type=int, default=1000,
+                        help="rows per cycle: files of many rows have thousands of cycles")
+    parser.add_argument("--decimal", default=',', help="decimal separator of the files")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best time is kept")
+    parser.add_argument("--fields", default="{}", help="fields of the import, as JSON, e.g. '{\"import_all_data\": true}'")
+    parser.add_argument("--data-dir", default=os.path.join(BENCHMARK_DIR, "data"))
+    parser.add_argument("--results", default=RESULTS_FILE, help="file the results are appended to")
+    parser.add_argument("--plugin", default=PLUGIN_FILE)
+    args = parser.parse_args()
+
+    module = load_plugin_module(args.plugin)
+    version = plugin_version(args.plugin)
+    field_results = json.loads(args.fields)
+
+    results = []
+    for technique in args.techniques:
+        for nb_rows in args.rows:
+            nb_cycles = max(nb_rows // args.rows_per_cycle, 1)
+            results += run_case(module, technique, nb_rows, nb_cycles, args.decimal, args.data_dir,
+                                args.stages, args.repeat, field_results)
+
+    print_results(results, previous_results(args.results, version))
+
+    record = {"version": version,
+              "date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": sys.version.split()[0],
+              "numpy": np.__version__,
+              "machine": platform.platform(),
+              "cpus": os.cpu_count(),
+              "results": results,
+              }
+    with open(args.results, 'a', encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# ##### BEGIN GPL LICENCE BLOCK #####
+#  Copyright (C) 2022-2023  Arthur Langlard
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENCE BLOCK #####
+
+
+# Generator of synthetic EC-Lab text files (.mpt), for the benchmarks.
+#
+# Usage: python generate_eclab.py GC 1000000 gc.mpt --cycles 2000
+
+
+
+import argparse
+import numpy as np
+
+
+DESCRIPTORS = {"CV": "Cyclic Voltammetry",
+               "GC": "Galvanostatic Cycling with Potential Limitation",
+               "CA": "Chronoamperometry / Chronocoulometry",
+               }
+
+# Names of the columns, in the order of the EC-Lab exports.
+COLUMNS = {"CV": ['mode', 'ox/red', 'error', 'control changes', 'counter inc.', 'time/s', 'control/V',
+                  'Ewe/V', '<I>/mA', 'cycle number', '(Q-Qo)/C', 'I Range', 'P/W'],
+           "GC": ['mode', 'ox/red', 'error', 'control changes', 'Ns changes', 'counter inc.', 'Ns',
+                  'I Range', 'time/s', 'control/V/mA', 'Ewe/V', 'dq/mA.h', '(Q-Qo)/mA.h', 'half cycle',
+                  'Q charge/discharge/mA.h', 'control/V', 'control/mA', '<I>/mA', 'Capacity/mA.h',
+                  'cycle number', 'P/W'],
+           "CA": ['mode', 'ox/red', 'error', 'control changes', 'Ns changes', 'counter inc.', 'Ns',
+                  'I Range', 'time/s', 'control/V', 'Ewe/V', '<I>/mA', 'dq/mA.h', '(Q-Qo)/mA.h',
+                  'half cycle', 'cycle number', 'Capacity/mA.h', 'P/W'],
+           }
+
+INTEGER_COLUMNS = ['mode', 'ox/red', 'error', 'control changes', 'Ns changes', 'counter inc.', 'Ns',
+                   'I Range', 'half cycle']
+
+# Parameters of the techniques, as the table of the header.
+SEQUENCE_TABLES = {"CV": [["Ei (V)", "0,000"],
+                          ["dE/dt", "20,000"],
+                          ["dE/dt unit", "mV/s"],
+                          ["nc cycles", "2"],
+                          ],
+                   "GC": [["Ns", "0", "1"],
+                          ["Set I/C", "I", "I"],
+                          ["Is", "1,000", "-1,000"],
+                          ["unit Is", "mA", "mA"],
+                          ["EM (V)", "4,200", "2,500"],
+                          ],
+                   "CA": [["Ns", "0", "1"],
+                          ["Ei (V)", "0,500", "0,000"],
+                          ],
+                   }
+
+ROWS_PER_BLOCK = 100000    # Rows generated and written at once.
+
+
+
+
+
+def header_lines(technique):
+    """ Lines of the header, from the name of the technique to the reference electrode.
+    """
+    lines = [DESCRIPTORS[technique],
+             "Run on channel : 1 (SN 0001)",
+             "User : ",
+             "Electrode connection : standard",
+             "Ewe ctrl range : min = -10,00 V, max = 10,00 V",
+             "Acquisition started on : 01/01/2023 00:00:00.000",
+             "Device : VMP3 (SN 0001)",
+             "Electrode material : ",
+             "Comments : ",
+             "Mass of active material : 0,001 mg",
+             "Electrode surface area : 0,071 cm²",
+             "Characteristic mass : 1,234 mg",
+             "Volume (V) : 0,001 cm³",
+             "Cycle Definition : Charge/Discharge alternance",
+             ]
+    for row in SEQUENCE_TABLES[technique]:
+        lines.append(''.join(field.ljust(20) for field in row))
+    lines.append("Reference electrode : Ag/AgCl (0,197 V)")
+    return lines
+
+
+
+def block_columns(technique, rows, nb_rows, nb_cycles, rng):
+    """ Values of the columns for the rows of indices rows (an integer array), out of
+    nb_rows rows in nb_cycles cycles.
+    Each cycle is a charge and a discharge (two half cycles, or two sequences Ns) with
+    realistic shapes: triangular potential for CV, capacity ramps for GC, current
+    decays for CA. Noise is added so that the values have all their digits.
+    """
+    nb = len(rows)
+    rows_per_half_cycle = max(nb_rows / (2.0 * nb_cycles), 1.0)
+    half_cycle = np.minimum((rows / rows_per_half_cycle).astype(np.int64), 2 * nb_cycles - 1)
+    progress = rows / rows_per_half_cycle - half_cycle    # From 0 to 1 in each half cycle.
+    charge = half_cycle % 2 == 0
+    noise = rng.normal(scale=1e-4, size=nb)
+
+    values = {'mode': np.full(nb, 2 if technique == "CV" else 1),
+              'ox/red': charge.astype(np.int64),
+              'error': np.zeros(nb, dtype=np.int64),
+              'control changes': (progress * rows_per_half_cycle < 1).astype(np.int64),
+              'Ns changes': (progress * rows_per_half_cycle < 1).astype(np.int64),
+              'counter inc.': np.zeros(nb, dtype=np.int64),
+              'Ns': half_cycle % 2,
+              'I Range': np.full(nb, 41),
+              'half cycle': half_cycle,
+              'time/s': rows * 0.5 + noise,
+              'cycle number': (half_cycle // 2 + 1).astype(float),
+              }
+
+    if technique == "CV":
+        potential = np.where(charge, -0.5 + 1.5 * progress, 1.0 - 1.5 * progress)
+        current = 0.2 * (potential - 0.25) + np.where(charge, 0.05, -0.05) + noise
+        values.update({'control/V': potential,
+                       'Ewe/V': potential + noise,
+                       '<I>/mA': current,
+                       '(Q-Qo)/C': np.cumsum(current) * 5e-4,
+                       })
+    elif technique == "GC":
+        current = np.where(charge, 1.0, -1.0)
+        full_capacity = rows_per_half_cycle * 0.5 / 3600.0
+        capacity = progress * full_capacity
+        potential = np.where(charge, 2.5 + 1.7 * progress ** 0.5, 4.2 - 1.7 * progress ** 2) + noise
+        values.update({'control/V/mA': current,
+                       'Ewe/V': potential,
+                       'dq/mA.h': current * 0.5 / 3600.0 + noise * 1e-3,
+                       '(Q-Qo)/mA.h': np.where(charge, capacity, full_capacity - capacity) + noise * 1e-3,
+                       'Q charge/discharge/mA.h': np.where(charge, capacity, -capacity),
+                       'control/V': potential,
+                       'control/mA': current,
+                       '<I>/mA': current + noise,
+                       'Capacity/mA.h': capacity + noise * 1e-3,
+                       })
+    else:
+        potential = np.where(charge, 0.5, 0.0)
+        current = np.where(charge, 1.0, -1.0) * np.exp(-5.0 * progress) + noise
+        capacity = np.abs(current) * progress * rows_per_half_cycle * 0.5 / 3600.0
+        values.update({'control/V': potential,
+                       'Ewe/V': potential + noise,
+                       '<I>/mA': current,
+                       'dq/mA.h': current * 0.5 / 3600.0,
+                       '(Q-Qo)/mA.h': np.cumsum(current) * 0.5 / 3600.0,
+                       'Capacity/mA.h': capacity,
+                       })
+
+    values['P/W'] = values['Ewe/V'] * values['<I>/mA'] * 1e-3
+    return [values[name] for name in COLUMNS[technique]]
+
+
+
+def format_block(technique, columns, decimal_separator, newline):
+    """ Text of a block of rows, as EC-Lab writes it: integers for the flags, 16
+    significant digits with a 3-digit exponent for the measurements.
+    """
+    formats = ['%d' if name in INTEGER_COLUMNS else '%.15E' for name in COLUMNS[technique]]
+    row_format = '\t'.join(formats)
+    text = newline.join(row_format % row for row in zip(*[column.tolist() for column in columns]))
+    text = text.replace('E+', 'E+0').replace('E-', 'E-0')
+    if decimal_separator != '.':
+        text = text.replace('.', decimal_separator)
+    return text + newline
+
+
+
+def generate(filename, technique="CV", nb_rows=1000, nb_cycles=10, decimal_separator=',', newline='\n',
+             encoding="latin-1", seed=0):
+    """ Write a synthetic EC-Lab text file of nb_rows rows of data.
+    """
+    rng = np.random.default_rng(seed)
+    lines = header_lines(technique)
+
+    with open(filename, 'w', encoding=encoding, newline='') as f:
+        f.write("EC-Lab ASCII FILE" + newline)
+        f.write("Nb header lines : " + str(len(lines) + 4) + newline)
+        f.write(newline)
+        for line in lines:
+            f.write(line + newline)
+        f.write('\t'.join(COLUMNS[technique]) + '\t' + newline)
+
+        for start in range(0, nb_rows, ROWS_PER_BLOCK):
+            rows = np.arange(start, min(start + ROWS_PER_BLOCK, nb_rows))
+            columns = block_columns(technique, rows, nb_rows, nb_cycles, rng)
+            f.write(format_block(technique, columns, decimal_separator, newline))
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic EC-Lab text file.")
+    parser.add_argument("technique", choices=sorted(DESCRIPTORS))
+    parser.add_argument("rows", type=int, help="number of rows of data")
+    parser.add_argument("filename")
+    parser.add_argument("--cycles", type=int, default=10, help="number of cycles")
+    parser.add_argument("--decimal", default=',', help="decimal separator (EC-Lab uses the one of the locale)")
+    parser.add_argument("--crlf", action="store_true", help="Windows line endings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.filename, args.technique, args.rows, args.cycles, args.decimal,
+             '\r\n' if args.crlf else '\n', seed=args.seed)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+# ##### BEGIN GPL LICENCE BLOCK #####
+#  Copyright (C) 2022-2023  Arthur Langlard
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENCE BLOCK #####
+
+
+# Converter of EC-Lab files to columnar files (.npz, HDF5 or Parquet), without Veusz.
+# The files are imported by the plugins of ImportEC-LAB.py, with the same fields as in
+# the import dialog, one file per process.
+#
+# Usage: python convert_eclab.py auto data/*.mpt --format npz --output-dir converted
+#        python convert_eclab.py CV run.mpt.gz --field extract_cycles=yes --field compact_integers=yes
+#
+# As a library:
+#     import convert_eclab
+#     datasets = convert_eclab.eclab.import_file("run.mpt")    # dict of numpy arrays
+
+
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+PLUGIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ImportEC-LAB.py")
+PLUGIN_MODULE = "ImportEC_LAB"
+
+FORMATS = {"npz": ".npz",
+           "hdf5": ".h5",
+           "parquet": ".parquet",
+           }
+
+# Name of the settings of the conversion in the converted files: an entry of the
+# .npz files, an attribute of the HDF5 files and a key of the Parquet metadata.
+SETTINGS_KEY = "__conversion__"
+
+
+
+
+
+def load_plugin(filename=PLUGIN_FILE):
+    """ Import the plugin file as a module, without Veusz.
+    Its name has a dash, so it is loaded from its path and registered in sys.modules,
+    where the worker processes of the plugin find it.
+    """
+    if PLUGIN_MODULE in sys.modules:
+        return sys.modules[PLUGIN_MODULE]
+    spec = importlib.util.spec_from_file_location(PLUGIN_MODULE, filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PLUGIN_MODULE] = module
+    spec.loader.exec_module(module)
+    return module
+
+eclab = load_plugin()
+
+
+
+def parse_fields(technique, assignments):
+    """ Values of fields of the plugin of a technique, from "name=value" strings.
+    The values are converted to the type of the defaults of the fields.
+    """
+    plugin = eclab.IMPORT_PLUGINS[technique]()
+    defaults = dict((field.name, field.default) for field in plugin.fields)
+
+    field_results = {}
+    for assignment in assignments:
+        name, separator, value = assignment.partition("=")
+        name = name.strip()
+        if separator == "" or name not in defaults:
+            raise ValueError("Unknown field: %s (fields of %s: %s)" % (name, technique, ", ".join(defaults)))
+        default = defaults[name]
+        if isinstance(default, bool):
+            field_results[name] = value.strip().lower() in ("1", "true", "yes", "on")
+        elif isinstance(default, int):
+            field_results[name] = int(value)
+        elif isinstance(default, float):
+            field_results[name] = float(value)
+        else:
+            field_results[name] = value
+    return field_results
+
+
+
+def output_path(filename, output_dir, output_format):
+    """ Path of the converted file: the name of the EC-Lab file, without its
+    compression and its extension, in output_dir (by default the folder of the file).
+    """
+    name = eclab.file_label(filename) + FORMATS[output_format]
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(filename)), name)
+
+
+
+
+
+def conversion_settings(technique, field_results, encoding, compress):
+    """ Settings of a conversion, as JSON: the technique, all the fields of its plugin
+    (defaults included, so that equal imports have equal settings), the encoding and
+    the compression.
+    """
+    plugin = eclab.IMPORT_PLUGINS[technique]()
+    return json.dumps({"technique": technique,
+                       "fields": eclab.plugin_field_results(plugin, field_results),
+                       "encoding": encoding,
+                       "compress": compress,
+                       }, sort_keys=True)
+
+
+
+def write_npz(filename, datasets, settings, compress=False):
+    """ One array per dataset, and the settings as a string array.
+    """
+    arrays = dict(datasets)
+    arrays[SETTINGS_KEY] = np.array(settings)
+    if compress:
+        np.savez_compressed(filename, **arrays)
+    else:
+        np.savez(filename, **arrays)
+
+
+
+def write_hdf5(filename, datasets, settings, compress=False):
+    """ One HDF5 dataset per dataset. A '/' would make groups in HDF5: the names of
+    the datasets are escaped, and kept unchanged in their "name" attribute.
+    """
+    import h5py
+
+    with h5py.File(filename, "w") as h5_file:
+        h5_file.attrs[SETTINGS_KEY] = settings
+        for name, data in datasets.items():
+            key = name.replace("%", "%25").replace("/", "%2F")
+            h5_dataset = h5_file.create_dataset(key, data=data, compression="gzip" if compress else None)
+            h5_dataset.attrs["name"] = name
+
+
+
+def write_parquet(filename, datasets, settings, compress=False):
+    """ One column per dataset. The datasets shorter than the longest one (cycles,
+    single values...) are completed with nulls, as Parquet tables are rectangular.
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    length = max([len(data) for data in datasets.values()] + [0])
+    columns = []
+    for data in datasets.values():
+        if len(data) < length:
+            padded = np.zeros(length, dtype=data.dtype)
+            padded[:len(data)] = data
+            columns.append(pyarrow.array(padded, mask=np.arange(length) >= len(data)))
+        else:
+            columns.append(pyarrow.array(data))
+    table = pyarrow.Table.from_arrays(columns, names=list(datasets), metadata={SETTINGS_KEY: settings})
+    pyarrow.parquet.write_table(table, filename, compression="zstd" if compress else "snappy")
+
+
+
+def read_settings(filename, output_format):
+    """ Settings stored in a converted file, None if they cannot be read.
+    """
+    try:
+        if output_format == "npz":
+            with np.load(filename) as npz_file:
+                return str(npz_file[SETTINGS_KEY])
+        if output_format == "hdf5":
+            import h5py
+            with h5py.File(filename, "r") as h5_file:
+                settings = h5_file.attrs[SETTINGS_KEY]
+            return settings.decode() if isinstance(settings, bytes) else str(settings)
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(filename).metadata[SETTINGS_KEY.encode()].decode()
+    except (OSError, KeyError, ValueError, TypeError, ImportError):
+        return None
+
+WRITERS = {"npz": write_npz,
+           "hdf5": write_hdf5,
+           "parquet": write_parquet,
+           }
+
+
+
+
+
+def convert_file(filename, technique, output_format="npz", output_dir=None, field_results=None,
+                 encoding=eclab.DEFAULT_ENCODING, compress=False, overwrite=False, parse_workers=1):
+    """ Convert an EC-Lab file. The converted file is written under a temporary name
+    and renamed, so that an interrupted conversion leaves no partial file. A large
+    file is converted by parse_workers processes (see import_file).
+    Return the path of the converted file, or None if it was already up to date: newer
+    than the EC-Lab file and converted with the same settings.
+    """
+    output = output_path(filename, output_dir, output_format)
+    settings = conversion_settings(technique, field_results, encoding, compress)
+    if (not overwrite and os.path.exists(output)
+            and os.path.getmtime(output) >= os.path.getmtime(filename)
+            and read_settings(output, output_format) == settings):
+        return None
+
+    try:
+        datasets = eclab.import_file(filename, technique, field_results, encoding, parse_workers)
+    finally:
+        # A worker converts many files: do not keep them in memory.
+        eclab.parse_cache.clear()
+        eclab.row_index_cache.clear()
+
+    root, extension = os.path.splitext(output)
+    temporary = root + ".tmp" + extension
+    try:
+        WRITERS[output_format](temporary, datasets, settings, compress)
+        os.replace(temporary, output)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return output
+
+
+
+def convert_file_task(filename, *args):
+    """ Convert a file in a worker: errors are returned with the file rather than
+    stopping the other conversions.
+    """
+    try:
+        return filename, convert_file(filename, *args), None
+    except Exception as error:
+        return filename, None, "%s: %s" % (type(error).__name__, error)
+
+
+
+def convert_files(files, technique, output_format="npz", output_dir=None, field_results=None,
+                  encoding=eclab.DEFAULT_ENCODING, compress=False, overwrite=False, max_workers=None,
+                  parse_workers=1):
+    """ Convert many EC-Lab files in parallel, one file per process.
+    Yield (filename, converted file or None if up to date, error or None), in the
+    order the conversions finish. Of several files converted to the same file
+    (run.mpt and run.mpt.gz for instance), only the first one is converted.
+    """
+    from concurrent.futures import as_completed
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    arguments = (technique, output_format, output_dir, field_results, encoding, compress, overwrite, parse_workers)
+
+    outputs = {}
+    for filename in files:
+        output = output_path(filename, output_dir, output_format)
+        if output in outputs:
+            yield filename, None, "ValueError: converted to the same file as " + outputs[output]
+        else:
+            outputs[output] = filename
+    files = list(outputs.values())
+
+    if max_workers == 1 or len(files) <= 1:
+        for filename in files:
+            yield convert_file_task(filename, *arguments)
+        return
+
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(convert_file_task, filename, *arguments) for filename in files]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert EC-Lab files to .npz, HDF5 or Parquet files.")
+    parser.add_argument("technique", choices=sorted(eclab.IMPORT_PLUGINS),
+                        help="technique of the files, or auto to detect it from each file")
+    parser.add_argument("files", nargs="+", help="EC-Lab files or glob patterns")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="npz")
+    parser.add_argument("--output-dir", help="folder of the converted files (default: folder of each file)")
+    parser.add_argument("--field", action="append", default=[], metavar="NAME=VALUE",
+                        help="field of the import plugin, as in the import dialog (repeatable)")
+    parser.add_argument("--encoding", default=eclab.DEFAULT_ENCODING)
+    parser.add_argument("--compress", action="store_true", help="compress the .npz and HDF5 files, zstd for Parquet")
+    parser.add_argument("--overwrite", action="store_true", help="also convert the files already converted with the same settings")
+    parser.add_argument("--workers", type=int, default=0, help="parallel conversions (0: one per core)")
+    parser.add_argument("--parse-workers", type=int, default=1,
+                        help="processes converting each large file (0: one per core), for a few large files")
+    args = parser.parse_args()
+
+    try:
+        field_results = parse_fields(args.technique, args.field)
+    except ValueError as error:
+        parser.error(str(error))
+
+    files = []
+    for pattern in args.files:
+        files.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+
+    nb_failed = 0
+    for filename, output, error in convert_files(files, args.technique, args.format, args.output_dir,
+                                                 field_results, args.encoding, args.compress, args.overwrite,
+                                                 args.workers or None, args.parse_workers):
+        if error is not None:
+            nb_failed += 1
+            print("FAILED   %s  %s" % (filename, error), file=sys.stderr)
+        elif output is None:
+            print("up to date  %s" % filename)
+        else:
+            print("converted  %s -> %s" % (filename, output))
+
+    print("%d files, %d failed" % (len(files), nb_failed))
+    return 1 if nb_failed > 0 else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# ##### BEGIN GPL LICENCE BLOCK #####
+#  Copyright (C) 2022-2023  Arthur Langlard
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENCE BLOCK #####
+
+
+# Tests of the readers which avoid parsing a whole text file again: the incremental
+# import, the parse cache, the binary sidecar cache, the time window and the row
+# selections. Each import is compared with the plain import of a file holding only
+# the expected rows.
+#
+# Usage: python -m pytest tests
+
+
+
+import importlib.util
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_FILE = os.path.join(os.path.dirname(TESTS_DIR), "ImportEC-LAB.py")
+SOURCE_FILE = os.path.join(TESTS_DIR, "data", "GC_comma.mpt")
+
+
+
+
+
+def load_plugin():
+    """ Import the plugin file as a module, without Veusz.
+    """
+    if "ImportEC_LAB" in sys.modules:
+        return sys.modules["ImportEC_LAB"]
+    spec = importlib.util.spec_from_file_location("ImportEC_LAB", PLUGIN_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["ImportEC_LAB"] = module
+    spec.loader.exec_module(module)
+    return module
+
+eclab = load_plugin()
+
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    eclab.parse_cache.clear()
+    eclab.row_index_cache.clear()
+    yield
+    eclab.parse_cache.clear()
+    eclab.row_index_cache.clear()
+
+
+
+def source_lines():
+    """ The header lines and the data rows of the source file, with their line ends.
+    """
+    with open(SOURCE_FILE, encoding="latin-1", newline='') as f:
+        lines = f.readlines()
+    nb_header_lines = int(lines[1].split(':')[1])
+    return lines[:nb_header_lines], lines[nb_header_lines:]
+
+
+
+def write_file(filename, text):
+    """ Write the text of an EC-Lab file. The modification time is set past that of
+    the previous version of the file, which the caches would otherwise not tell apart
+    on file systems with a coarse time resolution.
+    """
+    mtime_ns = os.stat(filename).st_mtime_ns if os.path.exists(filename) else 0
+    with open(filename, 'w', encoding="latin-1", newline='') as f:
+        f.write(text)
+    os.utime(filename, ns=(mtime_ns + 10**9, mtime_ns + 10**9))
+
+
+
+def import_gc(filename, **field_results):
+    return eclab.import_file(str(filename), "GC", field_results)
+
+
+
+def expected_import(tmp_path, rows, **field_results):
+    """ Plain import of a new file holding the rows, without any cache.
+    """
+    header, _ = source_lines()
+    filename = tmp_path / ("expected_%d.mpt" % len(list(tmp_path.glob("expected_*.mpt"))))
+    write_file(filename, ''.join(header + rows))
+    return import_gc(filename, **field_results)
+
+
+
+def assert_same_import(datasets, expected):
+    assert list(datasets) == list(expected)
+    for name in expected:
+        np.testing.assert_array_equal(datasets[name], expected[name], err_msg=name)
+
+
+
+
+
+def test_incremental_partial_last_line(tmp_path):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+
+    # EC-Lab is writing row 20.
+    write_file(filename, ''.join(header + rows[:20]) + rows[20][:len(rows[20]) // 2])
+    assert_same_import(import_gc(filename, incremental=True), expected_import(tmp_path, rows[:20]))
+
+    write_file(filename, ''.join(header + rows[:30]))
+    assert_same_import(import_gc(filename, incremental=True), expected_import(tmp_path, rows[:30]))
+
+    write_file(filename, ''.join(header + rows))
+    assert_same_import(import_gc(filename, incremental=True), expected_import(tmp_path, rows))
+
+
+
+def test_incremental_without_last_end_of_line(tmp_path):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+
+    # The last row is finished, but its end of line is not written yet, or ever.
+    write_file(filename, ''.join(header + rows[:30]).rstrip('\r\n'))
+    assert_same_import(import_gc(filename, incremental=True), expected_import(tmp_path, rows[:30]))
+
+    write_file(filename, ''.join(header + rows).rstrip('\r\n'))
+    assert_same_import(import_gc(filename, incremental=True), expected_import(tmp_path, rows))
+
+    write_file(filename, ''.join(header + rows))
+    assert_same_import(import_gc(filename, incremental=True), expected_import(tmp_path, rows))
+
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_rewritten_file(tmp_path, incremental):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+
+    write_file(filename, ''.join(header + rows))
+    assert_same_import(import_gc(filename, incremental=incremental), expected_import(tmp_path, rows))
+
+    # Truncated, then rewritten with other rows, under the cached entry of the file.
+    write_file(filename, ''.join(header + rows[:25]))
+    assert_same_import(import_gc(filename, incremental=incremental), expected_import(tmp_path, rows[:25]))
+
+    write_file(filename, ''.join(header + rows[10:]))
+    assert_same_import(import_gc(filename, incremental=incremental), expected_import(tmp_path, rows[10:]))
+
+
+
+def test_stale_sidecar(tmp_path):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+    data_path, header_path = eclab.sidecar_paths(str(filename))[0]
+
+    write_file(filename, ''.join(header + rows[:25]))
+    import_gc(filename, disk_cache=True)
+    assert os.path.exists(data_path) and os.path.exists(header_path)
+
+    eclab.parse_cache.clear()
+    write_file(filename, ''.join(header + rows))
+    assert_same_import(import_gc(filename, disk_cache=True), expected_import(tmp_path, rows))
+
+    # Rewritten with the same size and modification time: only the hash of the file changed.
+    mtime_ns = os.stat(filename).st_mtime_ns
+    swapped_rows = rows[:-2] + [rows[-1], rows[-2]]
+    write_file(filename, ''.join(header + swapped_rows))
+    os.utime(filename, ns=(mtime_ns, mtime_ns))
+    eclab.parse_cache.clear()
+    assert_same_import(import_gc(filename, disk_cache=True), expected_import(tmp_path, swapped_rows))
+
+
+
+def test_foreign_sidecar(tmp_path):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+    other_filename = tmp_path / "other.mpt"
+
+    write_file(other_filename, ''.join(header + rows[10:]))
+    import_gc(other_filename, disk_cache=True)
+    write_file(filename, ''.join(header + rows))
+
+    for (data_path, header_path), (other_data_path, other_header_path) in zip(
+            eclab.sidecar_paths(str(filename)), eclab.sidecar_paths(str(other_filename))):
+        if os.path.exists(other_header_path):
+            os.replace(other_data_path, data_path)
+            os.replace(other_header_path, header_path)
+
+    eclab.parse_cache.clear()
+    assert_same_import(import_gc(filename, disk_cache=True), expected_import(tmp_path, rows))
+
+
+
+@pytest.mark.parametrize("key, value", [("version", eclab.SIDECAR_VERSION - 1),
+                                        ("descriptor", "CA"),
+                                        ("encoding", "utf-8"),
+                                        ("compact", [False, True]),
+                                        ])
+def test_sidecar_of_other_import(tmp_path, key, value):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+    data_path, header_path = eclab.sidecar_paths(str(filename))[0]
+
+    write_file(filename, ''.join(header + rows))
+    expected = import_gc(filename, disk_cache=True)
+
+    # A sidecar of the same file, with other data, written by another import.
+    with open(header_path, encoding="utf-8") as f:
+        sidecar_header = json.load(f)
+    sidecar_header[key] = value
+    with open(header_path, 'w', encoding="utf-8") as f:
+        json.dump(sidecar_header, f)
+    data_Np = np.load(data_path)
+    np.save(data_path, np.zeros_like(data_Np))
+
+    eclab.parse_cache.clear()
+    assert_same_import(import_gc(filename, disk_cache=True), expected)
+
+
+
+
+
+@pytest.mark.parametrize("single_precision", [False, True])
+@pytest.mark.parametrize("cached", [False, True])
+def test_window_edges_on_rows(tmp_path, single_precision, cached):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+    write_file(filename, ''.join(header + rows))
+
+    time = import_gc(filename)["time/s"]
+    eclab.parse_cache.clear()
+    if cached:
+        import_gc(filename, single_precision=single_precision)
+
+    # The window starts and stops exactly on the time of rows, which are both imported.
+    datasets = import_gc(filename, time_window=True, time_start=float(time[5]), time_stop=float(time[15]), time_unit="s",
+                         single_precision=single_precision)
+    expected = expected_import(tmp_path, rows[5:16], single_precision=single_precision)
+    # The error of the float32 columns is that of all the rows parsed, not only of the window.
+    datasets.pop("float32_relative_error", None)
+    expected.pop("float32_relative_error", None)
+    assert_same_import(datasets, expected)
+
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_selected_cycles(tmp_path, cached):
+    header, rows = source_lines()
+    filename = tmp_path / "run.mpt"
+    write_file(filename, ''.join(header + rows))
+
+    cycle_numbers = import_gc(filename)["cycle number"]
+    eclab.parse_cache.clear()
+    if cached:
+        import_gc(filename)
+
+    selected_rows = [row for row, cycle_number in zip(rows, cycle_numbers) if cycle_number == 1]
+    assert 0 < len(selected_rows) < len(rows)
+    assert_same_import(import_gc(filename, cycles="1"), expected_import(tmp_path, selected_rows))
@@ -0,0 +1,228 @@
+# ##### BEGIN GPL LICENCE BLOCK #####
+#  Copyright (C) 2022-2023  Arthur Langlard
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENCE BLOCK #####
+
+
+# Tests of the reader of binary EC-Lab files (.mpr), on synthetic files of the three
+# versions of the data module and the two forms of module header.
+#
+# Usage: python -m pytest tests
+
+
+
+import importlib.util
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+
+PLUGIN_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ImportEC-LAB.py")
+
+DATA_OFFSETS = {0: 100, 2: 405, 3: 406}    # Start of the rows in the data module.
+
+NB_ROWS = 6
+
+
+
+
+
+def load_plugin():
+    """ Import the plugin file as a module, without Veusz.
+    """
+    if "ImportEC_LAB" in sys.modules:
+        return sys.modules["ImportEC_LAB"]
+    spec = importlib.util.spec_from_file_location("ImportEC_LAB", PLUGIN_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["ImportEC_LAB"] = module
+    spec.loader.exec_module(module)
+    return module
+
+eclab = load_plugin()
+
+
+
+def module_bytes(short_name, long_name, version, content, new_header=False):
+    """ A module of a .mpr file: its header, in the old or the new form, then its content.
+    """
+    names = short_name.encode('latin-1').ljust(10) + long_name.encode('latin-1').ljust(25)
+    date = b'01/01/23'
+    if new_header:
+        header = names + struct.pack('<IIII', 0xFFFFFFFF, len(content), version, 0) + date
+    else:
+        header = names + struct.pack('<II', len(content), version) + date
+    return b'MODULE' + header + content
+
+
+
+def write_mpr(filename, version, column_ids, records, new_header=False):
+    """ Write a .mpr file with a settings module and a data module holding records, a
+    structured array of the row layout of column_ids.
+    """
+    id_type = 'u1' if version == 0 else '<u2'
+    data = (struct.pack('<IB', len(records), len(column_ids))
+            + np.array(column_ids, dtype=id_type).tobytes())
+    data = data.ljust(DATA_OFFSETS[version], b'\0') + records.tobytes()
+
+    with open(filename, 'wb') as f:
+        f.write(eclab.MPR_MAGIC.ljust(eclab.MPR_HEADER_SIZE, b'\0'))
+        f.write(module_bytes("VMP Set", "VMP settings", 0, b'\0' * 64, new_header))
+        f.write(module_bytes("VMP data", "VMP data", version, data, new_header))
+
+
+
+def record_dtype(column_ids):
+    """ Row layout of column_ids: the flags in one byte, then the other columns.
+    """
+    fields = []
+    for column_id in column_ids:
+        if column_id in eclab.MPR_FLAGS:
+            if ('flags', 'u1') not in fields:
+                fields.append(('flags', 'u1'))
+        else:
+            fields.append(eclab.MPR_COLUMNS[column_id])
+    return np.dtype(fields)
+
+
+
+# CV: flags mode, ox/red and error, time, Ewe, <I>, (Q-Qo)/mA.h and cycle number.
+CV_COLUMN_IDS = [1, 2, 3, 4, 6, 11, 13, 24]
+
+# GC: flags mode and ox/red, time, Ewe, <I>, Q charge/discharge, half cycle and cycle number.
+GC_COLUMN_IDS = [1, 2, 4, 6, 11, 467, 468, 24]
+
+
+
+def cv_records():
+    records = np.zeros(NB_ROWS, dtype=record_dtype(CV_COLUMN_IDS))
+    mode = np.array([1, 2, 3, 1, 2, 3])
+    ox_red = np.array([0, 1, 0, 1, 0, 1])
+    error = np.array([0, 0, 1, 0, 0, 0])
+    records['flags'] = mode | (ox_red << 2) | (error << 3) | 0x40    # 0x40: bit of no column.
+    records['time/s'] = np.arange(NB_ROWS) * 0.5
+    records['Ewe/V'] = np.linspace(-0.5, 1.0, NB_ROWS)
+    records['<I>/mA'] = np.linspace(0.1, 0.6, NB_ROWS)
+    records['(Q-Qo)/mA.h'] = np.linspace(0.0, 1e-3, NB_ROWS)
+    records['cycle number'] = [1, 1, 1, 2, 2, 2]
+    return records, mode, ox_red, error
+
+
+
+def gc_records():
+    records = np.zeros(NB_ROWS, dtype=record_dtype(GC_COLUMN_IDS))
+    records['flags'] = 1 | (np.array([1, 1, 1, 0, 0, 0]) << 2)
+    records['time/s'] = np.arange(NB_ROWS) * 10.0
+    records['Ewe/V'] = [3.0, 3.5, 4.0, 4.0, 3.5, 3.0]
+    records['<I>/mA'] = [1.0, 1.0, 1.0, -1.0, -1.0, -1.0]
+    records['Q charge/discharge/mA.h'] = [0.0, 1e-3, 2e-3, 0.0, -1e-3, -2e-3]
+    records['half cycle'] = [0, 0, 0, 1, 1, 1]
+    records['cycle number'] = [1, 1, 1, 1, 1, 1]
+    return records
+
+
+
+def import_mpr(filename, technique, field_results=None):
+    eclab.parse_cache.clear()
+    return eclab.import_file(str(filename), technique, field_results)
+
+
+
+FORMATS = [(version, new_header) for version in (0, 2, 3) for new_header in (False, True)]
+
+# Column IDs above 255, as "Q charge/discharge", only exist from version 2.
+GC_FORMATS = [(version, new_header) for version, new_header in FORMATS if version > 0]
+
+
+
+
+
+@pytest.mark.parametrize("version, new_header", FORMATS)
+def test_columns(tmp_path, version, new_header):
+    records, mode, ox_red, error = cv_records()
+    filename = tmp_path / "cv.mpr"
+    write_mpr(filename, version, CV_COLUMN_IDS, records, new_header)
+
+    mpr_file = eclab.MPRFile(str(filename))
+    names, columns = mpr_file.columns()
+    assert names == ['mode', 'ox/red', 'error', 'time/s', 'Ewe/V', '<I>/mA', '(Q-Qo)/mA.h', 'cycle number']
+    assert np.array_equal(columns[0], mode)
+    assert np.array_equal(columns[1], ox_red)
+    assert np.array_equal(columns[2], error)
+    for name, column in zip(names[3:], columns[3:]):
+        assert np.array_equal(column, records[name])
+
+
+
+@pytest.mark.parametrize("version, new_header", GC_FORMATS)
+def test_table(tmp_path, version, new_header):
+    filename = tmp_path / "gc.mpr"
+    records = gc_records()
+    write_mpr(filename, version, GC_COLUMN_IDS, records, new_header)
+
+    names, data_Np = eclab.MPRFile(str(filename)).table()
+    assert names[-1] == "Capacity/mA.h"
+    assert data_Np.shape == (NB_ROWS, len(names))
+    assert np.allclose(data_Np[:, names.index("Capacity/mA.h")], np.abs(records['Q charge/discharge/mA.h']))
+    assert np.allclose(data_Np[:, names.index("Ewe/V")], records['Ewe/V'])
+
+
+
+@pytest.mark.parametrize("version, new_header", FORMATS)
+def test_cv_import(tmp_path, version, new_header):
+    records, _, _, _ = cv_records()
+    filename = tmp_path / "cv.mpr"
+    write_mpr(filename, version, CV_COLUMN_IDS, records, new_header)
+
+    datasets = import_mpr(filename, "CV", {"extract_cycles": True})
+    assert np.allclose(datasets["Ewe/V (1)"], records['Ewe/V'][:3])
+    assert np.allclose(datasets["Ewe/V (2)"], records['Ewe/V'][3:])
+    assert np.allclose(datasets["(Q-Qo)/C (2)"], records['(Q-Qo)/mA.h'][3:] * 3.6)
+    assert np.allclose(datasets["<I>_per_surf/mA/cm2 (1)"], records['<I>/mA'][:3])
+    assert "mode (1)" not in datasets
+
+
+
+@pytest.mark.parametrize("version, new_header", GC_FORMATS)
+def test_gc_import(tmp_path, version, new_header):
+    records = gc_records()
+    filename = tmp_path / "gc.mpr"
+    write_mpr(filename, version, GC_COLUMN_IDS, records, new_header)
+
+    datasets = import_mpr(filename, "GC", {"extract_steps": True})
+    assert np.allclose(datasets["Capacity/mA.h (0)"], [0.0, 1e-3, 2e-3])
+    assert np.allclose(datasets["Capacity_per_mass/mA.h/mg (1)"], [0.0, 1e-3, 2e-3])
+    assert np.allclose(datasets["time/s (1)"], [30.0, 40.0, 50.0])
+
+
+
+def test_missing_columns(tmp_path):
+    records, _, _, _ = cv_records()
+    filename = tmp_path / "cv.mpr"
+    write_mpr(filename, 2, CV_COLUMN_IDS, records)
+
+    with pytest.raises(ValueError, match="EC-LAB GC plugin: Capacity/mA.h"):
+        import_mpr(filename, "GC")
+
+
+
+def test_not_mpr(tmp_path):
+    filename = tmp_path / "empty.mpr"
+    filename.write_bytes(b"")
+    with pytest.raises(ValueError, match="Not a EC-LAB binary file"):
+        eclab.MPRFile(str(filename))
@@ -0,0 +1,201 @@
+# ##### BEGIN GPL LICENCE BLOCK #####
+#  Copyright (C) 2022-2023  Arthur Langlard
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENCE BLOCK #####
+
+
+# Regression tests of the text import: the datasets of doImport are compared with those
+# of the first version of the plugin, which converted the data part row by row. Its
+# datasets are frozen in tests/data, for files with decimal commas, decimal points and
+# CRLF line ends.
+#
+# Usage: python -m pytest tests
+#
+# The files of tests/data are written by running this file on the first version:
+#     git show b59aa04:ImportEC-LAB.py > /tmp/ImportEC-LAB-first.py
+#     python tests/test_parser.py /tmp/ImportEC-LAB-first.py
+
+
+
+import importlib.util
+import os
+import sys
+
+import numpy as np
+import pytest
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(TESTS_DIR, "data")
+PLUGIN_FILE = os.path.join(os.path.dirname(TESTS_DIR), "ImportEC-LAB.py")
+
+PLUGIN_NAMES = {"CV": "ImportECLAB_CV",
+                "GC": "ImportECLAB_GC",
+                "CA": "ImportECLAB_CA",
+                }
+
+# Decimal separator and line end of the files of each variant.
+VARIANTS = {"comma": (',', '\n'),
+            "point": ('.', '\n'),
+            "crlf": (',', '\r\n'),
+            }
+
+# Fields of the imports compared, by technique. The other fields keep their defaults.
+FIELD_SETS = {"CV": {"default": {},
+                     "all_data": {"import_all_data": True},
+                     "cycles": {"extract_cycles": True},
+                     },
+              "GC": {"default": {},
+                     "all_data": {"import_all_data": True},
+                     "cycles": {"extract_cycles": True},
+                     "steps": {"extract_steps": True, "extract_cycles": True},
+                     },
+              "CA": {"default": {},
+                     "all_data": {"import_all_data": True},
+                     "cycles": {"extract_cycles": True},
+                     "steps": {"extract_steps": True, "extract_cycles": True},
+                     },
+              }
+
+NB_ROWS = 40
+NB_CYCLES = 2
+
+
+
+
+
+def load_plugin():
+    """ Import the plugin file as a module, without Veusz.
+    """
+    if "ImportEC_LAB" in sys.modules:
+        return sys.modules["ImportEC_LAB"]
+    spec = importlib.util.spec_from_file_location("ImportEC_LAB", PLUGIN_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["ImportEC_LAB"] = module
+    spec.loader.exec_module(module)
+    return module
+
+eclab = load_plugin()
+
+
+
+def data_file(technique, variant):
+    return os.path.join(DATA_DIR, "%s_%s.mpt" % (technique, variant))
+
+
+
+def expected_file(technique, variant):
+    return os.path.join(DATA_DIR, "%s_%s_expected.npz" % (technique, variant))
+
+
+
+def dataset_key(field_set, index, name):
+    """ Key of a dataset in the .npz files: its position is kept, as the order of the
+    datasets is part of what is compared.
+    """
+    return "%s %03d %s" % (field_set, index, name)
+
+
+
+def imported_datasets(plugin, params):
+    return [(dataset.name, np.atleast_1d(np.asarray(dataset.data, dtype=float)))
+            for dataset in plugin.doImport(params)]
+
+
+
+
+
+@pytest.mark.parametrize("technique", sorted(PLUGIN_NAMES))
+@pytest.mark.parametrize("variant", sorted(VARIANTS))
+def test_same_datasets_as_row_by_row_parser(technique, variant):
+    with np.load(expected_file(technique, variant)) as expected:
+        expected = dict(expected)
+
+    for field_set, field_results in FIELD_SETS[technique].items():
+        eclab.parse_cache.clear()
+        plugin = getattr(eclab, PLUGIN_NAMES[technique])()
+        params = eclab.ImportParams(data_file(technique, variant), "latin-1",
+                                    eclab.plugin_field_results(plugin, field_results))
+        datasets = imported_datasets(plugin, params)
+
+        keys = sorted(key for key in expected if key.startswith(field_set + " "))
+        assert [dataset_key(field_set, index, name) for index, (name, _) in enumerate(datasets)] == keys
+        for key, (_, data) in zip(keys, datasets):
+            np.testing.assert_array_equal(data, expected[key], err_msg=key)
+
+
+
+def test_crlf_same_as_lf():
+    for technique in PLUGIN_NAMES:
+        with np.load(expected_file(technique, "comma")) as lf, np.load(expected_file(technique, "crlf")) as crlf:
+            assert sorted(lf.files) == sorted(crlf.files)
+            for key in lf.files:
+                np.testing.assert_array_equal(lf[key], crlf[key])
+
+
+
+def header_lines(technique):
+    with open(data_file(technique, "comma"), encoding="latin-1") as f:
+        lines = f.readlines()
+    return lines[:int(lines[1].split(':')[1]) - 1]
+
+
+
+def test_sequence_values():
+    lines = [line.replace("-1,000    ", "C/10      ") if line.startswith("Is ") else line
+             for line in header_lines("GC")]
+    header_infos = eclab.ImportECLAB_GC.HeaderInfo(lines).m_header_infos
+    np.testing.assert_array_equal(header_infos["currents"], [1.0, np.nan])
+    assert header_infos["currents_units"] == ["mA", "mA"]
+    assert header_infos["threshold_voltages"] == [4.2, 2.5]
+
+    header_infos = eclab.ImportECLAB_CA.HeaderInfo(header_lines("CA")).m_header_infos
+    assert header_infos["potential"] == [0.5, 0.0]
+
+
+
+
+
+
+def write_expected(first_plugin_file):
+    """ Write the data files and the datasets imported from them by first_plugin_file.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), "benchmarks"))
+    import bench_eclab
+    import generate_eclab
+
+    module = bench_eclab.load_plugin_module(first_plugin_file)
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    for technique in PLUGIN_NAMES:
+        for variant, (decimal_separator, newline) in VARIANTS.items():
+            generate_eclab.generate(data_file(technique, variant), technique, NB_ROWS, NB_CYCLES,
+                                    decimal_separator, newline)
+
+            arrays = {}
+            for field_set, field_results in FIELD_SETS[technique].items():
+                plugin = module[PLUGIN_NAMES[technique]]()
+                fields = dict((field.name, field.default) for field in plugin.fields)
+                fields.update(field_results)
+                params = bench_eclab.ImportParams(data_file(technique, variant), "latin-1", fields)
+                for index, (name, data) in enumerate(imported_datasets(plugin, params)):
+                    arrays[dataset_key(field_set, index, name)] = data
+            np.savez_compressed(expected_file(technique, variant), **arrays)
+
+
+
+if __name__ == "__main__":
+    write_expected(sys.argv[1])